@@ -3,11 +3,17 @@
 import os, sys, warnings
 
 from . import utils
-from .utils import clean_up, device_parameters, general, parallel_sim, utils
+from .utils import async_sim, clean_up, device_parameters, distributed, general, job_ledger, parallel_sim, results, runtime_history, sim_cache, utils
+from .utils.async_sim import *
 from .utils.clean_up import *
 from .utils.device_parameters import *
+from .utils.distributed import *
 from .utils.general import *
+from .utils.job_ledger import *
 from .utils.parallel_sim import *
+from .utils.results import *
+from .utils.runtime_history import *
+from .utils.sim_cache import *
 from .utils.utils import *
 
 from . import plots
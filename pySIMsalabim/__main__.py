@@ -0,0 +1,34 @@
+"""Command line interface of pySIMsalabim, e.g. to start a worker daemon: pySIMsalabim worker --listen 0.0.0.0:5555 --exe-dir SIMsalabim/SimSS"""
+######### Package Imports #########################################################################
+
+import argparse
+from pySIMsalabim.utils.general import get_default_max_jobs
+from pySIMsalabim.utils.distributed import run_worker, parse_address
+
+######### Function Definitions ####################################################################
+
+def main(argv = None):
+    """Parse the command line arguments and run the chosen command.
+
+    Parameters
+    ----------
+    argv : List, optional
+        Command line arguments, by default None (sys.argv)
+    """
+    parser = argparse.ArgumentParser(prog = 'pySIMsalabim', description = 'pySIMsalabim command line interface')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    worker_parser = subparsers.add_parser('worker', help = 'Run a worker daemon that runs simulations for a coordinator, see run_simulation_distributed')
+    worker_parser.add_argument('--listen', default = '127.0.0.1:5555', help = 'host:port to listen on, by default 127.0.0.1:5555')
+    worker_parser.add_argument('--exe-dir', default = '.', help = 'folder with the simss and/or zimt executable, by default the current folder')
+    worker_parser.add_argument('--work-dir', default = None, help = 'folder for the file store and the job folders, by default a new temporary folder')
+    worker_parser.add_argument('--slots', type = int, default = get_default_max_jobs(), help = 'number of simulations to run at the same time, by default the number of usable CPUs - 1')
+    worker_parser.add_argument('--token', default = None, help = 'shared secret the coordinator must send, by default none')
+
+    args = parser.parse_args(argv)
+    if args.command == 'worker':
+        host, port = parse_address(args.listen)
+        run_worker(host, port, args.exe_dir, args.work_dir, args.slots, args.token)
+
+if __name__ == '__main__':
+    main()
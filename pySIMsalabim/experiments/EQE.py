@@ -118,7 +118,7 @@ def calc_EQE(Jext,Jext_err,J0_single, J0_err_single, lambda_array,p):
 
     return deltaJ, deltaJerr, I_diff, EQE_val, EQE_err
 
-def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_max, lambda_step, Vext, output_file = 'EQE.dat', JV_file_name = 'JV.dat', varFile = 'none',remove_dirs = True, parallel = False, max_jobs = max(1,os.cpu_count()-1), run_mode = True, **kwargs):
+def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_max, lambda_step, Vext, output_file = 'EQE.dat', JV_file_name = 'JV.dat', varFile = 'none',remove_dirs = True, parallel = False, max_jobs = utils_gen.get_default_max_jobs(), run_mode = True, **kwargs):
     """Run the EQE calculation for a given spectrum and external voltage, and save the results in a file.
 
     Parameters
@@ -148,11 +148,13 @@ def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_
     parallel : bool, optional
         Run the simulations in parallel, by default False
     max_jobs : int, optional
-        Maximum number of parallel jobs, by default max(1,os.cpu_count()-1)
+        Maximum number of parallel jobs, by default the number of usable CPUs - 1, see get_default_max_jobs
     run_mode : bool, optional
         indicate whether the script is in 'web' mode (True) or standalone mode (False). Used to control the console output, by default True
     **kwargs : dict
-        Additional arguments to be passed to the function.
+        Additional arguments to be passed to the function:
+        hooks : dict, functions called when the simulations start, finish or fail, see call_hook, by default None
+        retry_ladder : bool, List or RetryLadder, rescue the simulations that fail to converge with the rungs of a retry ladder, see RetryLadder, by default None (no retries)
 
     Returns
     -------
@@ -160,6 +162,8 @@ def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_
         0 if the function runs successfully.
     """
     verbose = kwargs.get('verbose', False) # Check if the user wants to print messages to the console
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = utils_gen.get_retry_ladder(kwargs)
     UUID = kwargs.get('UUID', '') # Check if the user wants to add a UUID to the JV file name
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters to the simulation
     force_multithreading = kwargs.get('force_multithreading', False) # Check if the user wants to force multithreading instead of using GNU parallel 
@@ -236,9 +240,9 @@ def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_
         EQE_args = update_cmd_pars(EQE_args, cmd_pars)
     
     if threadsafe:
-        result, message = utils_gen.run_simulation_filesafe('simss', EQE_args, session_path, run_mode,verbose=verbose)
+        result, message = utils_gen.run_simulation_filesafe('simss', EQE_args, session_path, run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
     else:
-        result, message = utils_gen.run_simulation('simss', EQE_args, session_path, run_mode,verbose=verbose)
+        result, message = utils_gen.run_simulation('simss', EQE_args, session_path, run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
     # result, message = run_sim_EQE(simss_device_parameters, session_path, spectrum, Vext, JV_file_name, run_mode)
     
     # If the simulation fails, stop running the script and exit
@@ -285,7 +289,7 @@ def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_
                 dum_args = update_cmd_pars(dum_args, cmd_pars)
             EQE_args_list.append(dum_args)
         
-        results = run_simulation_parallel('simss', EQE_args_list, session_path, max_jobs, force_multithreading=force_multithreading,verbose=verbose)
+        results = run_simulation_parallel('simss', EQE_args_list, session_path, max_jobs, force_multithreading=force_multithreading,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         
         for i in lambda_array:
             JV_file_name_single = f'{JV_file_name_base}{dum_str}_{int(i*1e9)}nm{JV_file_name_ext}'
@@ -323,9 +327,9 @@ def run_EQE(simss_device_parameters, session_path, spectrum, lambda_min, lambda_
                 EQE_args = update_cmd_pars(EQE_args, cmd_pars)
 
             if threadsafe:
-                result, message = utils_gen.run_simulation_filesafe('simss', EQE_args, session_path, run_mode,verbose=verbose)
+                result, message = utils_gen.run_simulation_filesafe('simss', EQE_args, session_path, run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
             else:
-                result, message = utils_gen.run_simulation('simss', EQE_args, session_path, run_mode,verbose=verbose)
+                result, message = utils_gen.run_simulation('simss', EQE_args, session_path, run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
 
             if not result == 0:
                 msg_list.append(message)
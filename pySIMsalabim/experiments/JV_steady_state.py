@@ -18,10 +18,262 @@ except ImportError:
 from pySIMsalabim.utils import general as utils_gen
 from pySIMsalabim.utils.parallel_sim import *
 from pySIMsalabim.utils.utils import update_cmd_pars
+from pySIMsalabim.utils.device_parameters import ReadParameterFile
+from pySIMsalabim.experiments.JV_sweep import build_tVG_arrays_log
+
+######### Constants ###############################################################################
+
+# SimSS parameters that define the JV sweep or its output and are therefore not passed to ZimT by the zimt engine
+SIMSS_JV_PARS = ['Vdist', 'preCond', 'Vpre', 'fixIons', 'Vscan', 'Vmin', 'Vmax', 'Vstep', 'Vacc', 'NJV', 'untilVoc', 'G_frac', 'JVFile', 'scParsFile', 'varFile', 'outputRatio']
+# SimSS parameters that are encoded in the tVG file or the file names by the zimt engine, the others in SIMSS_JV_PARS are ignored
+SIMSS_JV_VOLTAGE_PARS = ['Vdist', 'Vscan', 'Vmin', 'Vmax', 'Vstep', 'Vacc', 'NJV', 'JVFile', 'varFile']
 
 ######### Functions #################################################################################
 
-def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', varFile = 'none', G_fracs = [], parallel = False, max_jobs = max(1,os.cpu_count()-1), run_mode = True, **kwargs):
+def read_SS_JV_parameters(simss_device_parameters, session_path, cmd_pars = None):
+    """Read the parameters of the simss device parameters file, overwritten by the cmd_pars.
+
+    Parameters
+    ----------
+    simss_device_parameters : string
+        Name of the simss device parameters file.
+    session_path : string
+        Path to the session folder where the simulation will run.
+    cmd_pars : List, optional
+        List with the command line parameters that overwrite the parameters in the file, by default None
+
+    Returns
+    -------
+    dict
+        Value of each parameter by name
+    """
+    dev_par = ReadParameterFile(os.path.join(session_path, simss_device_parameters))
+    if cmd_pars is not None:
+        for par in cmd_pars:
+            dev_par[par['par']] = par['val']
+    return dev_par
+
+def get_SS_JV_voltages(simss_device_parameters, session_path, cmd_pars = None):
+    """Get the voltages SimSS would simulate, based on the JV parameters (Vdist, Vscan, Vmin, Vmax, Vstep, Vacc and NJV) in the simss device parameters file and the cmd_pars.
+
+    Parameters
+    ----------
+    simss_device_parameters : string
+        Name of the simss device parameters file.
+    session_path : string
+        Path to the session folder where the simulation will run.
+    cmd_pars : List, optional
+        List with the command line parameters that overwrite the parameters in the file, by default None
+
+    Returns
+    -------
+    np.array
+        Array of voltages in the order they are simulated
+    """
+    dev_par = read_SS_JV_parameters(simss_device_parameters, session_path, cmd_pars)
+
+    Vmin, Vmax = float(dev_par['Vmin']), float(dev_par['Vmax'])
+    Vscan = int(dev_par.get('Vscan', 1))
+    if int(dev_par.get('Vdist', 1)) == 2:
+        # Logarithmic distribution, same as SimSS
+        _, V, _ = build_tVG_arrays_log(Vmin, Vmax, float(dev_par['Vacc']), 1, 1, int(dev_par['NJV']), 0, stabilized=True)
+    else:
+        # Uniform distribution with steps Vstep starting at Vmin
+        Vstep = float(dev_par['Vstep'])
+        V = Vmin + Vstep*np.arange(int(np.floor((Vmax - Vmin)/Vstep + 1e-10)) + 1)
+    if Vscan == -1:
+        V = V[::-1]
+
+    return np.asarray(V)
+
+def create_tVG_SS_JV(V, G_fracs, tVG_name, session_path):
+    """Create a tVG file with a steady-state point (t = 0) for every combination of G_frac and voltage. The voltages are swept for each G_frac in turn.
+
+    Parameters
+    ----------
+    V : np.array
+        Array of voltages
+    G_fracs : List
+        List of fractional generation rates
+    tVG_name : string
+        Name of the tVG file
+    session_path : string
+        Path of the simulation folder for this session
+
+    Returns
+    -------
+    int
+        0 if the tVG file is created
+    string
+        A message to indicate the result of the process
+    """
+    G = np.repeat(np.asarray(G_fracs, dtype = float), len(V))
+    tVG = pd.DataFrame({'t': np.zeros(len(G)), 'Vext': np.tile(V, len(G_fracs)), 'G_frac': G})
+    tVG.to_csv(os.path.join(session_path, tVG_name), sep=' ', index=False, float_format='%.5e')
+
+    return 0, 'Success'
+
+def split_tj_SS_JV(tj_name, JV_file_names, n_V):
+    """Split the tj file of a ZimT steady-state G_frac sweep, see create_tVG_SS_JV, into one JV file per G_frac. The JV files have the columns of the tj file, without the time.
+
+    Parameters
+    ----------
+    tj_name : string
+        Path to the tj file
+    JV_file_names : List
+        List with the paths of the JV files, one per G_frac
+    n_V : int
+        Number of voltages per G_frac
+
+    Returns
+    -------
+    int
+        0 if the JV files are written, 1 if the tj file does not match the tVG file
+    string
+        A message to indicate the result of the process
+    """
+    data = pd.read_csv(tj_name, sep=r'\s+')
+    if len(data) != n_V*len(JV_file_names):
+        return 1, f'The tj file {tj_name} has {len(data)} points instead of the expected {n_V*len(JV_file_names)}, could not split it into JV files.'
+
+    data = data.drop(columns = ['t'], errors = 'ignore')
+    for i, JV_file_name in enumerate(JV_file_names):
+        data.iloc[i*n_V:(i+1)*n_V].to_csv(JV_file_name, sep=' ', index=False, float_format='%.6e')
+
+    return 0, 'Success'
+
+def split_var_SS_JV(var_name, var_file_names, n_V):
+    """Split the var file of a ZimT steady-state G_frac sweep, see create_tVG_SS_JV, into one var file per G_frac, like the var files of one SimSS run per G_frac. 
+    Every point is written to the var file (outputRatio = 1), so each G_frac has the same number of rows. The var files have the columns of the ZimT var file, without the time.
+
+    Parameters
+    ----------
+    var_name : string
+        Path to the var file
+    var_file_names : List
+        List with the paths of the var files, one per G_frac
+    n_V : int
+        Number of voltages per G_frac
+
+    Returns
+    -------
+    int
+        0 if the var files are written, 1 if the var file does not match the tVG file
+    string
+        A message to indicate the result of the process
+    """
+    data = pd.read_csv(var_name, sep=r'\s+')
+    if len(data) == 0 or len(data) % (n_V*len(var_file_names)) != 0:
+        return 1, f'The var file {var_name} has {len(data)} rows, which is not a multiple of the {n_V*len(var_file_names)} points, could not split it into var files.'
+
+    n_rows = len(data)//len(var_file_names)
+    data = data.drop(columns = ['t'], errors = 'ignore')
+    for i, var_file_name in enumerate(var_file_names):
+        data.iloc[i*n_rows:(i+1)*n_rows].to_csv(var_file_name, sep=' ', index=False, float_format='%.6e')
+
+    return 0, 'Success'
+
+def run_SS_JV_zimt(simss_device_parameters, session_path, JV_file_names, G_fracs, zimt_device_parameters, zimt_session_path, dum_str = '', run_mode = True, **kwargs):
+    """Run the steady-state JV simulations for all G_fracs in one ZimT run instead of one SimSS run per G_frac. 
+    The voltages of the simss device parameters are encoded for each G_frac as steady-state points in one tVG file, so the inputs are read once and every point starts from the converged state of the previous point. 
+    The tj file is then split into one JV file per G_frac, the JV files have the columns of the tj file. No scPars files are written.
+    If var_file_names is given, the var file is split into one var file per G_frac in the same way, see split_var_SS_JV.
+    Preconditioning (preCond) and stopping at Voc (untilVoc) are not supported, the other SimSS parameters of SIMSS_JV_PARS in the cmd_pars are ignored with a warning.
+
+    Parameters
+    ----------
+    simss_device_parameters : string
+        Name of the simss device parameters file, used for the voltages.
+    session_path : string
+        Path to the SimSS session folder.
+    JV_file_names : List
+        List with the paths of the JV files, one per G_frac
+    G_fracs : List
+        List of fractional generation rates
+    zimt_device_parameters : string
+        Name of the zimt device parameters file.
+    zimt_session_path : string
+        Path to the ZimT session folder with the zimt executable, where the simulation will run.
+    dum_str : str, optional
+        UUID string to add to the tVG, tj, var and log file names, by default ''
+    run_mode : bool, optional
+        indicate whether the script is in 'web' mode (True) or standalone mode (False). Used to control the console output, by default True
+    **kwargs : dict
+        Additional arguments: cmd_pars, threadsafe, turnoff_autoTidy, verbose, hooks and retry_ladder, see run_SS_JV, and 
+        var_file_names : List, paths of the var files, one per G_frac, by default None (no var files)
+
+    Returns
+    -------
+    int
+        Exitcode of the simulation.
+    str
+        Message from the simulation.
+
+    Raises
+    ------
+    ValueError
+        If preCond or untilVoc is 1, these are not supported by the zimt engine
+    """
+    verbose = kwargs.get('verbose', False)
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = kwargs.get('retry_ladder', None)
+    cmd_pars = kwargs.get('cmd_pars', None)
+    var_file_names = kwargs.get('var_file_names', None)
+    threadsafe = kwargs.get('threadsafe', False)
+    turnoff_autoTidy = kwargs.get('turnoff_autoTidy', False)
+
+    dev_par = read_SS_JV_parameters(simss_device_parameters, session_path, cmd_pars)
+    for par in ['preCond', 'untilVoc']:
+        if int(float(dev_par.get(par, 0))) == 1:
+            raise ValueError(par + ' = 1 is not supported by the zimt engine, run the JV simulations with the simss engine instead')
+    if cmd_pars is not None:
+        ignored = [par['par'] for par in cmd_pars if par['par'] in SIMSS_JV_PARS and par['par'] not in SIMSS_JV_VOLTAGE_PARS]
+        if len(ignored) > 0:
+            print('Warning: the SimSS parameters ' + ', '.join(ignored) + ' are ignored by the zimt engine.')
+
+    V = get_SS_JV_voltages(simss_device_parameters, session_path, cmd_pars)
+
+    tVG_name = os.path.join(zimt_session_path, 'tVG_Gfracs' + dum_str + '.txt')
+    tj_name = os.path.join(zimt_session_path, 'tj_Gfracs' + dum_str + '.dat')
+    var_name = os.path.join(zimt_session_path, 'var_Gfracs' + dum_str + '.dat') if var_file_names is not None else 'none'
+    create_tVG_SS_JV(V, G_fracs, tVG_name, zimt_session_path)
+
+    SS_JV_args = [{'par':'dev_par_file','val':zimt_device_parameters},
+                    {'par':'tVGFile','val':tVG_name},
+                    {'par':'tJFile','val':tj_name},
+                    {'par':'varFile','val':var_name},
+                    {'par':'logFile','val':os.path.join(zimt_session_path,'log_Gfracs'+dum_str+'.txt')}
+                    ]
+    if var_file_names is not None:
+        # Write every point, so the var file can be split per G_frac
+        SS_JV_args.append({'par':'outputRatio','val':'1'})
+    if turnoff_autoTidy:
+        SS_JV_args.append({'par':'autoTidy','val':'0'})
+
+    # Pass the cmd_pars that are not specific to the SimSS JV sweep, e.g. layer parameters
+    if cmd_pars is not None:
+        SS_JV_args = update_cmd_pars(SS_JV_args, [par for par in cmd_pars if par['par'] not in SIMSS_JV_PARS])
+
+    if threadsafe:
+        result, message = utils_gen.run_simulation_filesafe('zimt', SS_JV_args, zimt_session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
+    else:
+        result, message = utils_gen.run_simulation('zimt', SS_JV_args, zimt_session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
+
+    if result != 0 and result != 95:
+        return result, message
+
+    ret, msg = split_tj_SS_JV(tj_name, JV_file_names, len(V))
+    if ret != 0:
+        return ret, msg
+    if var_file_names is not None:
+        ret, msg = split_var_SS_JV(var_name, var_file_names, len(V))
+        if ret != 0:
+            return ret, msg
+    if result == 95:
+        return 0, 'All JV simulations completed successfully, but some had some points that did not converge'
+    return 0, 'All JV simulations completed successfully'
+
+def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', varFile = 'none', G_fracs = [], parallel = False, max_jobs = utils_gen.get_default_max_jobs(), run_mode = True, **kwargs):
     """
 
     Parameters
@@ -35,7 +287,7 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
     parallel : bool, optional
         Run the simulations in parallel, by default False
     max_jobs : int, optional
-        Maximum number of parallel jobs, by default max(1,os.cpu_count()-1)
+        Maximum number of parallel jobs, by default the number of usable CPUs - 1, see get_default_max_jobs
     cmd_pars : _type_, optional
         _description_, by default None
     UUID : str, optional
@@ -43,7 +295,9 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
     run_mode : bool, optional
         indicate whether the script is in 'web' mode (True) or standalone mode (False). Used to control the console output, by default True
     **kwargs : dict
-        Additional arguments to be passed to the function.
+        Additional arguments to be passed to the function:
+        hooks : dict, functions called when the simulations start, finish or fail, see call_hook, by default None
+        retry_ladder : bool, List or RetryLadder, rescue the simulations that fail to converge with the rungs of a retry ladder, see RetryLadder, by default None (no retries)
 
     Returns
     -------
@@ -54,10 +308,15 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
 
     """
     verbose = kwargs.get('verbose', False) # Check if the user wants to show verbose output in the console
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = utils_gen.get_retry_ladder(kwargs)
     UUID = kwargs.get('UUID', '') # Check if the user wants to add a UUID to the JV file name
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters to the 
     force_multithreading = kwargs.get('force_multithreading', False) # Check if the user wants to force multithreading instead of using GNU parallel
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters
+    engine = kwargs.get('engine', 'simss') # Run one SimSS simulation per G_frac ('simss') or all G_fracs in one ZimT simulation ('zimt'), see run_SS_JV_zimt
+    zimt_device_parameters = kwargs.get('zimt_device_parameters', None) # Name of the zimt device parameters file, required for the zimt engine
+    zimt_session_path = kwargs.get('zimt_session_path', None) # Path to the ZimT session folder with the zimt executable, required for the zimt engine
     # Check if the user wants to force the use of thread safe mode, necessary for Windows with parallel simulations
     if os.name == 'nt':  
         threadsafe = kwargs.get('threadsafe', True) # Check if the user wants to force the use of threads instead of processes
@@ -116,9 +375,9 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
 
         if threadsafe:
             # Run the simulation in thread safe mode
-            result, message = utils_gen.run_simulation_filesafe('simss', SS_JV_args, session_path, run_mode = run_mode,verbose=verbose)
+            result, message = utils_gen.run_simulation_filesafe('simss', SS_JV_args, session_path, run_mode = run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         else:
-            result, message = utils_gen.run_simulation('simss',SS_JV_args,session_path,run_mode = run_mode,verbose=verbose)
+            result, message = utils_gen.run_simulation('simss',SS_JV_args,session_path,run_mode = run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
 
         return result, message
 
@@ -131,6 +390,15 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
             varFile = var_file_base + dum_str + var_file_ext
             varFile = os.path.join(session_path,varFile)
 
+        if engine == 'zimt':
+            if zimt_device_parameters is None or zimt_session_path is None:
+                raise ValueError('zimt_device_parameters and zimt_session_path must be given to run the JV simulations with the zimt engine')
+            JV_file_names = [JV_file_name_base + f'_Gfrac_{G_frac}' + dum_str + JV_file_name_ext for G_frac in G_fracs]
+            # One var file per G_frac, with the same names as the simss engine
+            var_file_names = [os.path.join(session_path,var_file_base + f'_Gfrac_{G_frac}' + dum_str +var_file_ext) for G_frac in G_fracs] if varFile != 'none' else None
+            return run_SS_JV_zimt(simss_device_parameters, session_path, JV_file_names, G_fracs, zimt_device_parameters, zimt_session_path, dum_str, run_mode,
+                                  cmd_pars=cmd_pars, var_file_names=var_file_names, threadsafe=threadsafe, turnoff_autoTidy=turnoff_autoTidy, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
+
         # SS_JV_args = [{'par':'dev_par_file','val':simss_device_parameters}]
         SS_JV_args_list = []
         for G_frac in G_fracs:
@@ -153,37 +421,26 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
             SS_JV_args_list.append(dum_args)                             
                                        
         if parallel and len(G_fracs) > 1:
-            results = run_simulation_parallel('simss', SS_JV_args_list, session_path, max_jobs, force_multithreading=force_multithreading,verbose=verbose)
-            msg_list = ['' for i in range(len(results))]
+            results = run_simulation_parallel('simss', SS_JV_args_list, session_path, max_jobs, force_multithreading=force_multithreading,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         else:
-            results, msg_list = [], []
+            result_list = []
             for dum_args in SS_JV_args_list:
 
                 if threadsafe:
-                    result, message = utils_gen.run_simulation_filesafe('simss', dum_args, session_path, run_mode,verbose=verbose)
+                    result_list.append(utils_gen.run_simulation_filesafe('simss', dum_args, session_path, run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder))
                 else:
-                    result, message = utils_gen.run_simulation('simss', dum_args, session_path, run_mode,verbose=verbose)
-                
-                results.append(result)
-                msg_list.append(message)
-        
-        # check if results is a list of CompletedProcess objects
-        if isinstance(results, list) :
-            if len(results) > 0 and not isinstance(results[0], subprocess.CompletedProcess):
-                pass
-            else:    
-                if len(results) > 0 and isinstance(results[0], tuple) and all(isinstance(res[0], subprocess.CompletedProcess) for res in results):
-                    # Extract the return codes from the CompletedProcess objects
-                    results = [res[0].returncode for res in results]
+                    result_list.append(utils_gen.run_simulation('simss', dum_args, session_path, run_mode,verbose=verbose, hooks=hooks, retry_ladder=retry_ladder))
+            results = BatchResult.from_results(result_list, 'simss', SS_JV_args_list, session_path)
+        msg_list = [results.message(idx) for idx in range(len(results))]
         
         # Check if all simulations were successful
-        if all([res == 0 for res in results]):
+        if np.all(results.codes == 0):
             if verbose and not run_mode:
                 print('All JV simulations completed successfully\n')
                 # for mess in msg_list:
                 #     print(mess)
             return 0, 'All JV simulations completed successfully'
-        elif all([(res == 0 or res == 95) for res in results]):
+        elif np.all(results.succeeded):
             if verbose and not run_mode:
                 print('All JV simulations completed successfully, but some had some points that did not converge\n')
                 for mess in msg_list:
@@ -195,11 +452,9 @@ def run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', va
                 for i, res in enumerate(results):
                     print(f'Simulation {i+1} failed with return code {res}')
 
-            # get all results that are not 0
-            failed_results = [res for i, res in enumerate(results) if res != 0 and res != 95]
+            # get the unique return codes of the simulations that failed
+            failed_results = np.unique(results.filter(failed = True).codes).tolist()
             # If there is only one failed result, return it with the error message
-            # get only unique values in failed_results
-            failed_results = list(set(failed_results))
             if len(failed_results) == 1:
                 return failed_results[0], utils_gen.error_message(failed_results[0])
             else:
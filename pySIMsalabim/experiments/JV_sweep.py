@@ -402,6 +402,10 @@ def JV_sweep(zimt_device_parameters, session_path, UseExpData, scan_speed=None,
         Either 'lin' or 'log' to specify how the rms error is calculated
     stabilized : bool, optional
         If True, perform a stabilized JV sweep i.e. steady-state. Default is False.
+    **kwargs : dict
+        Additional keyword arguments:
+        hooks : dict, functions called when the simulations start, finish or fail, see call_hook, by default None
+        retry_ladder : bool, List or RetryLadder, rescue the simulations that fail to converge with the rungs of a retry ladder, see RetryLadder, by default None (no retries)
 
     Returns
     -------
@@ -413,6 +417,8 @@ def JV_sweep(zimt_device_parameters, session_path, UseExpData, scan_speed=None,
         Dictionary containing the special output values of the simulation. In this case, the rms error ('rms').
     """
     verbose = kwargs.get('verbose', False) # Check if the user wants to see the console output
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = utils_gen.get_retry_ladder(kwargs)
     UUID = kwargs.get('UUID', '') # Check if the user wants to add a UUID to the tj file name
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters
     Vdist = kwargs.get('Vdist', 1) # Voltage distribution type (1: linear, 2: exponential)
@@ -491,9 +497,9 @@ def JV_sweep(zimt_device_parameters, session_path, UseExpData, scan_speed=None,
             JV_sweep_args = update_cmd_pars(JV_sweep_args, cmd_pars)
 
         if threadsafe:
-            result, message = utils_gen.run_simulation_filesafe('zimt', JV_sweep_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation_filesafe('zimt', JV_sweep_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         else:
-            result, message = utils_gen.run_simulation('zimt', JV_sweep_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation('zimt', JV_sweep_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
 
         if result == 0 or result == 95:
             if UseExpData == 1:
@@ -683,6 +683,10 @@ def Hysteresis_JV(zimt_device_parameters, session_path, UseExpData, scan_speed,
         file name of the second expJV curve, by default ''
     rms_mode : str, optional
         Either 'lin' or 'log' to specify how the rms error is calculated
+    **kwargs : dict
+        Additional keyword arguments:
+        hooks : dict, functions called when the simulations start, finish or fail, see call_hook, by default None
+        retry_ladder : bool, List or RetryLadder, rescue the simulations that fail to converge with the rungs of a retry ladder, see RetryLadder, by default None (no retries)
 
     Returns
     -------
@@ -694,6 +698,8 @@ def Hysteresis_JV(zimt_device_parameters, session_path, UseExpData, scan_speed,
         Dictionary containing the special output values of the simulation. In this case, the rms error ('rms') and the hysteresis index ('hyst_index')
     """
     verbose = kwargs.get('verbose', False) # Check if the user wants to see the console output
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = utils_gen.get_retry_ladder(kwargs)
     UUID = kwargs.get('UUID', '') # Check if the user wants to add a UUID to the tj file name
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters
     Vdist = kwargs.get('Vdist', 1) # Voltage distribution type (1: linear, 2: exponential)
@@ -766,9 +772,9 @@ def Hysteresis_JV(zimt_device_parameters, session_path, UseExpData, scan_speed,
             Hysteresis_JV_args = update_cmd_pars(Hysteresis_JV_args, cmd_pars)
 
         if threadsafe:
-            result, message = utils_gen.run_simulation_filesafe('zimt', Hysteresis_JV_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation_filesafe('zimt', Hysteresis_JV_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         else:
-            result, message = utils_gen.run_simulation('zimt', Hysteresis_JV_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation('zimt', Hysteresis_JV_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
 
         if result == 0 or result == 95:
             if UseExpData == 1:
@@ -479,7 +479,7 @@ def plot_impedance(session_path, output_file='freqZ.dat'):
     Capacitance_plot(session_path,output_file)
 
 
-def get_tolDens(zimt_device_parameters, session_path, f_min, f_max, V_0, G_frac, del_V, run_mode, tVG_name, tj_name, varFile, ini_timeFactor, dum_str, cmd_pars):
+def get_tolDens(zimt_device_parameters, session_path, f_min, f_max, V_0, G_frac, del_V, run_mode, tVG_name, tj_name, varFile, ini_timeFactor, dum_str, cmd_pars, hooks = None, retry_ladder = None):
     """
     Calculate the tolerance of the density solver, to ensure a reliable impedance spectrum
 
@@ -513,6 +513,10 @@ def get_tolDens(zimt_device_parameters, session_path, f_min, f_max, V_0, G_frac,
         dummy string with UUID string to append to the file names
     cmd_pars : list
         List of dictionaries with the command line parameters
+    hooks : dict, optional
+        Functions called when the simulation starts, finishes or fails, see call_hook, by default None
+    retry_ladder : RetryLadder, optional
+        Retry ladder to rescue the simulation if it fails to converge, see RetryLadder, by default None
     
     Returns
     -------
@@ -547,7 +551,7 @@ def get_tolDens(zimt_device_parameters, session_path, f_min, f_max, V_0, G_frac,
         if cmd_pars is not None:
             tolDens_args = update_cmd_pars(tolDens_args, cmd_pars)
         
-        result, message = utils_gen.run_simulation('zimt', tolDens_args, session_path, run_mode)
+        result, message = utils_gen.run_simulation('zimt', tolDens_args, session_path, run_mode, hooks=hooks, retry_ladder=retry_ladder)
 
         if result == 0 or result == 95:
             data = read_tj_file(session_path, tj_file_name=tj_name)
@@ -617,6 +621,10 @@ def run_impedance_simu(zimt_device_parameters, session_path, f_min, f_max, f_ste
         Constant defining the size of the initial timestep, by default 1e-3
     timeFactor : float, optional
         Exponential increase of the timestep, to reduce the amount of timepoints necessary. Use values close to 1., by default 1.02
+    **kwargs : dict
+        Additional keyword arguments:
+        hooks : dict, functions called when the simulations start, finish or fail, see call_hook, by default None
+        retry_ladder : bool, List or RetryLadder, rescue the simulations that fail to converge with the rungs of a retry ladder, see RetryLadder, by default None (no retries)
         
     Returns
     -------
@@ -626,6 +634,8 @@ def run_impedance_simu(zimt_device_parameters, session_path, f_min, f_max, f_ste
         Return message to display on the UI, for both success and failed
     """
     verbose = kwargs.get('verbose', False) # Check if the user wants to see the console output
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = utils_gen.get_retry_ladder(kwargs)
     UUID = kwargs.get('UUID', '') # Check if the user wants to add a UUID to the tj file name
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters
     # Check if the user wants to force the use of thread safe mode, necessary for Windows with parallel simulations
@@ -693,9 +703,9 @@ def run_impedance_simu(zimt_device_parameters, session_path, f_min, f_max, f_ste
                 Impedance_SS_args = update_cmd_pars(Impedance_SS_args, cmd_pars)
             
             if threadsafe:
-                result, message = utils_gen.run_simulation_filesafe('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose)
+                result, message = utils_gen.run_simulation_filesafe('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
             else:
-                result, message = utils_gen.run_simulation('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose)
+                result, message = utils_gen.run_simulation('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
     
             if result == 0 or result == 95:
                 data = read_tj_file(session_path, tj_file_name=tj_name)
@@ -765,9 +775,9 @@ def run_impedance_simu(zimt_device_parameters, session_path, f_min, f_max, f_ste
                 Impedance_SS_args = update_cmd_pars(Impedance_SS_args, cmd_pars)
             
             if threadsafe:
-                result, message = utils_gen.run_simulation_filesafe('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose)
+                result, message = utils_gen.run_simulation_filesafe('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
             else:
-                result, message = utils_gen.run_simulation('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose)
+                result, message = utils_gen.run_simulation('zimt', Impedance_SS_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
     
             if result == 0 or result == 95:
                 data = read_tj_file(session_path, tj_file_name=tj_name)
@@ -788,7 +798,7 @@ def run_impedance_simu(zimt_device_parameters, session_path, f_min, f_max, f_ste
         cmd_pars = [dictionary for dictionary in cmd_pars if dictionary['par'] not in ('R_series', 'R_shunt')]
 
     # Calculate the tolerance of the density solver
-    result, message, tolDens = get_tolDens(zimt_device_parameters, session_path, f_min, f_max, V_0, G_frac, del_V, run_mode, tVG_name, tj_name, varFile, ini_timeFactor, dum_str, cmd_pars)
+    result, message, tolDens = get_tolDens(zimt_device_parameters, session_path, f_min, f_max, V_0, G_frac, del_V, run_mode, tVG_name, tj_name, varFile, ini_timeFactor, dum_str, cmd_pars, hooks=hooks, retry_ladder=retry_ladder)
 
     if result != 0:
         # Failed to calculate the tolerance of the density solver, return the error message
@@ -824,9 +834,9 @@ def run_impedance_simu(zimt_device_parameters, session_path, f_min, f_max, f_ste
             Impedance_args = update_cmd_pars(Impedance_args, cmd_pars)
 
         if threadsafe:
-            result, message = utils_gen.run_simulation_filesafe('zimt', Impedance_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation_filesafe('zimt', Impedance_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         else:
-            result, message = utils_gen.run_simulation('zimt', Impedance_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation('zimt', Impedance_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
 
         if result == 0 or result == 95:
             data = read_tj_file(session_path, tj_file_name=tj_name) 
@@ -439,6 +439,10 @@ def run_IMPS_simu(zimt_device_parameters, session_path, f_min, f_max, f_steps, V
         Constant defining the size of the initial timestep, by default 1e-3
     timeFactor : float, optional
         Exponential increase of the timestep, to reduce the amount of timepoints necessary. Use values close to 1., by default 1.02
+    **kwargs : dict
+        Additional keyword arguments:
+        hooks : dict, functions called when the simulations start, finish or fail, see call_hook, by default None
+        retry_ladder : bool, List or RetryLadder, rescue the simulations that fail to converge with the rungs of a retry ladder, see RetryLadder, by default None (no retries)
        
     Returns
     -------
@@ -448,6 +452,8 @@ def run_IMPS_simu(zimt_device_parameters, session_path, f_min, f_max, f_steps, V
         Return message to display on the UI, for both success and failed
     """
     verbose = kwargs.get('verbose', False) # Check if the user wants to see the console output
+    hooks = kwargs.get('hooks', None)
+    retry_ladder = utils_gen.get_retry_ladder(kwargs)
     UUID = kwargs.get('UUID', '') # Check if the user wants to add a UUID to the tj file name
     cmd_pars = kwargs.get('cmd_pars', None) # Check if the user wants to add additional command line parameters
     # Check if the user wants to force the use of thread safe mode, necessary for Windows with parallel simulations
@@ -507,9 +513,9 @@ def run_IMPS_simu(zimt_device_parameters, session_path, f_min, f_max, f_steps, V
             IMPS_args = update_cmd_pars(IMPS_args, cmd_pars)
 
         if threadsafe:
-            result, message = utils_gen.run_simulation_filesafe('zimt', IMPS_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation_filesafe('zimt', IMPS_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
         else:
-            result, message = utils_gen.run_simulation('zimt', IMPS_args, session_path, run_mode, verbose=verbose)
+            result, message = utils_gen.run_simulation('zimt', IMPS_args, session_path, run_mode, verbose=verbose, hooks=hooks, retry_ladder=retry_ladder)
 
         if result == 0 or result == 95:
             data = read_tj_file(session_path, tj_file_name=tj_name)
@@ -34,6 +34,36 @@ def test_run_SS_JV():
     # Check the output
     assert ret == 0, 'JV simulation failed'
 
+def test_run_SS_JV_zimt():
+    """ Test the run_SS_JV function with the zimt engine """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    simss_device_parameters = os.path.join(cwd, 'SIMsalabim','SimSS','simulation_setup.txt')
+    zimt_device_parameters = os.path.join(cwd, 'SIMsalabim','ZimT','simulation_setup.txt')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    zimt_session_path = os.path.join(cwd, 'SIMsalabim','ZimT')
+    # Set the JV parameters
+    Gfracs = [0.1,0.5,1.0]
+    UUID = str(uuid.uuid4())
+    # Run all the JV simulations in one zimt simulation
+    ret, mess = run_SS_JV(simss_device_parameters, session_path, JV_file_name = 'JV.dat', G_fracs = Gfracs, run_mode = False, UUID=UUID, cmd_pars=[{'par': 'l2.L', 'val': '500e-9'}],
+                          engine = 'zimt', zimt_device_parameters = zimt_device_parameters, zimt_session_path = zimt_session_path)
+    V = get_SS_JV_voltages(simss_device_parameters, session_path)
+    JV_lengths = [len(pd.read_csv(os.path.join(session_path, f'JV_Gfrac_{G_frac}_{UUID}.dat'), sep=r'\s+')) for G_frac in Gfracs]
+
+    # Clean up the output
+    sim.clean_up_output('JV_Gfrac',session_path)
+    sim.clean_up_output('tj_Gfracs',zimt_session_path)
+    sim.clean_up_output('tVG_Gfracs',zimt_session_path)
+    sim.clean_up_output('log_Gfracs',zimt_session_path)
+
+    # Check the output
+    assert ret == 0, 'JV simulation with the zimt engine failed'
+    assert JV_lengths == [len(V)]*len(Gfracs)
+
 def test_SS_JV_parallel():
     """ Test the SS_JV_parallel function """
     try:
@@ -77,6 +107,7 @@ def test_SS_JV_parallel():
 
 if __name__ == '__main__':
     test_run_SS_JV()
+    test_run_SS_JV_zimt()
     test_SS_JV_parallel()
 
     cwd = os.path.abspath('../..')
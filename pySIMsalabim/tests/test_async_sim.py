@@ -0,0 +1,99 @@
+""" Test the asyncio simulation runners of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid, asyncio
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.async_sim import *
+
+######### Test Functions #########################################################################
+
+def get_async_cmd_pars(name, UUID):
+    """ Get the cmd_pars of a JV simulation with output files that are unique for this test """
+    return [{'par':'dev_par_file','val':'simulation_setup.txt'},
+            {'par':'JVFile','val':f'JV_{name}_{UUID}.dat'},
+            {'par':'logFile','val':f'log_{name}_{UUID}.txt'},
+            {'par':'scParsFile','val':f'scPars_{name}_{UUID}.txt'},
+            {'par':'varFile','val':'none'}]
+
+def test_run_simulation_parallel_async():
+    """ Test the run_simulation_parallel_async function """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+
+    cmd_pars_list = [get_async_cmd_pars('async_' + str(i), UUID) for i in range(3)]
+    batch, msg_list = asyncio.run(run_simulation_parallel_async('simss', cmd_pars_list, session_path, max_jobs = 2))
+    found = [os.path.isfile(os.path.join(session_path, cmd_pars[1]['val'])) for cmd_pars in cmd_pars_list]
+
+    # Clean up the output
+    sim.clean_up_output('JV_async',session_path)
+    sim.clean_up_output('log_async',session_path)
+    sim.clean_up_output('scPars_async',session_path)
+
+    assert batch == [0, 0, 0], 'JV simulations failed'
+    assert all(found), 'JV file not found'
+    assert len(msg_list) == 3
+
+def test_run_simulation_async_cancel():
+    """ Test that cancelling run_simulation_async kills the simulation """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+
+    # Keep the simulation process to check that it is gone after the cancellation
+    processes = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+    async def create_and_keep(*args, **kwargs):
+        process = await create_subprocess_exec(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    async def run_and_cancel():
+        task = asyncio.ensure_future(run_simulation_async('simss', get_async_cmd_pars('async_cancel', UUID), session_path))
+        while len(processes) == 0:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    asyncio.create_subprocess_exec = create_and_keep
+    try:
+        cancelled = asyncio.run(run_and_cancel())
+    finally:
+        asyncio.create_subprocess_exec = create_subprocess_exec
+
+    # Clean up the output
+    sim.clean_up_output('JV_async_cancel',session_path)
+    sim.clean_up_output('log_async_cancel',session_path)
+    sim.clean_up_output('scPars_async_cancel',session_path)
+
+    assert cancelled, 'The task was not cancelled'
+    assert processes[0].returncode is not None, 'The simulation is still running'
+    if os.name != 'nt':
+        try:
+            os.kill(processes[0].pid, 0)
+            exists = True
+        except ProcessLookupError:
+            exists = False
+        assert not exists, 'The simulation process still exists'
+
+if __name__ == '__main__':
+    test_run_simulation_parallel_async()
+    test_run_simulation_async_cancel()
+    print('All async simulation tests passed')
@@ -0,0 +1,62 @@
+""" Test the distributed simulation runner of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid, threading
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.distributed import *
+
+######### Test Functions #########################################################################
+
+def test_run_simulation_distributed():
+    """ Test the run_simulation_distributed function with two workers on localhost """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+
+    cmd_pars_list = []
+    for G_frac in [0.1,0.5,1.0]:
+        cmd_pars_list.append([{'par':'dev_par_file','val':'simulation_setup.txt'},
+                              {'par':'G_frac','val':str(G_frac)},
+                              {'par':'JVFile','val':f'JV_dist_{G_frac}_{UUID}.dat'},
+                              {'par':'logFile','val':f'log_dist_{G_frac}_{UUID}.txt'},
+                              {'par':'scParsFile','val':f'scPars_dist_{G_frac}_{UUID}.txt'},
+                              {'par':'varFile','val':'none'},
+                              {'par':'outputRatio','val':'0'},
+                              {'par':'autoTidy','val':'0'}])
+
+    # Start two workers on localhost, each with their own work folder
+    servers = [create_worker_server('127.0.0.1', 0, session_path, n_slots = 1, token = UUID) for _ in range(2)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    workers = ['127.0.0.1:' + str(server.server_address[1]) for server in servers]
+
+    try:
+        result, msg_list, return_code_list = run_simulation_distributed('simss', cmd_pars_list, session_path, workers, token = UUID)
+        output_files = [os.path.join(session_path, cmd_pars[2]['val']) for cmd_pars in cmd_pars_list]
+        found = [os.path.isfile(output_file) for output_file in output_files]
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    # Clean up the output
+    sim.clean_up_output('JV_dist',session_path)
+    sim.clean_up_output('log_dist',session_path)
+    sim.clean_up_output('scPars_dist',session_path)
+
+    assert result == 0, 'Distributed JV simulations failed'
+    assert return_code_list == [0, 0, 0]
+    assert all(found), 'JV file not found'
+
+if __name__ == '__main__':
+    test_run_simulation_distributed()
+    print('All distributed simulation tests passed')
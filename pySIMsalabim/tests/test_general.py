@@ -0,0 +1,38 @@
+""" Test the simulation watchdog of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, time, signal
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.general import *
+
+######### Test Functions #########################################################################
+
+def test_execute_simulation_timeout():
+    """ Test that a simulation that exceeds its wall-clock time limit is killed and returns TIMEOUT_ERROR_CODE """
+    start = time.perf_counter()
+    result = execute_simulation([sys.executable, '-c', 'import time; time.sleep(60)'], '.', timeout = 0.5)
+
+    assert result.returncode == TIMEOUT_ERROR_CODE
+    assert time.perf_counter() - start < 30, 'The simulation was not killed'
+
+def test_execute_simulation_cpu_time_limit():
+    """ Test that a simulation that exceeds its CPU time limit returns CPU_LIMIT_ERROR_CODE and that other kills are not relabelled """
+    if os.name == 'nt':
+        # cpu_time_limit is not supported on Windows
+        return
+    result = execute_simulation([sys.executable, '-c', 'while True: pass'], '.', cpu_time_limit = 1, timeout = 60)
+    assert result.returncode == CPU_LIMIT_ERROR_CODE
+
+    # Killed with SIGKILL long before the CPU time limit, e.g. by the OOM killer
+    result = execute_simulation([sys.executable, '-c', 'import os, signal; os.kill(os.getpid(), signal.SIGKILL)'], '.', cpu_time_limit = 30)
+    assert result.returncode == -signal.SIGKILL
+
+if __name__ == '__main__':
+    test_execute_simulation_timeout()
+    test_execute_simulation_cpu_time_limit()
+    print('All watchdog tests passed')
@@ -0,0 +1,59 @@
+""" Test the job ledger of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.parallel_sim import *
+from pySIMsalabim.utils.job_ledger import *
+
+######### Test Functions #########################################################################
+
+def test_run_simulation_parallel_ledger():
+    """ Test that a sweep with a job ledger does not run the finished simulations again """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    ledger_file = os.path.join(session_path, f'ledger_{UUID}.db')
+
+    cmd_pars_list = []
+    for G_frac in [0.1,0.5,1.0]:
+        cmd_pars_list.append([{'par':'dev_par_file','val':'simulation_setup.txt'},
+                              {'par':'G_frac','val':str(G_frac)},
+                              {'par':'JVFile','val':f'JV_ledger_{G_frac}_{UUID}.dat'},
+                              {'par':'logFile','val':f'log_ledger_{G_frac}_{UUID}.txt'},
+                              {'par':'scParsFile','val':f'scPars_ledger_{G_frac}_{UUID}.txt'},
+                              {'par':'varFile','val':'none'},
+                              {'par':'outputRatio','val':'0'},
+                              {'par':'autoTidy','val':'0'}])
+
+    # Run the first two simulations, then the whole sweep as if it was resumed
+    first = run_simulation_parallel('simss', cmd_pars_list[:2], session_path, max_jobs = 2, ledger = ledger_file)
+    jobs_first = get_ledger_jobs(ledger_file, state = 'done')
+    second = run_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2, ledger = ledger_file)
+    jobs_second = get_ledger_jobs(ledger_file, state = 'done')
+    JV_files = get_ledger_outputs(ledger_file, 'JVFile')
+
+    # Clean up the output
+    sim.clean_up_output('JV_ledger',session_path)
+    sim.clean_up_output('log_ledger',session_path)
+    sim.clean_up_output('scPars_ledger',session_path)
+    sim.clean_up_output('ledger_',session_path)
+
+    assert first == [0, 0] and second == [0, 0, 0], 'JV simulations failed'
+    assert len(jobs_first) == 2 and len(jobs_second) == 3
+    # The finished simulations were not run again
+    assert list(jobs_second['attempts']) == [1, 1, 1]
+    assert sorted(JV_files) == sorted(os.path.join(session_path, cmd_pars[2]['val']) for cmd_pars in cmd_pars_list)
+
+if __name__ == '__main__':
+    test_run_simulation_parallel_ledger()
+    print('All job ledger tests passed')
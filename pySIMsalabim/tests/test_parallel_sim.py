@@ -0,0 +1,227 @@
+""" Test the parallel simulation runners of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid, threading
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.parallel_sim import *
+
+######### Test Functions #########################################################################
+
+def get_SS_JV_cmd_pars_list(session_path, UUID, G_fracs = [0.1,0.5,1.0]):
+    """ Create the list of command line parameters for a set of steady-state JV simulations """
+    cmd_pars_list = []
+    for G_frac in G_fracs:
+        cmd_pars_list.append([{'par':'dev_par_file','val':'simulation_setup.txt'},
+                              {'par':'G_frac','val':str(G_frac)},
+                              {'par':'JVFile','val':f'JV_Gfrac_{G_frac}_{UUID}.dat'},
+                              {'par':'logFile','val':f'log_Gfrac_{G_frac}_{UUID}.txt'},
+                              {'par':'scParsFile','val':f'scPars_Gfrac_{G_frac}_{UUID}.txt'},
+                              {'par':'varFile','val':'none'},
+                              {'par':'outputRatio','val':'0'},
+                              {'par':'autoTidy','val':'0'}])
+    return cmd_pars_list
+
+def test_iter_simulation_parallel():
+    """ Test the iter_simulation_parallel function """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    cmd_pars_list = get_SS_JV_cmd_pars_list(session_path, UUID)
+
+    # Run the simulations and collect the results as they finish
+    finished = []
+    for idx, ret, output_files, timing in iter_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2):
+        assert ret == 0, 'JV simulation failed'
+        assert os.path.isfile(output_files['JVFile']), 'JV file not found'
+        assert timing['wall'] > 0
+        assert timing['usage']['wall'] > 0
+        finished.append(idx)
+    batch_usage = sim.get_last_batch_resource_usage()
+
+    # Clean up the output
+    sim.clean_up_output('JV_Gfrac',session_path)
+    sim.clean_up_output('log_Gfrac',session_path)
+    sim.clean_up_output('scPars_Gfrac',session_path)
+    # Check that every simulation was yielded once
+    assert sorted(finished) == list(range(len(cmd_pars_list))), 'Not all simulations were returned'
+    assert batch_usage['n_runs'] == len(cmd_pars_list)
+
+def test_run_simulation_parallel_hooks():
+    """ Test the hooks of run_simulation_parallel """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    cmd_pars_list = get_SS_JV_cmd_pars_list(session_path, UUID)
+
+    # Collect the events, the hooks are called from the worker threads
+    events = []
+    lock = threading.Lock()
+    def make_hook(event):
+        def hook(idx, info):
+            with lock:
+                events.append((event, idx, info.get('n_done')))
+        return hook
+    hooks = {event: make_hook(event) for event in ['submit', 'start', 'finish']}
+    ret = run_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2, force_multithreading = True, hooks = hooks)
+
+    # Clean up the output
+    sim.clean_up_output('JV_Gfrac',session_path)
+    sim.clean_up_output('log_Gfrac',session_path)
+    sim.clean_up_output('scPars_Gfrac',session_path)
+
+    assert ret == [0, 0, 0], 'JV simulations failed'
+    for event in ['submit', 'start', 'finish']:
+        assert sorted(idx for name, idx, n_done in events if name == event) == [0, 1, 2]
+    assert sorted(n_done for name, idx, n_done in events if name == 'finish') == [1, 2, 3]
+
+def test_run_simulation_parallel_cancel():
+    """ Test the cancellation and the fail-fast policy of run_simulation_parallel """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    cmd_pars_list = get_SS_JV_cmd_pars_list(session_path, UUID)
+
+    # A cancelled batch does not run any simulation
+    token = sim.CancellationToken()
+    token.cancel()
+    ret = run_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2, force_multithreading = True, cancel_token = token)
+    assert ret == [sim.CANCELLED_ERROR_CODE] * 3
+    assert not os.path.isfile(os.path.join(session_path, cmd_pars_list[0][2]['val'])), 'Cancelled simulation was run'
+
+    # The fail-fast policy only counts the input errors
+    token = sim.CancellationToken()
+    hooks = sim.add_fail_fast_hook(None, token, threshold = 2)
+    hooks['failure'](0, {'returncode': 93})
+    hooks['failure'](1, {'returncode': 91})
+    assert not token.cancelled
+    hooks['failure'](2, {'returncode': 96})
+    assert token.cancelled
+
+def test_retry_ladder():
+    """ Test the retry ladder of run_simulation_parallel """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    cmd_pars_list = get_SS_JV_cmd_pars_list(session_path, UUID)
+
+    # The rungs that rescued simulations are tried first, the cmd_pars are not changed
+    ladder = sim.RetryLadder([[{'par':'maxItPois','val':'5000'}], [{'par':'tolPois','val':'1e-4'}]])
+    ladder.record(1)
+    assert ladder.get_order() == [1, 0]
+    cmd_pars = ladder.get_cmd_pars(cmd_pars_list[0], 1)
+    assert cmd_pars[-1] == {'par':'tolPois','val':'1e-4'} and len(cmd_pars_list[0]) == len(cmd_pars) - 1
+
+    # Simulations that converge are not run again
+    ret = run_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2, retry_ladder = True)
+
+    # Clean up the output
+    sim.clean_up_output('JV_Gfrac',session_path)
+    sim.clean_up_output('log_Gfrac',session_path)
+    sim.clean_up_output('scPars_Gfrac',session_path)
+
+    assert ret == [0, 0, 0], 'JV simulations failed'
+    assert ret.rungs.tolist() == [-1, -1, -1]
+
+def test_run_simulation_parallel_lazy():
+    """ Test run_simulation_parallel with a generator of cmd_pars instead of a list """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    G_fracs = [0.1,0.2,0.3,0.4,0.5,1.0]
+
+    # The generator is read once, while the simulations run
+    n_submitted = []
+    ret_gnu = run_simulation_parallel('simss', (cmd_pars for cmd_pars in get_SS_JV_cmd_pars_list(session_path, UUID, G_fracs)), session_path, max_jobs = 2, lookahead = 3, 
+                                      hooks = {'submit': lambda idx, info: n_submitted.append(idx)})
+    ret_mt = run_simulation_parallel('simss', (cmd_pars for cmd_pars in get_SS_JV_cmd_pars_list(session_path, UUID, G_fracs)), session_path, max_jobs = 2, force_multithreading = True)
+
+    # Clean up the output
+    sim.clean_up_output('JV_Gfrac',session_path)
+    sim.clean_up_output('log_Gfrac',session_path)
+    sim.clean_up_output('scPars_Gfrac',session_path)
+
+    assert ret_gnu == [0] * len(G_fracs) and ret_mt == [0] * len(G_fracs), 'JV simulations failed'
+    assert sorted(n_submitted) == list(range(len(G_fracs)))
+
+def test_run_simulation_batch():
+    """ Test run_simulation_batch with a mixed batch of simss and zimt simulations """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    simss_session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    zimt_session_path = os.path.join(cwd, 'SIMsalabim','ZimT')
+    UUID = str(uuid.uuid4())
+
+    # Steady-state point followed by a voltage step for the zimt simulations
+    tVG_name = f'tVG_batch_{UUID}.txt'
+    with open(os.path.join(zimt_session_path, tVG_name), 'w') as fp:
+        fp.write('t Vext G_frac\n0 0 1\n1e-6 0.1 1\n')
+    zimt_cmd_pars_list = []
+    for i in range(2):
+        zimt_cmd_pars_list.append([{'par':'dev_par_file','val':'simulation_setup.txt'},
+                                   {'par':'tVGFile','val':tVG_name},
+                                   {'par':'tJFile','val':f'tj_batch_{i}_{UUID}.dat'},
+                                   {'par':'logFile','val':f'log_batch_{i}_{UUID}.txt'},
+                                   {'par':'varFile','val':'none'},
+                                   {'par':'autoTidy','val':'0'}])
+    jobs = sim.get_batch_jobs('simss', get_SS_JV_cmd_pars_list(simss_session_path, UUID), simss_session_path) + sim.get_batch_jobs('zimt', zimt_cmd_pars_list, zimt_session_path)
+
+    batch = sim.run_simulation_batch(jobs, max_jobs = 2)
+
+    # Clean up the output
+    sim.clean_up_output('JV_Gfrac',simss_session_path)
+    sim.clean_up_output('log_Gfrac',simss_session_path)
+    sim.clean_up_output('scPars_Gfrac',simss_session_path)
+    sim.clean_up_output('tj_batch',zimt_session_path)
+    sim.clean_up_output('log_batch',zimt_session_path)
+    sim.clean_up_output('tVG_batch',zimt_session_path)
+
+    assert batch == [0, 0, 0, 0, 0], 'Simulations failed'
+    assert batch.sim_type == ['simss'] * 3 + ['zimt'] * 2
+    assert batch.result(3).output_files['tJFile'] == os.path.join(zimt_session_path, zimt_cmd_pars_list[0][2]['val'])
+
+def test_get_parallel_results():
+    """ Test the messages of the finished and failed simulations of get_parallel_results """
+    result, message_list = get_parallel_results([0, 95, 3, 93], [[], [], [], []], '.')
+
+    assert result == 93
+    assert message_list[0] == 'Simulation completed.' and message_list[2] == 'Action completed'
+    assert message_list[1].startswith('Simulation completed but raised errorcode: 95')
+    assert message_list[3] == parallel_error_message(93)
+
+if __name__ == '__main__':
+    test_iter_simulation_parallel()
+    test_run_simulation_parallel_hooks()
+    test_run_simulation_parallel_cancel()
+    test_retry_ladder()
+    test_run_simulation_parallel_lazy()
+    test_run_simulation_batch()
+    test_get_parallel_results()
+    print('All parallel simulation tests passed')
@@ -0,0 +1,71 @@
+""" Test the structured simulation results of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid
+import numpy as np
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.results import *
+from pySIMsalabim.utils.parallel_sim import run_simulation_parallel
+
+######### Test Functions #########################################################################
+
+def test_batch_result():
+    """ Test the filtering and the list behaviour of BatchResult """
+    batch = BatchResult([0, 95, 91, 95, 0], messages = ['', '', 'error', '', ''], usage = [{'wall': 1.0}, None, {'wall': 2.0, 'max_rss': 123456789}, None, None])
+
+    assert batch == [0, 95, 91, 95, 0] and len(batch) == 5 and batch[2] == 91
+    assert list(batch.where(codes = 95)) == [1, 3]
+    failed = batch.filter(failed = True)
+    assert failed == [91] and list(failed.index) == [2] and failed.message(0) == 'error'
+    assert batch.counts() == {0: 2, 91: 1, 95: 2}
+    assert batch.overall_code == 91
+    assert np.isnan(batch.wall[1]) and batch.result(2).usage['wall'] == 2.0
+    assert batch.result(2).usage['max_rss'] == 123456789
+    code, message = batch.result(2)
+    assert code == 91 and message == 'error'
+    assert batch.result(2) == (91, 'error') and batch.result(0) != (91, 'error')
+
+def test_run_simulation_parallel_result():
+    """ Test the result of run_simulation_parallel and run_simulation """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+
+    cmd_pars_list = []
+    for G_frac in [0.1,0.5,1.0]:
+        cmd_pars_list.append([{'par':'dev_par_file','val':'simulation_setup.txt'},
+                              {'par':'G_frac','val':str(G_frac)},
+                              {'par':'JVFile','val':f'JV_res_{G_frac}_{UUID}.dat'},
+                              {'par':'logFile','val':f'log_res_{G_frac}_{UUID}.txt'},
+                              {'par':'scParsFile','val':f'scPars_res_{G_frac}_{UUID}.txt'},
+                              {'par':'varFile','val':'none'},
+                              {'par':'outputRatio','val':'0'},
+                              {'par':'autoTidy','val':'0'}])
+
+    batch = run_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2, force_multithreading = True)
+    single = sim.run_simulation('simss', cmd_pars_list[0], session_path)
+    ret, mess = single
+
+    # Clean up the output
+    sim.clean_up_output('JV_res',session_path)
+    sim.clean_up_output('log_res',session_path)
+    sim.clean_up_output('scPars_res',session_path)
+
+    assert isinstance(batch, BatchResult) and batch == [0, 0, 0], 'JV simulations failed'
+    assert np.all(batch.wall > 0)
+    assert batch.result(1).output_files['JVFile'] == os.path.join(session_path, cmd_pars_list[1][2]['val'])
+    assert ret == 0 and single.code == 0 and single.timing['wall'] > 0
+
+if __name__ == '__main__':
+    test_batch_result()
+    test_run_simulation_parallel_result()
+    print('All result tests passed')
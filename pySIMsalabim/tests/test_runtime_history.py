@@ -0,0 +1,56 @@
+""" Test the runtime history of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.parallel_sim import *
+from pySIMsalabim.utils.runtime_history import *
+
+######### Test Functions #########################################################################
+
+def test_runtime_history():
+    """ Test that the runtime of the simulations is recorded and can be estimated """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    history_file = os.path.join(session_path, f'runtime_{UUID}.db')
+
+    cmd_pars_list = []
+    for G_frac in [0.1,0.5,1.0]:
+        cmd_pars_list.append([{'par':'dev_par_file','val':'simulation_setup.txt'},
+                              {'par':'G_frac','val':str(G_frac)},
+                              {'par':'JVFile','val':f'JV_runtime_{G_frac}_{UUID}.dat'},
+                              {'par':'logFile','val':f'log_runtime_{G_frac}_{UUID}.txt'},
+                              {'par':'scParsFile','val':f'scPars_runtime_{G_frac}_{UUID}.txt'},
+                              {'par':'varFile','val':'none'},
+                              {'par':'outputRatio','val':'0'},
+                              {'par':'autoTidy','val':'0'}])
+
+    ret = run_simulation_parallel('simss', cmd_pars_list, session_path, max_jobs = 2, runtime_history = history_file, force_multithreading = True)
+    history = load_runtime_history(history_file, 'simss')
+    estimate = estimate_simulation_runtime(history_file, 'simss', cmd_pars_list, session_path, max_jobs = 2)
+
+    # Clean up the output
+    sim.clean_up_output('JV_runtime',session_path)
+    sim.clean_up_output('log_runtime',session_path)
+    sim.clean_up_output('scPars_runtime',session_path)
+    sim.clean_up_output('runtime_',session_path)
+
+    assert ret == [0, 0, 0], 'JV simulations failed'
+    assert len(history) == 3 and all(history['wall'] > 0)
+    assert sorted(history['G_frac']) == [0.1, 0.5, 1.0]
+    assert all(val is not None and val > 0 for val in estimate['per_job'])
+    assert estimate['makespan'] <= estimate['total']
+
+if __name__ == '__main__':
+    test_runtime_history()
+    print('All runtime history tests passed')
@@ -0,0 +1,62 @@
+""" Test the simulation result cache of pySIMsalabim """
+
+######### Package Imports #########################################################################
+import os, sys, uuid, shutil
+try :
+    import pySIMsalabim as sim
+except ImportError:
+    # Add the parent directory to the system path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    import pySIMsalabim as sim
+from pySIMsalabim.utils.sim_cache import *
+
+######### Test Functions #########################################################################
+
+def test_run_simulation_cached():
+    """ Test that a cached simulation restores its output without running again """
+    # Set the path to the simulation setup file
+    if os.path.exists('SIMsalabim'):
+        cwd = os.path.abspath('.')
+    else:
+        cwd = os.path.abspath('../..')
+    session_path = os.path.join(cwd, 'SIMsalabim','SimSS')
+    UUID = str(uuid.uuid4())
+    cache_dir = os.path.join(session_path, 'cache_'+UUID)
+
+    cmd_pars = [{'par':'dev_par_file','val':'simulation_setup.txt'},
+                {'par':'JVFile','val':f'JV_cache_{UUID}.dat'},
+                {'par':'logFile','val':f'log_cache_{UUID}.txt'},
+                {'par':'scParsFile','val':f'scPars_cache_{UUID}.txt'},
+                {'par':'varFile','val':'none'}]
+    JV_file = os.path.join(session_path, f'JV_cache_{UUID}.dat')
+
+    # First run, the simulation is run and stored in the cache
+    ret, mess = sim.run_simulation('simss', cmd_pars, session_path, cache_dir = cache_dir)
+    assert ret == 0, 'JV simulation failed'
+    with open(JV_file) as fp:
+        JV = fp.read()
+    key = get_simulation_key('simss', cmd_pars, session_path)
+    assert os.path.isdir(os.path.join(cache_dir, key)), 'Simulation not stored in the cache'
+
+    # Second run, the output is restored from the cache
+    os.remove(JV_file)
+    ret, mess = sim.run_simulation('simss', cmd_pars, session_path, cache_dir = cache_dir)
+    assert ret == 0, 'Cached JV simulation failed'
+    with open(JV_file) as fp:
+        assert fp.read() == JV, 'Cached JV file differs'
+
+    # A different simulation gets a different key
+    assert get_simulation_key('simss', cmd_pars + [{'par':'G_frac','val':'0.5'}], session_path) != key
+
+    # Evict the whole cache
+    assert evict_cache(cache_dir, max_size = 0) == 1
+
+    # Clean up
+    sim.clean_up_output('JV_cache',session_path)
+    sim.clean_up_output('log_cache',session_path)
+    sim.clean_up_output('scPars_cache',session_path)
+    shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    test_run_simulation_cached()
+    print('All cache tests passed')
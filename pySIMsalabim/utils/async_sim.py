@@ -0,0 +1,107 @@
+"""Functions to run SIMsalabim simulations with asyncio"""
+######### Package Imports #########################################################################
+
+import os, asyncio, time
+from asyncio.subprocess import PIPE, DEVNULL
+from pySIMsalabim.utils.general import construct_cmd_args, get_result_message, get_console_error_message, get_default_max_jobs
+from pySIMsalabim.utils.results import SimulationResult, BatchResult
+
+######### Function Definitions ####################################################################
+
+async def run_simulation_async(sim_type, cmd_pars, session_path, run_mode = False, verbose = False):
+    """Run the SIMsalabim simulation executable with the chosen device parameters without blocking the event loop.
+        The executable is started directly with asyncio.create_subprocess_exec, so no thread is blocked while the simulation runs.
+        Return the return code of the process accompanied by a message with information, in case of both success and failure.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+    run_mode : boolean
+        True if function is called as part of The Shell, False when called directly.
+        Prevents using streamlit components outside of The Shell.
+    verbose : boolean
+        True if the console output of the simulation should be printed to the console
+
+    Returns
+    -------
+    SimulationResult
+        Result of the simulation with the return code (0 for success, other values for errors), the message to display on the UI, the output files and timing.
+        It unpacks as (returncode, message)
+
+    Raises
+    ------
+    asyncio.CancelledError
+        If the coroutine is cancelled, the simulation is killed first
+    """
+    cmd_args = construct_cmd_args(sim_type, cmd_pars, session_path)
+
+    # The console output is only needed to build the message (The Shell) or to print it
+    capture_output = run_mode or verbose
+    start_time = time.time()
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*cmd_args, cwd=session_path, stdout=PIPE if capture_output else DEVNULL)
+    try:
+        stdout, _ = await process.communicate()
+    except asyncio.CancelledError:
+        # E.g. asyncio.wait_for timed out or the web request was closed, do not leave the simulation running
+        process.kill()
+        await process.wait()
+        raise
+    wall = time.perf_counter() - start
+
+    if run_mode:
+        message = get_result_message(process.returncode, stdout)
+    else:
+        if verbose:
+            print(get_console_error_message(stdout))
+        message = ''
+
+    timing = {'start': start_time, 'end': start_time + wall, 'wall': wall}
+    return SimulationResult(process.returncode, message, timing = timing, usage = {'wall': wall}, output_source = (sim_type, cmd_pars, session_path))
+
+async def run_simulation_parallel_async(sim_type, cmd_pars_list, session_path, max_jobs = get_default_max_jobs(), run_mode = False, verbose = False):
+    """Run the SIMsalabim simulation executable for a list of parameters on the running event loop.
+        At most max_jobs simulations are in flight at the same time. Unlike run_simulation_parallel, no thread is used per simulation,
+        so max_jobs can be much larger than the number of threads that would be reasonable.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+    max_jobs : int
+        Maximum number of simulations that run at the same time. Default is the number of usable CPUs - 1 (get_default_max_jobs)
+    run_mode : boolean
+        True if function is called as part of The Shell, False when called directly.
+    verbose : bool
+        If True, print the output of the simulation to the console
+
+    Returns
+    -------
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. It behaves like the list of return codes
+    List
+        Return list of messages for each simulation
+    """
+    result_list = [None] * len(cmd_pars_list)
+    jobs = iter(enumerate(cmd_pars_list))
+
+    async def worker():
+        # Each worker pulls the next simulation once its previous one is done, so only max_jobs coroutines exist
+        for idx, cmd_pars in jobs:
+            result_list[idx] = await run_simulation_async(sim_type, cmd_pars, session_path, run_mode = run_mode, verbose = verbose)
+
+    n_workers = max(1, min(int(max_jobs), len(cmd_pars_list)))
+    await asyncio.gather(*(worker() for _ in range(n_workers)))
+
+    return BatchResult.from_results(result_list, sim_type, cmd_pars_list, session_path), [res.message for res in result_list]
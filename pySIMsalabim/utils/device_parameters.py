@@ -1,7 +1,12 @@
 """Functions for processing the device parameters"""
 ######### Package Imports #########################################################################
 
-import os, shutil, random
+import os, shutil, random, threading
+
+######### Constants ###############################################################################
+
+devpar_cache = {} # Parsed device parameter files, keyed on (path, parse function) and invalidated by (size, modification time), see read_devpar_file_cached
+devpar_cache_lock = threading.Lock()
 
 ######### Function Definitions ####################################################################
 
@@ -42,36 +47,13 @@ def load_device_parameters(session_path, dev_par_file_name, default_path=os.path
                 if (file.endswith('_parameters.txt')):
                     shutil.copy(os.path.join(default_path, file), session_path) # The layer files
 
-    # Read the simulation_setup file and store all lines in a list
-    with open(os.path.join(session_path, dev_par_file_name), encoding='utf-8') as fp:
-        # First check how many layers are defined.
-        layersSection = False
-        layers = [['par', 'setup',dev_par_file_name,dev_par_file_name]] # Initialize the simulation setup file. This is identified by key 'setup'
-
-        for line in fp:
-            # Read all lines from the file
-            if line.startswith('**'):
-            # Left adjusted comment
-                comm_line = line.replace('*', '').strip()
-                if ('Layers' in comm_line):  # Found section with the layer files
-                    layersSection = True
-                else:
-                    layersSection = False
-            else:
-                    # Line is either a parameter or leftover comment.
-                par_line = line.split('*')
-                if '=' in par_line[0]:  # Line contains a parameter
-                    par_split = par_line[0].split('=')
-                    par = ['par', par_split[0].strip(), par_split[1].strip(),par_line[1].strip()] # The element with index 2 contains the actual file name!
-                    if layersSection: # If the line is in the layer section, it contains the name of a layer file, thus add it to the Layers list
-                        layers.append(par) # Add sublist to the layers list 
-        fp.close()
+    # Read the simulation_setup file and get the layer files from it
+    layers = [['par', 'setup',dev_par_file_name,dev_par_file_name]] # Initialize the simulation setup file. This is identified by key 'setup'
+    layers += read_devpar_file_cached(os.path.join(session_path, dev_par_file_name), layers_read_from_txt)
 
     # Read each layer file and append it as a sublist in the main dev_par list
     for layer in layers:
-        with open(os.path.join(session_path, layer[2]), encoding='utf-8') as fp:
-            dev_par[f'{layer[2]}'] = devpar_read_from_txt(fp)
-            fp.close()
+        dev_par[f'{layer[2]}'] = read_devpar_file_cached(os.path.join(session_path, layer[2]))
     
     if run_mode == True:
         # Now load the layer files that are not in the simulation_setup but have been defined or created before
@@ -86,11 +68,88 @@ def load_device_parameters(session_path, dev_par_file_name, default_path=os.path
 
         # Read each extra layer file and append it as a sublist in the main dev_par list
         for layer in extraLayers:
-            with open(os.path.join(session_path, layer), encoding='utf-8') as fp:
-                dev_par[f'{layer}'] = devpar_read_from_txt(fp)
-                fp.close()
+            dev_par[f'{layer}'] = read_devpar_file_cached(os.path.join(session_path, layer))
     return dev_par, layers
 
+def layers_read_from_txt(fp):
+    """Read the layer files from the Layers section of the opened simulation setup file.
+
+    Parameters
+    ----------
+    fp : TextIOWrapper
+        filepointer to the opened simulation setup file.
+
+    Returns
+    -------
+    List
+        List with a sublist ['par', name, file name, comment] for each layer
+    """
+    layersSection = False
+    layers = []
+    for line in fp:
+        # Read all lines from the file
+        if line.startswith('**'):
+        # Left adjusted comment
+            comm_line = line.replace('*', '').strip()
+            if ('Layers' in comm_line):  # Found section with the layer files
+                layersSection = True
+            else:
+                layersSection = False
+        else:
+                # Line is either a parameter or leftover comment.
+            par_line = line.split('*')
+            if '=' in par_line[0]:  # Line contains a parameter
+                par_split = par_line[0].split('=')
+                par = ['par', par_split[0].strip(), par_split[1].strip(),par_line[1].strip()] # The element with index 2 contains the actual file name!
+                if layersSection: # If the line is in the layer section, it contains the name of a layer file, thus add it to the Layers list
+                    layers.append(par) # Add sublist to the layers list 
+    return layers
+
+def read_devpar_file_cached(filename, read_func = None):
+    """Read and parse a device parameter file. The parsed file is cached for the whole process and only parsed again when the size 
+    or modification time of the file changes. A copy is returned, so the caller can change it without changing the cache.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the device parameter file
+    read_func : function, optional
+        Function that parses the opened file, by default devpar_read_from_txt
+
+    Returns
+    -------
+    List
+        Parsed file, see read_func
+    """
+    if read_func is None:
+        read_func = devpar_read_from_txt
+    key = (os.path.abspath(filename), read_func.__name__)
+    stat = os.stat(filename)
+    with devpar_cache_lock:
+        cached = devpar_cache.get(key)
+    if cached is None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+        with open(filename, encoding='utf-8') as fp:
+            parsed = read_func(fp)
+        cached = ((stat.st_size, stat.st_mtime_ns), parsed)
+        with devpar_cache_lock:
+            devpar_cache[key] = cached
+    return copy_devpar(cached[1])
+
+def copy_devpar(dev_par_object):
+    """Copy a parsed device parameter file. Only the (nested) lists are copied, the strings are shared, which is much faster than a deepcopy.
+
+    Parameters
+    ----------
+    dev_par_object : List
+        Parsed device parameter file or list of layers
+
+    Returns
+    -------
+    List
+        Copy of dev_par_object
+    """
+    return [copy_devpar(item) if isinstance(item, list) else item for item in dev_par_object]
+
 def devpar_read_from_txt(fp):
     """Read the opened .txt file line by line and store all in a List.
 
@@ -552,6 +611,131 @@ def get_inputFile_from_layer(layer, session_path):
                                
     return input_files
 
+def get_output_files(sim_type, cmd_pars, session_path):
+    """Get the paths of the output files of a simulation. The file names set in the command line parameters take precedence over the ones in the simulation setup file.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with the command line parameters, must contain the device parameters file with a key: dev_par_file
+    session_path : string
+        Folder path of the current simulation session
+
+    Returns
+    -------
+    dict
+        Dictionary with the output file parameter name (e.g. 'JVFile') as key and the path of the output file as value. Output files set to 'none' are not included.
+    """
+    # make sure sim_type is simss or zimt
+    sim = sim_type.lower()
+    if sim == 'simss':
+        output_pars = ['JVFile', 'scParsFile', 'varFile', 'logFile']
+    elif sim == 'zimt':
+        output_pars = ['tJFile', 'varFile', 'logFile']
+    else:
+        raise ValueError('sim_type must be either simss or zimt')
+
+    output_files = {}
+    # Read the default output file names from the simulation setup file
+    for cmd_par in cmd_pars:
+        if cmd_par['par'] == 'dev_par_file':
+            dev_par = read_devpar_file_cached(os.path.join(session_path, cmd_par['val']))
+            for par_name in output_pars:
+                param = get_par_from_dev_par(dev_par, par_name)
+                if param is not None:
+                    output_files[par_name] = param[2]
+            break
+
+    # Overwrite with the file names from the command line parameters
+    for cmd_par in cmd_pars:
+        if cmd_par['par'] in output_pars:
+            output_files[cmd_par['par']] = str(cmd_par['val'])
+
+    return {key: os.path.join(session_path, val) for key, val in output_files.items() if val.lower() != 'none'}
+
+def get_input_files(sim_type, cmd_pars, session_path):
+    """Get the paths of all input files of a simulation, i.e. the simulation setup file, the layer files and the files referenced in them
+    or in the command line parameters (nk, spectrum, trap, genProfile, expJV and tVG files). The file names set in the command line parameters
+    take precedence over the ones in the simulation setup and layer files. Files that do not exist are not included.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with the command line parameters, must contain the device parameters file with a key: dev_par_file
+    session_path : string
+        Folder path of the current simulation session
+
+    Returns
+    -------
+    List
+        Sorted list with the paths of the input files
+    """
+    # make sure sim_type is simss or zimt
+    sim = sim_type.lower()
+    if sim not in ['simss', 'zimt']:
+        raise ValueError('sim_type must be either simss or zimt')
+
+    ignore_output_files = ['JVFile', 'scParsFile', 'tJFile', 'varFile', 'logFile']
+    if sim == 'simss':
+        ignore_output_files.append('tVGFile') # tVGFile is only used by zimt
+    else:
+        ignore_output_files.append('expJV') # expJV is only used by simss
+
+    def get_file_pars(dev_par_object):
+        # Get all parameters in a device parameter file that refer to an input file
+        file_pars = {}
+        for section in dev_par_object[1:]:
+            for param in section[1:]:
+                if param[0] != 'par' or param[1] in ignore_output_files:
+                    continue
+                if param[1].endswith('File') or param[1].startswith('nk') or param[1] in ['expJV', 'genProfile', 'spectrum']:
+                    file_pars[param[1]] = param[2]
+        return file_pars
+
+    dev_par_file = None
+    for cmd_par in cmd_pars:
+        if cmd_par['par'] == 'dev_par_file':
+            dev_par_file = cmd_par['val']
+            break
+    if dev_par_file is None:
+        raise ValueError('Device parameters file not found in the command parameters list.')
+
+    setup_par = read_devpar_file_cached(os.path.join(session_path, dev_par_file))
+
+    # Layer files, the ones from the command line parameters take precedence
+    layer_files = {}
+    for section in setup_par[1:]:
+        if section[0] == 'Layers':
+            for param in section[1:]:
+                if param[0] == 'par':
+                    layer_files[param[1]] = param[2]
+    for cmd_par in cmd_pars:
+        if cmd_par['par'].startswith('l') and cmd_par['par'][1:].isdigit():
+            layer_files[cmd_par['par']] = str(cmd_par['val'])
+
+    # Files referenced in the simulation setup and the layer files, prefixed with the layer for the latter (e.g. l1.nkLayer)
+    file_pars = get_file_pars(setup_par)
+    for layer, layer_file in layer_files.items():
+        if os.path.isfile(os.path.join(session_path, layer_file)):
+            layer_par = read_devpar_file_cached(os.path.join(session_path, layer_file))
+            for par_name, val in get_file_pars(layer_par).items():
+                file_pars[layer+'.'+par_name] = val
+
+    # Overwrite with the file names from the command line parameters
+    for cmd_par in get_inputFile_from_cmd_pars(sim, cmd_pars):
+        if cmd_par['par'] not in ignore_output_files:
+            file_pars[cmd_par['par']] = str(cmd_par['val'])
+
+    input_files = [dev_par_file] + list(layer_files.values())
+    input_files += [val for val in file_pars.values() if val.lower() not in ['none', 'calc', '']]
+    input_files = [os.path.abspath(os.path.join(session_path, f)) for f in input_files]
+
+    return sorted(set(f for f in input_files if os.path.isfile(f)))
+
 def make_basename_file_cmd_pars(cmd_pars,except_output_files = True):
     """ Update the command line parameters with the basename of the input files
 
@@ -614,9 +798,7 @@ def make_basename_input_files(filename, updateFile = True):
         List with the updated layer parameters
     """    
     # read the layer file
-    with open(filename, encoding='utf-8') as fp:
-        layer_par = devpar_read_from_txt(fp)
-        fp.close()
+    layer_par = read_devpar_file_cached(filename)
     
     section2update = ['Layers', 'Optics', 'Generation and recombination', 'Interface-layer-to-right', 'Bulk trapping']
     ignore_output_files = ['JVFile', 'scParsFile', 'tJFile', 'varFile', 'logFile']
@@ -0,0 +1,686 @@
+"""Functions to run SIMsalabim simulations on worker daemons on other machines over TCP"""
+######### Package Imports #########################################################################
+
+import os, json, socket, socketserver, struct, threading, queue, shutil, uuid, time, base64, hashlib
+from pySIMsalabim.utils.general import construct_cmd_args, execute_simulation, get_result_message, link_or_copy, get_default_max_jobs, resource_usage_local, summarize_resource_usage, call_hook, call_finish_hooks
+from pySIMsalabim.utils.general import CancellationToken, CANCELLED_ERROR_CODE, apply_fail_fast, get_retry_ladder
+from pySIMsalabim.utils.device_parameters import get_input_files, get_output_files, make_basename_file_cmd_pars, make_basename_input_files, devpar_write_to_txt, read_devpar_file_cached, layers_read_from_txt
+from pySIMsalabim.utils.sim_cache import get_file_hash
+from pySIMsalabim.utils.runtime_history import record_simulation_runtime
+from pySIMsalabim.utils.results import SUCCESS_CODES
+
+######### Constants ###############################################################################
+
+MAX_MESSAGE_SIZE = 2**32 - 1 # Maximum size in bytes of a message, limited by the 4 byte length prefix
+NOT_RUN_ERROR_CODE = -1 # Return code of a simulation that could not be run on any worker
+
+######### Function Definitions ####################################################################
+
+def send_message(sock, message):
+    """Send a message over a socket. A message is a JSON object prefixed with its length as a 4 byte big-endian integer.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Connected socket
+    message : dict
+        Message to send, must be JSON serializable
+    """
+    data = json.dumps(message).encode('utf-8')
+    if len(data) > MAX_MESSAGE_SIZE:
+        raise ValueError('Message too large to send: ' + str(len(data)) + ' bytes')
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+def recv_message(sock):
+    """Receive a message sent with send_message.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Connected socket
+
+    Returns
+    -------
+    dict
+        Received message
+
+    Raises
+    ------
+    ConnectionError
+        If the connection is closed before the complete message is received
+    """
+    length = struct.unpack('>I', recv_exact(sock, 4))[0]
+    return json.loads(recv_exact(sock, length).decode('utf-8'))
+
+def recv_exact(sock, n_bytes):
+    """Receive exactly n_bytes from a socket.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Connected socket
+    n_bytes : int
+        Number of bytes to receive
+
+    Returns
+    -------
+    bytes
+        Received bytes
+    """
+    data = bytearray()
+    while len(data) < n_bytes:
+        chunk = sock.recv(min(n_bytes - len(data), 1 << 20))
+        if not chunk:
+            raise ConnectionError('Connection closed by the other side')
+        data += chunk
+    return bytes(data)
+
+def parse_address(address):
+    """Parse a 'host:port' address.
+
+    Parameters
+    ----------
+    address : string or tuple
+        Address as 'host:port' or (host, port)
+
+    Returns
+    -------
+    tuple
+        (host, port)
+    """
+    if isinstance(address, (tuple, list)):
+        return address[0], int(address[1])
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+######### Worker ##################################################################################
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    """Handle one connection from a coordinator. The coordinator sends the input files it has not sent before (put_file) and one job at a time (run),
+    see run_simulation_distributed. While a job runs, a heartbeat message is sent at a fixed interval, so the coordinator can detect a dead worker.
+    """
+    def handle(self):
+        server = self.server
+        send_lock = threading.Lock()
+        authenticated = server.token is None
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            msg_type = message.get('type')
+            if msg_type == 'hello':
+                if server.token is not None and message.get('token') != server.token:
+                    send_message(self.request, {'type': 'error', 'message': 'Invalid token.'})
+                    return
+                authenticated = True
+                reply = {'type': 'hello', 'n_slots': server.n_slots, 'files': os.listdir(server.store_dir)}
+            elif not authenticated:
+                send_message(self.request, {'type': 'error', 'message': 'Send hello with the token first.'})
+                return
+            elif msg_type == 'ping':
+                reply = {'type': 'pong'}
+            elif msg_type == 'put_file':
+                reply = store_worker_file(server.store_dir, message['hash'], base64.b64decode(message['data']))
+            elif msg_type == 'run':
+                reply = run_worker_job(server, message, self.request, send_lock)
+            else:
+                reply = {'type': 'error', 'message': 'Unknown message type: ' + str(msg_type)}
+
+            try:
+                with send_lock:
+                    send_message(self.request, reply)
+            except OSError:
+                return
+
+def store_worker_file(store_dir, file_hash, data):
+    """Store an input file in the content-addressed file store of a worker.
+
+    Parameters
+    ----------
+    store_dir : string
+        Folder of the file store
+    file_hash : string
+        SHA-256 hash of the file, used as file name
+    data : bytes
+        Content of the file
+
+    Returns
+    -------
+    dict
+        Reply message, 'ok' or 'error' if the content does not match the hash
+    """
+    if hashlib.sha256(data).hexdigest() != file_hash:
+        return {'type': 'error', 'message': 'Hash mismatch for file ' + file_hash}
+    tmp_file = os.path.join(store_dir, file_hash + '.' + str(uuid.uuid4()) + '.tmp')
+    with open(tmp_file, 'wb') as fp:
+        fp.write(data)
+    os.replace(tmp_file, os.path.join(store_dir, file_hash))
+    return {'type': 'ok'}
+
+def run_worker_job(server, job, sock, send_lock):
+    """Run a job on a worker in a separate job folder. The input files are linked from the file store and the output files are returned in the reply.
+    The simulation is killed when a heartbeat cannot be sent, i.e. when the coordinator is gone or cancelled the batch.
+
+    Parameters
+    ----------
+    server : socketserver.ThreadingTCPServer
+        Worker server, see create_worker_server
+    job : dict
+        Run message with the keys job_id, sim_type, cmd_pars, files (basename -> hash), outputs (parameter -> basename), limits and heartbeat_interval
+    sock : socket.socket
+        Connection to the coordinator, used to send the heartbeats
+    send_lock : threading.Lock
+        Lock to send over the connection
+
+    Returns
+    -------
+    dict
+        Reply message, 'result' or 'missing_files' with the hashes of the files that are not in the store
+    """
+    sim_type = job['sim_type'].lower()
+    missing = [file_hash for file_hash in job['files'].values() if not os.path.isfile(os.path.join(server.store_dir, file_hash))]
+    if len(missing) > 0:
+        return {'type': 'missing_files', 'job_id': job['job_id'], 'hashes': missing}
+
+    job_dir = os.path.join(server.work_dir, 'job_' + str(uuid.uuid4()))
+    os.makedirs(job_dir)
+    stop_heartbeat = threading.Event()
+    cancel_token = CancellationToken()
+    def heartbeat():
+        while not stop_heartbeat.wait(job.get('heartbeat_interval', 5)):
+            try:
+                with send_lock:
+                    send_message(sock, {'type': 'heartbeat', 'job_id': job['job_id']})
+            except OSError:
+                cancel_token.cancel('Connection to the coordinator lost')
+                return
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+
+    try:
+        exe = sim_type + '.exe' if os.name == 'nt' else sim_type
+        link_or_copy(os.path.join(server.exe_dir, exe), os.path.join(job_dir, exe))
+        for name, file_hash in job['files'].items():
+            link_or_copy(os.path.join(server.store_dir, file_hash), os.path.join(job_dir, os.path.basename(name)))
+
+        cmd_args = construct_cmd_args(sim_type, job['cmd_pars'], job_dir)
+        console_file = os.path.join(job_dir, 'console_output.txt')
+        heartbeat_thread.start()
+        start = time.time()
+        result = execute_simulation(cmd_args, job_dir, stdout_file = console_file, cancel_token = cancel_token, **job.get('limits', {}))
+        end = time.time()
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+
+        console_output = ''
+        if result.returncode not in [0, 3]:
+            with open(console_file, 'rb') as fp:
+                console_output = fp.read()
+
+        outputs = {}
+        for par_name, basename in job['outputs'].items():
+            output_file = os.path.join(job_dir, os.path.basename(basename))
+            if os.path.isfile(output_file):
+                with open(output_file, 'rb') as fp:
+                    outputs[par_name] = base64.b64encode(fp.read()).decode('ascii')
+
+        return {'type': 'result', 'job_id': job['job_id'], 'returncode': result.returncode, 'message': get_result_message(result.returncode, console_output),
+                'outputs': outputs, 'timing': {'start': start, 'end': end, 'wall': end - start, 'usage': result.usage}, 'host': socket.gethostname()}
+    finally:
+        stop_heartbeat.set()
+        shutil.rmtree(job_dir, ignore_errors = True)
+
+def create_worker_server(host, port, exe_dir, work_dir = None, n_slots = get_default_max_jobs(), token = None):
+    """Create a worker server that runs the jobs of coordinators, see run_worker.
+    The server is not started, call serve_forever (e.g. in a thread) to start it and shutdown to stop it.
+
+    Parameters
+    ----------
+    host : string
+        Host name or IP address to listen on, e.g. '0.0.0.0' for all interfaces or '127.0.0.1' for local use only
+    port : int
+        Port to listen on, 0 to pick a free port (see server.server_address)
+    exe_dir : string
+        Folder with the simss and/or zimt executable of this worker
+    work_dir : string, optional
+        Folder for the file store and the job folders, by default a new temporary folder
+    n_slots : int, optional
+        Number of jobs this worker runs at the same time, by default the number of usable CPUs - 1
+    token : string, optional
+        Shared secret the coordinator must send before it can submit jobs, by default None (no check)
+
+    Returns
+    -------
+    socketserver.ThreadingTCPServer
+        Worker server
+    """
+    if work_dir is None:
+        import tempfile
+        work_dir = tempfile.mkdtemp(prefix='pySIMsalabim_worker_')
+    server = socketserver.ThreadingTCPServer((host, port), WorkerHandler, bind_and_activate = False)
+    server.daemon_threads = True
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.server_activate()
+    server.exe_dir = os.path.abspath(exe_dir)
+    server.work_dir = os.path.abspath(work_dir)
+    server.store_dir = os.path.join(server.work_dir, 'store')
+    server.n_slots = max(1, int(n_slots))
+    server.token = token
+    os.makedirs(server.store_dir, exist_ok = True)
+    return server
+
+def run_worker(host, port, exe_dir, work_dir = None, n_slots = get_default_max_jobs(), token = None):
+    """Run a worker daemon that runs simulations for coordinators on other machines, until it is interrupted.
+    Started from the command line with: pySIMsalabim worker --listen host:port --exe-dir path/to/SimSS.
+    There is no encryption, only use the worker on a trusted network and set a token.
+
+    Parameters
+    ----------
+    host : string
+        Host name or IP address to listen on
+    port : int
+        Port to listen on
+    exe_dir : string
+        Folder with the simss and/or zimt executable of this worker
+    work_dir : string, optional
+        Folder for the file store and the job folders, by default a new temporary folder
+    n_slots : int, optional
+        Number of jobs this worker runs at the same time, by default the number of usable CPUs - 1
+    token : string, optional
+        Shared secret the coordinator must send before it can submit jobs, by default None (no check)
+    """
+    server = create_worker_server(host, port, exe_dir, work_dir, n_slots, token)
+    print('pySIMsalabim worker listening on {}:{} with {} slots, work_dir: {}'.format(server.server_address[0], server.server_address[1], server.n_slots, server.work_dir))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+######### Coordinator #############################################################################
+
+def prepare_distributed_job(sim_type, cmd_pars, session_path):
+    """Prepare the job of a simulation to send to a worker. Like run_simulation_filesafe, all files are flattened to their basename:
+    the simulation setup and layer files are rewritten with the basename of the input files and the cmd_pars use basenames only.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    dict
+        Job with the keys sim_type, cmd_pars, files (basename -> hash) and outputs (parameter -> basename)
+    dict
+        Source of each file by hash, a path or the rewritten content as bytes
+    dict
+        Destination path of each output file by parameter, see get_output_files
+    """
+    dev_par_file = None
+    for cmd_par in cmd_pars:
+        if cmd_par['par'] == 'dev_par_file':
+            dev_par_file = cmd_par['val']
+            break
+    if dev_par_file is None:
+        raise ValueError('Device parameters file not found in the command parameters list.')
+
+    # The simulation setup and layer files refer to other files, these are rewritten with basenames
+    layer_files = {layer[1]: layer[2] for layer in read_devpar_file_cached(os.path.join(session_path, dev_par_file), layers_read_from_txt)}
+    for cmd_par in cmd_pars:
+        if cmd_par['par'].startswith('l') and cmd_par['par'][1:].isdigit():
+            layer_files[cmd_par['par']] = str(cmd_par['val'])
+    rewrite_files = [os.path.abspath(os.path.join(session_path, f)) for f in [dev_par_file] + list(layer_files.values())]
+
+    files, file_sources = {}, {}
+    for file in get_input_files(sim_type, cmd_pars, session_path):
+        if file in rewrite_files:
+            data = devpar_write_to_txt(make_basename_input_files(file, updateFile = False)).encode('utf-8')
+            file_hash = hashlib.sha256(data).hexdigest()
+            file_sources[file_hash] = data
+        else:
+            file_hash = get_file_hash(file)
+            file_sources[file_hash] = file
+        files[os.path.basename(file)] = file_hash
+
+    output_files = get_output_files(sim_type, cmd_pars, session_path)
+    job = {'sim_type': sim_type.lower(),
+           'cmd_pars': make_basename_file_cmd_pars([dict(cmd_par) for cmd_par in cmd_pars], except_output_files = False),
+           'files': files,
+           'outputs': {par_name: os.path.basename(path) for par_name, path in output_files.items()}}
+    return job, file_sources, output_files
+
+def connect_worker(address, token = None, connect_timeout = 10):
+    """Connect to a worker and say hello.
+
+    Parameters
+    ----------
+    address : string or tuple
+        Address of the worker as 'host:port' or (host, port)
+    token : string, optional
+        Shared secret of the worker, by default None
+    connect_timeout : float, optional
+        Time in s to wait for the connection and the reply, by default 10
+
+    Returns
+    -------
+    socket.socket
+        Connected socket
+    dict
+        Hello reply of the worker with the keys n_slots and files (the hashes in its file store)
+    """
+    sock = socket.create_connection(parse_address(address), timeout = connect_timeout)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_message(sock, {'type': 'hello', 'token': token})
+        reply = recv_message(sock)
+    except Exception:
+        sock.close()
+        raise
+    if reply.get('type') != 'hello':
+        sock.close()
+        raise ConnectionError('Worker ' + str(address) + ' refused the connection: ' + str(reply.get('message')))
+    return sock, reply
+
+def run_simulation_distributed(sim_type, cmd_pars_list, session_path, workers, verbose = False, **kwargs):
+    """Run a list of simulations on worker daemons (see run_worker), e.g. on several machines.
+    For each free slot of a worker, a connection is opened that takes the next job from a shared queue, so faster workers run more jobs.
+    The input files are sent by hash, only once per worker. The output files are sent back and written to the paths requested in the cmd_pars.
+    A worker that does not send a heartbeat or result within heartbeat_timeout is considered dead and its job is queued again for the other workers.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable and the input files
+    workers : List
+        Addresses of the workers as 'host:port' or (host, port)
+    verbose : bool, optional
+        If True, print the progress and the worker failures, by default False
+    **kwargs : dict
+        Additional keyword arguments:
+        token : string, shared secret of the workers, by default None
+        heartbeat_interval : float, interval in s at which a worker sends a heartbeat while a job runs, by default 5
+        heartbeat_timeout : float, time in s without any message after which a worker is considered dead, by default 6 * heartbeat_interval
+        max_attempts : int, maximum number of times a job is started, e.g. after worker failures, by default 3
+        progress_callback : function, called as progress_callback(idx, returncode, n_done, n_total) when a job finishes, by default None
+        hooks : dict, functions called when a job is queued (submit), sent to a worker (start), finished, failed or queued again after a worker failure (retry), see call_hook
+        fail_fast, fail_fast_codes : cancel the batch after the first simulation(s) failed with an input error, see apply_fail_fast
+        cancel_token : CancellationToken, cancel the batch: the queued jobs are not sent and the connections are closed, so the workers kill the running jobs. 
+            They return CANCELLED_ERROR_CODE
+        retry_ladder, retry_codes : queue the jobs that failed to converge again with the next rung of the retry ladder, see RetryLadder
+        runtime_history : string, runtime history file to add the wall time on the worker and the features of each simulation to, see record_simulation_runtime, by default None
+        timeout, cpu_time_limit, memory_limit, niceness : per-simulation watchdog limits on the worker, see execute_simulation
+        pin_cpus, cpus_per_job : pin each simulation to free CPUs of the worker, see execute_simulation
+
+    Returns
+    -------
+    int
+        Overall return code of the run, see get_parallel_results
+    List
+        Return list of messages for each simulation
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. It behaves like the list of return codes, NOT_RUN_ERROR_CODE for simulations that could not be run
+
+    The resource usage of the simulations on the workers can be retrieved afterwards with get_last_batch_resource_usage
+    """
+    cancel_token = apply_fail_fast(kwargs)
+    retry_ladder = get_retry_ladder(kwargs)
+    token = kwargs.get('token', None)
+    heartbeat_interval = kwargs.get('heartbeat_interval', 5)
+    heartbeat_timeout = kwargs.get('heartbeat_timeout', 6 * heartbeat_interval)
+    max_attempts = kwargs.get('max_attempts', 3)
+    progress_callback = kwargs.get('progress_callback', None)
+    hooks = kwargs.get('hooks', None)
+    runtime_history = kwargs.get('runtime_history', None)
+    limits = {key: kwargs[key] for key in ['timeout', 'cpu_time_limit', 'memory_limit', 'niceness', 'pin_cpus', 'cpus_per_job'] if kwargs.get(key) is not None}
+
+    n_total = len(cmd_pars_list)
+    return_code_list = [None] * n_total
+    msg_list = [''] * n_total
+    attempts = [0] * n_total
+    usage_list = [None] * n_total
+    start_list = [float('nan')] * n_total
+    rung_list = [None] * n_total # Rung of the retry ladder the job is run with
+    ladders = {} # Rungs that are left and the first result of each job that is run again by the retry ladder
+    pending = queue.Queue()
+    for idx in range(n_total):
+        call_hook(hooks, 'submit', idx, n_total = n_total)
+        pending.put(idx)
+
+    state = {'n_done': 0, 'n_slots': 0}
+    state_lock = threading.Lock()
+    all_done = threading.Event()
+    if n_total == 0:
+        all_done.set()
+
+    def finish_job(idx, returncode, message, wall = 0.0):
+        with state_lock:
+            return_code_list[idx] = returncode
+            msg_list[idx] = message
+            state['n_done'] += 1
+            n_done = state['n_done']
+        if progress_callback is not None:
+            progress_callback(idx, returncode, n_done, n_total)
+        call_finish_hooks(hooks, idx, returncode, wall, n_done = n_done, n_total = n_total)
+        if verbose:
+            print(str(n_done) + '/' + str(n_total) + ' simulations finished.')
+        if n_done == n_total:
+            all_done.set()
+
+    def retry_job(idx, returncode, message, wall):
+        # Queue the job again with the next rung of the retry ladder, returns the final (returncode, message, wall) when the job is finished
+        if idx not in ladders:
+            if returncode not in retry_ladder.codes:
+                return returncode, message, wall
+            ladders[idx] = {'rungs': retry_ladder.get_order(), 'first': (returncode, message, wall)}
+        elif returncode in SUCCESS_CODES and returncode not in retry_ladder.codes:
+            retry_ladder.record(rung_list[idx])
+            return returncode, message, wall
+        ladder = ladders[idx]
+        if len(ladder['rungs']) == 0 or (cancel_token is not None and cancel_token.cancelled):
+            # Not rescued, report the original failure
+            retry_ladder.record(None)
+            rung_list[idx] = None
+            return ladder['first']
+        rung_list[idx] = ladder['rungs'].pop(0)
+        call_hook(hooks, 'retry', idx, attempt = len(retry_ladder.rungs) - len(ladder['rungs']) + 1, rung = rung_list[idx], reason = 'error ' + str(ladder['first'][0]))
+        with state_lock:
+            attempts[idx] = 0
+        pending.put(idx)
+        return None
+
+    def prepare_job(idx):
+        # Local part of a job, errors are errors of this job and not of the worker
+        cmd_pars = cmd_pars_list[idx] if rung_list[idx] is None else retry_ladder.get_cmd_pars(cmd_pars_list[idx], rung_list[idx])
+        job, file_sources, output_files = prepare_distributed_job(sim_type, cmd_pars, session_path)
+        job.update({'type': 'run', 'job_id': idx, 'limits': limits, 'heartbeat_interval': heartbeat_interval})
+        return job, file_sources, output_files
+
+    def read_missing_files(worker, job, file_sources):
+        # Read the input files this worker does not have yet
+        with worker['lock']:
+            missing = set(job['files'].values()) - worker['files']
+        files = {}
+        for file_hash in missing:
+            source = file_sources[file_hash]
+            if not isinstance(source, bytes):
+                with open(source, 'rb') as fp:
+                    source = fp.read()
+            files[file_hash] = source
+        return files
+
+    def send_job(sock, worker, idx, job, files, attempt):
+        # Send the missing input files and the job to the worker, returns the result or None when the worker is missing files
+        for file_hash, data in files.items():
+            send_message(sock, {'type': 'put_file', 'hash': file_hash, 'data': base64.b64encode(data).decode('ascii')})
+            reply = recv_message(sock)
+            if reply.get('type') != 'ok':
+                raise ConnectionError('Worker failed to store a file: ' + str(reply.get('message')))
+            with worker['lock']:
+                worker['files'].add(file_hash)
+
+        call_hook(hooks, 'start', idx, worker = worker['address'], attempt = attempt)
+        send_message(sock, job)
+        while True:
+            reply = recv_message(sock)
+            if reply.get('type') != 'heartbeat':
+                break
+        if reply.get('type') == 'missing_files':
+            # The file store of the worker has been cleaned, the files are sent again
+            with worker['lock']:
+                worker['files'].difference_update(reply['hashes'])
+            return None
+        if reply.get('type') != 'result':
+            raise ConnectionError('Unexpected reply from worker: ' + str(reply))
+        return reply
+
+    def store_job_result(idx, reply, output_files):
+        for par_name, data in reply['outputs'].items():
+            destination = output_files[par_name]
+            tmp_file = destination + '.' + str(uuid.uuid4()) + '.tmp'
+            with open(tmp_file, 'wb') as fp:
+                fp.write(base64.b64decode(data))
+            os.replace(tmp_file, destination)
+        usage_list[idx] = reply['timing'].get('usage')
+        start_list[idx] = reply['timing']['start']
+        if runtime_history is not None:
+            record_simulation_runtime(runtime_history, sim_type, cmd_pars_list[idx], session_path, reply['returncode'], reply['timing']['wall'])
+        return reply['returncode'], reply['message'], reply['timing']['wall']
+
+    def slot(sock, worker):
+        sock.settimeout(heartbeat_timeout)
+        try:
+            while not all_done.is_set() and not (cancel_token is not None and cancel_token.cancelled):
+                try:
+                    idx = pending.get(timeout = 0.1)
+                except queue.Empty:
+                    continue
+                with state_lock:
+                    attempts[idx] += 1
+                    attempt = attempts[idx]
+                try:
+                    job, file_sources, output_files = prepare_job(idx)
+                except (OSError, ValueError) as e:
+                    # Errors on the coordinator only fail this job, the worker is fine
+                    finish_job(idx, NOT_RUN_ERROR_CODE, 'Simulation could not be prepared: ' + repr(e))
+                    continue
+
+                reply, read_error = None, None
+                while reply is None:
+                    try:
+                        files = read_missing_files(worker, job, file_sources)
+                    except OSError as e:
+                        read_error = e
+                        break
+                    try:
+                        reply = send_job(sock, worker, idx, job, files, attempt)
+                    except (OSError, ConnectionError, ValueError) as e:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            # The connection was closed to cancel the job
+                            finish_job(idx, CANCELLED_ERROR_CODE, get_result_message(CANCELLED_ERROR_CODE, ''))
+                            return
+                        # Worker died or the connection broke, queue the job again for the other workers
+                        if verbose:
+                            print('Worker ' + worker['address'] + ' failed: ' + repr(e))
+                        if attempt < max_attempts:
+                            call_hook(hooks, 'retry', idx, attempt = attempt + 1, reason = 'worker ' + worker['address'] + ' failed: ' + repr(e))
+                            pending.put(idx)
+                        else:
+                            finish_job(idx, NOT_RUN_ERROR_CODE, 'Simulation could not be run after ' + str(attempt) + ' attempts, last error: ' + repr(e))
+                        return
+                if read_error is not None:
+                    finish_job(idx, NOT_RUN_ERROR_CODE, 'Simulation could not be prepared: ' + repr(read_error))
+                    continue
+
+                try:
+                    returncode, message, wall = store_job_result(idx, reply, output_files)
+                except OSError as e:
+                    finish_job(idx, NOT_RUN_ERROR_CODE, 'Output files of the simulation could not be written: ' + repr(e))
+                    continue
+                if retry_ladder is not None:
+                    finished = retry_job(idx, returncode, message, wall)
+                    if finished is None:
+                        continue
+                    returncode, message, wall = finished
+                finish_job(idx, returncode, message, wall)
+        finally:
+            sock.close()
+            with state_lock:
+                state['n_slots'] -= 1
+                if state['n_slots'] == 0:
+                    # No workers left
+                    all_done.set()
+
+    # Open a connection for each slot of each worker
+    connections = []
+    for address in workers:
+        address = address if isinstance(address, str) else '{}:{}'.format(*address)
+        try:
+            sock, hello = connect_worker(address, token)
+        except (OSError, ConnectionError) as e:
+            print('Warning: could not connect to worker ' + address + ': ' + repr(e))
+            continue
+        worker = {'address': address, 'files': set(hello['files']), 'lock': threading.Lock()}
+        connections.append((sock, worker))
+        for _ in range(hello['n_slots'] - 1):
+            try:
+                connections.append((connect_worker(address, token)[0], worker))
+            except (OSError, ConnectionError):
+                break
+    if len(connections) == 0 and n_total > 0:
+        raise ConnectionError('Could not connect to any of the workers: ' + ', '.join(str(w) for w in workers))
+
+    def close_connections():
+        # Unblocks the slots waiting for a reply, the workers kill their job when the next heartbeat cannot be sent
+        for sock, _ in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    callback_key = cancel_token.add_callback(close_connections) if cancel_token is not None else None
+
+    state['n_slots'] = len(connections)
+    threads = [threading.Thread(target=slot, args=connection, daemon=True) for connection in connections]
+    for thread in threads:
+        thread.start()
+    all_done.wait()
+    for thread in threads:
+        thread.join()
+    if callback_key is not None:
+        cancel_token.remove_callback(callback_key)
+
+    # Jobs that were still queued when the batch was cancelled or the last worker failed
+    missing = [idx for idx in range(n_total) if return_code_list[idx] is None]
+    if len(missing) > 0 and cancel_token is not None and cancel_token.cancelled:
+        for idx in missing:
+            return_code_list[idx] = CANCELLED_ERROR_CODE
+            msg_list[idx] = get_result_message(CANCELLED_ERROR_CODE, '')
+    elif len(missing) > 0:
+        print('Warning: ' + str(len(missing)) + ' simulations did not run, no workers left.')
+        for idx in missing:
+            return_code_list[idx] = NOT_RUN_ERROR_CODE
+            msg_list[idx] = 'Simulation did not run, no workers left.'
+    resource_usage_local.batch = summarize_resource_usage(usage_list)
+
+    # Imported here, parallel_sim imports this module
+    from pySIMsalabim.utils.parallel_sim import get_parallel_results, get_batch_result
+    result, message_list = get_parallel_results(return_code_list, cmd_pars_list, session_path)
+    # Keep the messages of the workers for the failed simulations, they contain the console output of the simulation
+    msg_list = [msg if msg != '' and code not in SUCCESS_CODES else message for msg, message, code in zip(msg_list, message_list, return_code_list)]
+    batch = get_batch_result(sim_type, cmd_pars_list, session_path, return_code_list, msg_list, usage_list, start_list, rung_list)
+    if verbose and retry_ladder is not None:
+        retry_ladder.report()
+    return result, msg_list, batch
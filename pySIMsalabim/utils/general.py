@@ -1,10 +1,39 @@
 """Functions for general use"""
 ######### Package Imports #########################################################################
 
-import os, subprocess, uuid, shutil, time
+import os, sys, subprocess, uuid, shutil, time, shlex, signal, threading, weakref, tempfile, math
 import pandas as pd
-from subprocess import run, PIPE
+from subprocess import run, PIPE, DEVNULL, Popen, TimeoutExpired
 from pySIMsalabim.utils.device_parameters import *
+from pySIMsalabim.utils.sim_cache import run_simulation_cached
+from pySIMsalabim.utils.runtime_history import record_simulation_runtime
+from pySIMsalabim.utils.results import SimulationResult, CANCELLED_ERROR_CODE, SUCCESS_CODES
+from pySIMsalabim.utils.utils import update_cmd_pars
+if os.name != 'nt':
+    import resource, fcntl
+else:
+    from pySIMsalabim.aux_funcs.PathChecksWin import convert_to_long_path
+
+######### Constants ###############################################################################
+
+TIMEOUT_ERROR_CODE = 124 # Return code of a simulation killed by the watchdog after exceeding its wall-clock time limit
+CPU_LIMIT_ERROR_CODE = 125 # Return code of a simulation killed after exceeding its CPU time limit
+FAIL_FAST_CODES = [90, 91, 96] # Errors in the input that make all the other simulations of a batch fail the same way, see add_fail_fast_hook
+RETRY_CODES = [93, 94] # Numerical failure and failure to converge, the simulations that failed with these codes are run again by the retry ladder, see RetryLadder
+# Rungs of the retry ladder, from mild to strong: more iterations, a smaller acceleration (damping) of the solver and finally looser tolerances
+DEFAULT_RETRY_LADDER = [[{'par': 'maxItPois', 'val': '5000'}, {'par': 'maxItSS', 'val': '5000'}, {'par': 'maxItTrans', 'val': '2000'}],
+                        [{'par': 'maxItPois', 'val': '5000'}, {'par': 'maxItSS', 'val': '5000'}, {'par': 'maxItTrans', 'val': '2000'}, 
+                         {'par': 'minAcc', 'val': '0.05'}, {'par': 'maxAcc', 'val': '0.5'}],
+                        [{'par': 'maxItPois', 'val': '5000'}, {'par': 'maxItSS', 'val': '5000'}, {'par': 'maxItTrans', 'val': '2000'}, 
+                         {'par': 'minAcc', 'val': '0.05'}, {'par': 'maxAcc', 'val': '0.5'}, {'par': 'tolPois', 'val': '1e-4'}, {'par': 'tolDens', 'val': '1e-6'}]]
+FICLONE = 0x40049409 # ioctl request to clone (reflink) a file on Linux
+HOOK_EVENTS = ['submit', 'start', 'finish', 'failure', 'retry'] # Events for which a hook can be passed to the runners, see call_hook
+sandbox_local = threading.local() # Sandboxes of the current thread, see get_sandbox
+idle_sandboxes = {} # Sandboxes of the threads that ended by root folder, reused by the next threads, see get_sandbox
+idle_sandboxes_lock = threading.RLock()
+session_locks = {} # Lock of each session folder, see get_session_lock
+session_locks_lock = threading.Lock()
+resource_usage_local = threading.local() # Resource usage of the last simulation and batch run by the current thread, see get_last_resource_usage
 
 ######### Function Definitions ####################################################################
 
@@ -27,8 +56,16 @@ def fatal_error_message(errorcode):
         message = 'Stack overflow error: This error is only reported when stack checking is enabled.'
     elif errorcode == 205:
         message = 'Floating point overflow.'
+    elif errorcode == 203:
+        message = 'Heap overflow error: The simulation ran out of memory, check the memory limit.'
     elif errorcode == 206:
         message = 'Floating point underflow.'
+    elif errorcode == TIMEOUT_ERROR_CODE:
+        message = 'Simulation killed, runtime exceeds the wall-clock time limit set by timeout.'
+    elif errorcode == CPU_LIMIT_ERROR_CODE:
+        message = 'Simulation killed, CPU time exceeds the limit set by cpu_time_limit.'
+    elif errorcode == CANCELLED_ERROR_CODE:
+        message = 'Simulation cancelled, the batch was cancelled before or while it ran.'
     else:
         message = 'A fatal error occured.'
     return message
@@ -68,6 +105,12 @@ def error_message(errorcode):
             message += 'Runtime exceeds limit set by timeout.'
         elif errorcode == 99:
             message += 'Programming error (i.e. not due to the user!).'
+    elif errorcode == TIMEOUT_ERROR_CODE:
+        message = 'Error '+str(errorcode) +': Simulation killed, runtime exceeds the wall-clock time limit set by timeout.'
+    elif errorcode == CPU_LIMIT_ERROR_CODE:
+        message = 'Error '+str(errorcode) +': Simulation killed, CPU time exceeds the limit set by cpu_time_limit.'
+    elif errorcode == CANCELLED_ERROR_CODE:
+        message = 'Error '+str(errorcode) +': Simulation cancelled, the batch was cancelled before or while it ran.'
     elif errorcode > 100:
         message = 'Fatal error '+str(errorcode) +': '
         if errorcode == 106:
@@ -78,6 +121,8 @@ def error_message(errorcode):
             message += 'Range check error.'
         elif errorcode == 202:
             message += 'Stack overflow error: This error is only reported when stack checking is enabled.'
+        elif errorcode == 203:
+            message += 'Heap overflow error: The simulation ran out of memory, check the memory limit.'
         elif errorcode == 205:
             message += 'Floating point overflow.'
         elif errorcode == 206:
@@ -125,7 +170,7 @@ def construct_cmd(sim_type, cmd_pars):
                 # Add the device parameters file as " -dev_par_file "dev_par_file"
                 args_single = ' "' + i['val']+ '"'
             else:
-                args_single = ' ''' + i['val']+ ' '''
+                args_single = ' ' + shlex.quote(str(i['val']))
             cmd_line = cmd_line + args_single
             # After the dev_par_file key had been found once, stop the loop. If more than one dev_par_file is specified, the rest are ignored.
             break
@@ -137,12 +182,1123 @@ def construct_cmd(sim_type, cmd_pars):
             if os.name == 'nt': #add  "" to the parameter name if on Windows
                 args_single = ' -"' + i['par'] + '" "' + i['val'] + '"'
             else:
-                args_single = ' -' +i['par'] + ' ' + i['val']
+                args_single = ' -' +i['par'] + ' ' + shlex.quote(str(i['val']))
             cmd_line = cmd_line + args_single
     
     return cmd_line
 
-def run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose = False):
+def construct_cmd_args(sim_type, cmd_pars, session_path = None):
+    """Construct the list of arguments to run a SIMsalabim executable directly, i.e. without a shell
+
+    Parameters
+    ----------
+    sim_type : string
+        Which program to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string, optional
+        Folder with the simss or zimt executable. If given, the absolute path of the executable is used, by default None
+
+    Returns
+    -------
+    List
+        List of arguments, starting with the executable
+    """
+    # Start with the executable name
+    if os.name == 'nt':
+        executable = sim_type + '.exe'
+    else:
+        executable = sim_type
+    if session_path is not None:
+        executable = os.path.join(os.path.abspath(session_path), executable)
+    elif os.name != 'nt':
+        executable = './' + executable
+    cmd_args = [executable]
+
+    # The device parameter file must be placed first, as is required by SIMsalabim. If more than one dev_par_file is specified, the rest are ignored.
+    for i in cmd_pars:
+        if i['par'] == 'dev_par_file':
+            cmd_args.append(str(i['val']))
+            break
+
+    # Add the parameters as -par_name par_value
+    for i in cmd_pars:
+        if i['par'] != 'dev_par_file':
+            cmd_args.extend(['-' + i['par'], str(i['val'])])
+
+    return cmd_args
+
+def get_console_error_message(console_output):
+    """Get the error message from the console output of a SIMsalabim simulation. 
+    All lines after 'Program will be terminated.' are considered part of the error message.
+
+    Parameters
+    ----------
+    console_output : bytes or string
+        Console output of the simulation
+
+    Returns
+    -------
+    string
+        The error message, empty if no error message was found
+    """
+    if console_output is None:
+        return ''
+    if isinstance(console_output, bytes):
+        console_output = console_output.decode('utf-8', errors='replace')
+
+    startMessage = False
+    message = ''
+    for line_console in console_output.split('\n'):
+        if startMessage is True:
+            # The actual error message. Since the error message can be multi-line, append each line.
+            message = message + line_console + '\n'
+        if 'Program will be terminated.' in line_console:
+            # Last 'regular' line of the console output. The next line is from the error message.
+            startMessage = True
+    return message
+
+def get_result_message(returncode, console_output):
+    """Get the message to display on the UI for a finished simulation, for both success and failure.
+
+    Parameters
+    ----------
+    returncode : int
+        Return code of the simulation process
+    console_output : bytes or string
+        Console output of the simulation
+
+    Returns
+    -------
+    string
+        Return message to display on the UI
+    """
+    if returncode not in SUCCESS_CODES:
+        # SIMsalabim raised an error, stop the program and return the error message on the UI.
+        if returncode >= 100:
+            # A fatal (numerical) error occurred. Return errorcode and a standard error message.
+            message = fatal_error_message(returncode)
+        else:
+            # Simsalabim raised an error. Read the console output for the details / error messaging. 
+            message = get_console_error_message(console_output)
+
+        # Show the message as an error on the screen. Do not continue to the simulation results page.
+        message = 'Simulation raised an error with Errorcode: ' + str(returncode) + '\n\n' + message
+    elif returncode == 95:
+        # In case of errorcode 95, failures during the simulations were encountered but the simulation did not halt. Show 'error' messages on the UI.
+        message = get_console_error_message(console_output)
+        message = 'Simulation completed but raised errorcode: ' + str(returncode) + '\n\n' + 'The simulation finished but at least 1 point did not converge. \n\n' + message
+    elif returncode == 3:
+        # Special case, should not occur in the web version.
+        # When the program exits as a success but no simulation has been run, e.g. in the case of the autotidy functionality. 
+        message = 'Action completed'
+    else:
+        # Simulation completed as expected.
+        message = 'Simulation complete. Output can be found in the Simulation results.'
+    return message
+
+def execute_simulation(cmd_args, cwd, capture_output = False, stdout_file = None, **kwargs):
+    """Execute a SIMsalabim executable directly from an argument list, i.e. without starting a shell.
+        The console output is only kept in memory when it is needed, otherwise it is written to stdout_file or discarded.
+        Optionally, the simulation is bounded by a watchdog: a wall-clock time limit, a CPU time limit, a memory limit and a niceness.
+        A simulation that exceeds its wall-clock time limit is killed together with its process group and returns TIMEOUT_ERROR_CODE, 
+        a simulation that exceeds its CPU time limit returns CPU_LIMIT_ERROR_CODE.
+        A simulation that is cancelled with its cancel_token is not started, or killed together with its process group, and returns CANCELLED_ERROR_CODE.
+
+    Parameters
+    ----------
+    cmd_args : List
+        List of arguments, starting with the executable, see construct_cmd_args
+    cwd : string
+        Folder in which the simulation is run
+    capture_output : bool, optional
+        If True, the console output is returned in the stdout attribute of the result, by default False
+    stdout_file : string, optional
+        File to write the console output to when it is not captured. If None, the console output is discarded, by default None
+    **kwargs : dict
+        Additional keyword arguments:
+        timeout : float, wall-clock time limit in s, by default None (no limit)
+        cpu_time_limit : int, CPU time limit in s (Linux/macOS only), by default None (no limit)
+        memory_limit : int, limit of the address space in bytes (RLIMIT_AS, Linux/macOS only), by default None (no limit)
+        niceness : int, niceness added to the simulation process, by default None
+        pin_cpus : string, pin the simulation process to cpus_per_job free CPUs, in the order of the policy 'compact' or 'scatter' (Linux only), 
+            see acquire_cpus. By default None (not pinned)
+        cpus_per_job : int, number of CPUs to pin the simulation process to, by default 1
+        cancel_token : CancellationToken, token to cancel the simulation, see CancellationToken, by default None
+
+    Returns
+    -------
+    CompletedProcess
+        Output object with the returncode and, if captured, the console output of the simulation. 
+        The usage attribute holds the resource usage of the simulation, see get_resource_usage. It is also available with get_last_resource_usage.
+    """
+    timeout = kwargs.get('timeout', None)
+    cpu_time_limit = kwargs.get('cpu_time_limit', None)
+    memory_limit = kwargs.get('memory_limit', None)
+    niceness = kwargs.get('niceness', None)
+    pin_cpus = kwargs.get('pin_cpus', None)
+    cpus_per_job = kwargs.get('cpus_per_job', 1)
+    cancel_token = kwargs.get('cancel_token', None)
+
+    if cancel_token is not None and cancel_token.cancelled:
+        resource_usage_local.last = None
+        result = subprocess.CompletedProcess(cmd_args, CANCELLED_ERROR_CODE, None)
+        result.usage = None
+        return result
+
+    cpu_claim = None
+    if pin_cpus is not None:
+        if hasattr(os, 'sched_setaffinity') and os.name != 'nt':
+            # Wait until enough CPUs are free, also from other pySIMsalabim processes on this host
+            cpu_claim = retry_with_backoff(acquire_cpus, cpus_per_job, pin_cpus, exceptions = (BlockingIOError,), timeout = float('inf'), warning_timeout = 60, 
+                                           max_delay = 0.5, description = 'waiting for a free CPU to pin the simulation to')
+        else:
+            print('Warning: pin_cpus is only supported on Linux and is ignored.')
+
+    popen_kwargs = {}
+    if os.name == 'nt':
+        if cpu_time_limit is not None or memory_limit is not None:
+            print('Warning: cpu_time_limit and memory_limit are not supported on Windows and are ignored.')
+        if niceness is not None and niceness > 0:
+            popen_kwargs['creationflags'] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    else:
+        # Run the simulation in its own process group so that it can be killed cleanly
+        popen_kwargs['start_new_session'] = timeout is not None or cancel_token is not None
+    cpu_affinity = [cpu for cpu, _ in cpu_claim] if cpu_claim is not None else None
+    popen_args = cmd_args
+    if os.name != 'nt' and not hasattr(resource, 'prlimit') and (cpu_time_limit is not None or memory_limit is not None):
+        # No prlimit (macOS), set the limits in a shell that is replaced by the simulation
+        popen_args = ['/bin/sh', '-c', get_ulimit_cmd(cpu_time_limit, memory_limit) + 'exec "$@"', 'sh'] + list(cmd_args)
+        cpu_time_limit_child, memory_limit_child = None, None
+    else:
+        cpu_time_limit_child, memory_limit_child = cpu_time_limit, memory_limit
+
+    if capture_output:
+        stdout = PIPE
+    elif stdout_file is not None:
+        stdout = open(stdout_file, 'wb')
+    else:
+        stdout = DEVNULL
+
+    start = time.perf_counter()
+    try:
+        with Popen(popen_args, cwd=cwd, stdout=stdout, **popen_kwargs) as process:
+            if os.name != 'nt':
+                # Apply the limits to the started process instead of in a preexec_fn, which is not safe when threads are running
+                try:
+                    set_process_limits(process.pid, cpu_time_limit_child, memory_limit_child, niceness, cpu_affinity)
+                except ProcessLookupError:
+                    # The simulation already exited
+                    pass
+                except OSError:
+                    process.kill()
+                    process.wait()
+                    raise
+            if os.name == 'nt':
+                cancelled = threading.Event()
+                callback_key = None
+                if cancel_token is not None:
+                    callback_key = cancel_token.add_callback(lambda: (cancelled.set(), kill_process_group(process)))
+                try:
+                    output, _ = process.communicate(timeout=timeout)
+                    returncode = CANCELLED_ERROR_CODE if cancelled.is_set() else process.returncode
+                except TimeoutExpired:
+                    kill_process_group(process)
+                    output, _ = process.communicate()
+                    returncode = TIMEOUT_ERROR_CODE
+                finally:
+                    if callback_key is not None:
+                        cancel_token.remove_callback(callback_key)
+                usage = get_resource_usage(time.perf_counter() - start)
+            else:
+                output, killed, rusage, proc_stats = wait_for_simulation(process, timeout, cancel_token = cancel_token)
+                returncode = {'timeout': TIMEOUT_ERROR_CODE, 'cancelled': CANCELLED_ERROR_CODE}.get(killed, process.returncode)
+                usage = get_resource_usage(time.perf_counter() - start, rusage, proc_stats)
+    finally:
+        if stdout_file is not None and not capture_output:
+            stdout.close()
+        if cpu_claim is not None:
+            release_cpus(cpu_claim)
+
+    if cpu_time_limit is not None and os.name != 'nt':
+        # Killed by the kernel after reaching the soft (SIGXCPU) or hard (SIGKILL) CPU time limit. 
+        # A SIGKILL only counts when the CPU time reached the limit, it can also come from the OOM killer or the user
+        cpu_time = usage.get('user', 0) + usage.get('sys', 0)
+        if returncode == -signal.SIGXCPU or (returncode == -signal.SIGKILL and cpu_time >= int(max(1, cpu_time_limit))):
+            returncode = CPU_LIMIT_ERROR_CODE
+
+    resource_usage_local.last = usage
+    result = subprocess.CompletedProcess(cmd_args, returncode, output)
+    result.usage = usage
+    return result
+
+def wait_for_simulation(process, timeout = None, grace_time = 2, cancel_token = None):
+    """Wait for a simulation process to exit and collect its resource usage (Linux/macOS only). 
+    The process is reaped with os.wait4 to get its rusage. Before that, the I/O counters are read from /proc/<pid>/io (Linux only) while the exited process still exists.
+    Without os.waitid (macOS) the process is polled instead, so the watchdog is never blocked by the wait.
+    On Linux, the ru_maxrss of the process includes the memory of the forked Python process, so the peak memory is sampled from /proc/<pid>/status (VmHWM) while it runs.
+    A watchdog thread kills the process group after timeout s or when cancel_token is cancelled (SIGTERM, then SIGKILL after grace_time s).
+
+    Parameters
+    ----------
+    process : Popen
+        The simulation process, started in its own session/process group when timeout or cancel_token is set
+    timeout : float, optional
+        Wall-clock time limit in s, by default None (no limit)
+    grace_time : float, optional
+        Time in s to wait after SIGTERM before sending SIGKILL, by default 2
+    cancel_token : CancellationToken, optional
+        Token to cancel the simulation, see CancellationToken, by default None
+
+    Returns
+    -------
+    bytes or None
+        Console output of the simulation if stdout is a pipe, None otherwise
+    string or None
+        'timeout' or 'cancelled' if the simulation was killed by the watchdog, None otherwise
+    resource.struct_rusage
+        Resource usage of the process
+    dict
+        Statistics of the process from /proc (Linux only): the I/O counters, see read_proc_io, and max_rss, the sampled peak resident set size in bytes
+    """
+    output = []
+    reader = None
+    if process.stdout is not None:
+        # Read the console output while waiting, so the process never blocks on a full pipe
+        reader = threading.Thread(target=lambda: output.append(process.stdout.read()), daemon=True)
+        reader.start()
+
+    exit_lock = threading.Lock() # The process group is only signalled while the process has not been reaped, so its pid cannot be reused
+    exited = threading.Event()
+    killed = []
+    def watchdog(reason):
+        for sig in [signal.SIGTERM, signal.SIGKILL]:
+            with exit_lock:
+                if exited.is_set():
+                    return
+                if len(killed) == 0:
+                    killed.append(reason)
+                try:
+                    os.killpg(process.pid, sig)
+                except ProcessLookupError:
+                    return
+            if exited.wait(grace_time):
+                return
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, watchdog, args = ('timeout',))
+        timer.daemon = True
+        timer.start()
+    callback_key = None
+    if cancel_token is not None:
+        # The watchdog waits for the process to exit, so it does not run in the thread that cancels the token
+        callback_key = cancel_token.add_callback(lambda: threading.Thread(target = watchdog, args = ('cancelled',), daemon = True).start())
+
+    proc_stats = {}
+    use_proc = hasattr(os, 'waitid') and os.path.isdir('/proc')
+    sampler = None
+    if use_proc:
+        # The peak memory (VmHWM) only grows, so sampling it more and more sparsely only misses the peak of the last moments
+        def sample_max_rss():
+            interval = 0.01
+            while not exited.wait(interval):
+                max_rss = read_proc_max_rss(process.pid)
+                if max_rss is not None:
+                    proc_stats['max_rss'] = max_rss
+                interval = min(2 * interval, 1)
+        max_rss = read_proc_max_rss(process.pid)
+        if max_rss is not None:
+            proc_stats['max_rss'] = max_rss
+        sampler = threading.Thread(target=sample_max_rss, daemon=True)
+        sampler.start()
+
+    try:
+        # Wait outside exit_lock, so the watchdog can still kill the process. The lock is only held to reap it
+        if hasattr(os, 'waitid'):
+            # Wait without reaping the process, its I/O counters are gone after it is reaped
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            if use_proc:
+                proc_stats.update(read_proc_io(process.pid))
+        pid = 0
+        interval = 0.01
+        while pid == 0:
+            with exit_lock:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid != 0:
+                    exited.set()
+                    break
+            # No os.waitid (macOS), poll until the process has exited
+            time.sleep(interval)
+            interval = min(2 * interval, 0.1)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        exited.set()
+        if timer is not None:
+            timer.cancel()
+        if callback_key is not None:
+            cancel_token.remove_callback(callback_key)
+    if sampler is not None:
+        sampler.join()
+    if reader is not None:
+        reader.join()
+    return (output[0] if len(output) > 0 else None), (killed[0] if len(killed) > 0 else None), rusage, proc_stats
+
+def read_proc_max_rss(pid):
+    """Read the peak resident set size (VmHWM) of a running process from /proc/<pid>/status (Linux only).
+
+    Parameters
+    ----------
+    pid : int
+        Process id
+
+    Returns
+    -------
+    int or None
+        Peak resident set size in bytes, None if the process has exited or /proc/<pid>/status is not readable
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def read_proc_io(pid):
+    """Read the I/O counters of a process from /proc/<pid>/io (Linux only).
+
+    Parameters
+    ----------
+    pid : int
+        Process id
+
+    Returns
+    -------
+    dict
+        Counters with the keys read_chars, write_chars (all reads/writes) and read_bytes, write_bytes (from/to storage), empty if /proc/<pid>/io is not readable
+    """
+    names = {'rchar': 'read_chars', 'wchar': 'write_chars', 'read_bytes': 'read_bytes', 'write_bytes': 'write_bytes'}
+    io = {}
+    try:
+        with open('/proc/{}/io'.format(pid)) as fp:
+            for line in fp:
+                key, val = line.split(':')
+                if key in names:
+                    io[names[key]] = int(val)
+    except (OSError, ValueError):
+        pass
+    return io
+
+def get_resource_usage(wall, rusage = None, proc_stats = None):
+    """Get the resource usage of a simulation as a dict.
+
+    Parameters
+    ----------
+    wall : float
+        Wall time in s
+    rusage : resource.struct_rusage, optional
+        Resource usage of the process from os.wait4, by default None (Windows)
+    proc_stats : dict, optional
+        Statistics of the process from /proc, see wait_for_simulation, by default None. Its max_rss replaces the ru_maxrss of rusage
+
+    Returns
+    -------
+    dict
+        Resource usage with the keys wall, user and sys (CPU time in s), max_rss (peak resident set size in bytes) and the I/O counters, 
+        only wall on Windows
+    """
+    usage = {'wall': wall}
+    if rusage is not None:
+        usage.update({'user': rusage.ru_utime, 'sys': rusage.ru_stime})
+        if sys.platform == 'darwin':
+            # On Linux, ru_maxrss includes the memory of the forked Python process, the sampled peak of proc_stats is used instead
+            usage['max_rss'] = rusage.ru_maxrss
+    if proc_stats is not None:
+        usage.update(proc_stats)
+    return usage
+
+def get_last_resource_usage():
+    """Get the resource usage of the last simulation run by the current thread with run_simulation or run_simulation_filesafe.
+
+    Returns
+    -------
+    dict or None
+        Resource usage, see get_resource_usage. None if the last simulation was not run, e.g. because it was taken from the cache
+    """
+    return getattr(resource_usage_local, 'last', None)
+
+def get_last_batch_resource_usage():
+    """Get the resource usage of the last batch of simulations run by the current thread with run_simulation_parallel.
+
+    Returns
+    -------
+    dict or None
+        Aggregated resource usage of the batch, see summarize_resource_usage
+    """
+    return getattr(resource_usage_local, 'batch', None)
+
+def summarize_resource_usage(usage_list):
+    """Aggregate the resource usage of a batch of simulations.
+
+    Parameters
+    ----------
+    usage_list : List
+        Resource usage of each simulation, see get_resource_usage. None for simulations that were not run
+
+    Returns
+    -------
+    dict
+        Aggregated resource usage with the keys n_runs, wall (sum of the wall times), wall_max, user, sys, max_rss (peak of all simulations), mean_max_rss,
+        the I/O counters (sums) and cpu_utilization: the CPU time divided by the wall time, close to 1 for a CPU-bound batch and lower when the simulations wait for I/O
+    """
+    usage_list = [usage for usage in usage_list if usage is not None]
+    summary = {'n_runs': len(usage_list)}
+    if len(usage_list) == 0:
+        return summary
+    summary['wall'] = sum(usage['wall'] for usage in usage_list)
+    summary['wall_max'] = max(usage['wall'] for usage in usage_list)
+    for key in ['user', 'sys', 'read_chars', 'write_chars', 'read_bytes', 'write_bytes']:
+        values = [usage[key] for usage in usage_list if key in usage]
+        if len(values) > 0:
+            summary[key] = sum(values)
+    max_rss = [usage['max_rss'] for usage in usage_list if 'max_rss' in usage]
+    if len(max_rss) > 0:
+        summary['max_rss'] = max(max_rss)
+        summary['mean_max_rss'] = sum(max_rss) / len(max_rss)
+    if 'user' in summary and summary['wall'] > 0:
+        summary['cpu_utilization'] = (summary['user'] + summary['sys']) / summary['wall']
+    return summary
+
+def print_resource_usage(summary):
+    """Print a short overview of the resource usage of a batch of simulations, see summarize_resource_usage.
+
+    Parameters
+    ----------
+    summary : dict
+        Aggregated resource usage, see summarize_resource_usage
+    """
+    if summary is None or summary['n_runs'] == 0:
+        return
+    line = str(summary['n_runs']) + ' simulations, total wall time ' + '{:.2f}'.format(summary['wall']) + ' s'
+    if 'cpu_utilization' in summary:
+        line += ', CPU time ' + '{:.2f}'.format(summary['user'] + summary['sys']) + ' s (utilization ' + '{:.0%}'.format(summary['cpu_utilization']) + ')'
+    if 'max_rss' in summary:
+        line += ', peak memory ' + '{:.1f}'.format(summary['max_rss'] / 2**20) + ' MiB'
+    if 'read_bytes' in summary:
+        line += ', disk I/O ' + '{:.1f}'.format(summary['read_bytes'] / 2**20) + ' MiB read, ' + '{:.1f}'.format(summary['write_bytes'] / 2**20) + ' MiB written'
+    print(line)
+
+def call_hook(hooks, event, idx, **info):
+    """Call the hook of an event, if there is one. Used by the runners to report the progress of the simulations, e.g. to a progress bar or a dashboard.
+    The hooks are called from the thread that runs or collects the simulation, after the simulation process has been started or has exited, 
+    so they never wait on the process themselves. They should return quickly and must be thread-safe.
+    An exception raised by a hook is printed as a warning and does not stop the simulations.
+
+    The events are:
+        submit : the simulation is handed to the worker pool (or GNU parallel, or queued for the workers)
+        start : the simulation process is about to be started, not reported with GNU parallel
+        finish : the simulation finished, with the keys returncode and wall (wall time in s). Reported for all simulations, also the failed ones
+        failure : the simulation failed, i.e. the return code is not 0, 95 or 3, with the keys returncode and wall. Reported after finish
+        retry : the simulation is run again, with the keys attempt and reason
+
+    Parameters
+    ----------
+    hooks : dict or None
+        Function for each event in HOOK_EVENTS, called as hook(idx, info). Events without a function are not reported. None to report nothing
+    event : string
+        Event to report, one of HOOK_EVENTS
+    idx : int or None
+        Index of the simulation in the batch (cmd_pars_list), None for a single simulation
+    **info : dict
+        Information about the event, added to the info dict of the hook together with time (time since the epoch in s), 
+        and n_done and n_total for the runners that know them
+    """
+    if not hooks:
+        return
+    hook = hooks.get(event)
+    if hook is None:
+        return
+    info['time'] = time.time()
+    try:
+        hook(idx, info)
+    except Exception as e:
+        print('Warning: the ' + event + ' hook raised ' + repr(e))
+
+def run_hooked_job(hooks, progress, target, idx, *args):
+    """Run target(*args) for simulation idx of a batch and report it to the hooks (start, finish and failure), see call_hook. 
+    Used by the worker pools, the return value of target must start with the return code, e.g. a SimulationResult.
+
+    Parameters
+    ----------
+    hooks : dict
+        Function for each event, see call_hook
+    progress : dict
+        Progress of the batch, shared between the workers, with the keys n_done, n_total and lock
+    target : callable
+        Function that runs the simulation
+    idx : int
+        Index of the simulation in the batch
+
+    Returns
+    -------
+    object
+        Return value of target
+    """
+    call_hook(hooks, 'start', idx)
+    start = time.perf_counter()
+    if hooks.get('retry') is not None:
+        # The retries of the retry ladder are reported by the simulation runner, see run_retry_ladder
+        result = target(*args, hooks = {'retry': lambda _, info: hooks['retry'](idx, info)})
+    else:
+        result = target(*args)
+    wall = time.perf_counter() - start
+    with progress['lock']:
+        progress['n_done'] += 1
+        n_done = progress['n_done']
+    call_finish_hooks(hooks, idx, result[0], wall, n_done = n_done, n_total = progress['n_total'])
+    return result
+
+def call_finish_hooks(hooks, idx, returncode, wall, **info):
+    """Report a finished simulation to the hooks: the finish hook and, if it failed (return code not 0, 95 or 3), the failure hook, see call_hook.
+
+    Parameters
+    ----------
+    hooks : dict or None
+        Function for each event, see call_hook
+    idx : int or None
+        Index of the simulation in the batch, None for a single simulation
+    returncode : int
+        Return code of the simulation
+    wall : float
+        Wall time of the simulation in s
+    **info : dict
+        Additional information for the hooks, e.g. n_done and n_total
+    """
+    if not hooks:
+        return
+    call_hook(hooks, 'finish', idx, returncode = returncode, wall = wall, **info)
+    if returncode not in SUCCESS_CODES:
+        call_hook(hooks, 'failure', idx, returncode = returncode, wall = wall, **info)
+
+def remap_hooks(hooks, indices):
+    """Translate the indices reported to the hooks when a subset of a batch is run, e.g. the simulations that are not in the cache.
+
+    Parameters
+    ----------
+    hooks : dict or None
+        Function for each event, see call_hook
+    indices : List
+        Index in the original batch of each simulation of the subset
+
+    Returns
+    -------
+    dict or None
+        Hooks that call the original hooks with the index in the original batch
+    """
+    if not hooks:
+        return hooks
+    return {event: (lambda idx, info, hook = hook: hook(None if idx is None else indices[idx], info)) for event, hook in hooks.items() if hook is not None}
+
+class CancellationToken:
+    """Token to cancel a batch of simulations, e.g. from a notebook, a web request or another thread, or by the fail-fast policy (see add_fail_fast_hook).
+    Pass it as cancel_token to run_simulation_parallel or the other runners. After cancel is called, the simulations that did not start yet are not run 
+    and the running simulations are killed together with their process group. Both return CANCELLED_ERROR_CODE.
+    The token stays cancelled, use a new token for the next batch.
+    """
+    def __init__(self):
+        self.reason = None
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = {} # Functions to call when the token is cancelled, e.g. to kill a running simulation
+        self.next_key = 0
+
+    @property
+    def cancelled(self):
+        """True if the token has been cancelled"""
+        return self.event.is_set()
+
+    def cancel(self, reason = 'Cancelled by the user'):
+        """Cancel the token: call the registered callbacks, so the running simulations are killed, and stop the simulations that did not start yet.
+
+        Parameters
+        ----------
+        reason : string, optional
+            Reason of the cancellation, stored in the reason attribute, by default 'Cancelled by the user'
+
+        Returns
+        -------
+        bool
+            True if the token was cancelled by this call, False if it was cancelled already
+        """
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.reason = reason
+            self.event.set()
+            callbacks = list(self.callbacks.values())
+            self.callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print('Warning: cancelling a simulation raised ' + repr(e))
+        return True
+
+    def wait(self, timeout = None):
+        """Wait until the token is cancelled or timeout s have passed, returns True if the token is cancelled"""
+        return self.event.wait(timeout)
+
+    def add_callback(self, callback):
+        """Register a function that is called without arguments when the token is cancelled, it is called immediately if the token is cancelled already.
+        Returns the key to remove the callback with remove_callback.
+        """
+        with self.lock:
+            if not self.event.is_set():
+                key = self.next_key
+                self.next_key += 1
+                self.callbacks[key] = callback
+                return key
+        callback()
+        return None
+
+    def remove_callback(self, key):
+        """Remove a callback that was registered with add_callback, e.g. when the simulation it kills has exited"""
+        with self.lock:
+            self.callbacks.pop(key, None)
+
+def add_fail_fast_hook(hooks, cancel_token, threshold = 1, codes = FAIL_FAST_CODES):
+    """Add the fail-fast policy to the hooks of a batch: cancel the batch when threshold simulations failed with one of the return codes in codes.
+    The default codes (corrupt device parameter file, invalid input and missing input file) mean that the other simulations of the batch will most likely fail the same way, 
+    so the queued simulations are not run and the running ones are killed, see CancellationToken.
+
+    Parameters
+    ----------
+    hooks : dict or None
+        Function for each event, see call_hook
+    cancel_token : CancellationToken
+        Token that is cancelled when the threshold is reached
+    threshold : int, optional
+        Number of failed simulations with one of the codes after which the batch is cancelled, by default 1
+    codes : List, optional
+        Return codes that count as failures, by default FAIL_FAST_CODES
+
+    Returns
+    -------
+    dict
+        Hooks with a failure hook that counts the failures, the failure hook in hooks is still called
+    """
+    failures = {'n': 0, 'lock': threading.Lock()}
+    failure_hook = (hooks or {}).get('failure')
+
+    def fail_fast(idx, info):
+        if failure_hook is not None:
+            failure_hook(idx, info)
+        if info['returncode'] not in codes:
+            return
+        with failures['lock']:
+            failures['n'] += 1
+            n_failures = failures['n']
+        if n_failures >= threshold and cancel_token.cancel('Fail-fast: ' + str(n_failures) + ' simulation(s) failed with error ' + str(info['returncode'])):
+            print('Warning: ' + str(n_failures) + ' simulation(s) failed with error ' + str(info['returncode']) + ', cancelling the other simulations of the batch (fail_fast).')
+
+    hooks = dict(hooks or {})
+    hooks['failure'] = fail_fast
+    return hooks
+
+def apply_fail_fast(kwargs):
+    """Set up the fail-fast policy of a batch from the keyword arguments of a runner, see add_fail_fast_hook.
+    The options fail_fast and fail_fast_codes are removed from kwargs, and cancel_token and hooks are set when fail_fast is used.
+
+    Parameters
+    ----------
+    kwargs : dict
+        Keyword arguments of the runner:
+        fail_fast : bool or int, cancel the batch after the first simulation (True) or after this number of simulations failed with one of the fail_fast_codes, by default None (off)
+        fail_fast_codes : List, return codes that count for fail_fast, by default FAIL_FAST_CODES
+        cancel_token : CancellationToken, token that is cancelled, a new token is made if it is not set
+
+    Returns
+    -------
+    CancellationToken or None
+        Token of the batch, None if the batch cannot be cancelled
+    """
+    fail_fast = kwargs.pop('fail_fast', None)
+    fail_fast_codes = kwargs.pop('fail_fast_codes', FAIL_FAST_CODES)
+    if fail_fast:
+        if kwargs.get('cancel_token') is None:
+            kwargs['cancel_token'] = CancellationToken()
+        kwargs['hooks'] = add_fail_fast_hook(kwargs.get('hooks'), kwargs['cancel_token'], int(fail_fast), fail_fast_codes)
+    return kwargs.get('cancel_token')
+
+class RetryLadder:
+    """Retry policy for simulations that failed to converge: the simulation is run again with the overrides of each rung of the ladder, 
+    e.g. more iterations or looser tolerances, until it no longer fails. The ladder is shared by the simulations of a batch: 
+    the rungs that rescued simulations before are tried first, so in a sweep in which many points need the same rung the rungs below it are not tried for every point.
+    The number of simulations rescued by each rung is kept in rescued, see report.
+
+    Parameters
+    ----------
+    rungs : List, optional
+        Overrides of each rung, a list with parameters to add to the simss/zimt cmd line (dicts with par,val keys, e.g. {'par': 'NP', 'val': '800'}), 
+        by default DEFAULT_RETRY_LADDER
+    codes : List, optional
+        Return codes of the simulations to run again, by default RETRY_CODES (93 and 94). 
+        With 95, the simulations in which some points did not converge are also run again, their output files are replaced by the output of the retries
+    """
+    def __init__(self, rungs = None, codes = None):
+        self.rungs = DEFAULT_RETRY_LADDER if rungs is None else list(rungs)
+        self.codes = RETRY_CODES if codes is None else list(codes)
+        self.rescued = [0] * len(self.rungs) # Number of simulations rescued by each rung
+        self.n_failed = 0 # Number of simulations that none of the rungs rescued
+        self.lock = threading.Lock()
+
+    def get_order(self):
+        """Order in which the rungs are tried: the rungs that rescued most simulations first, then in the order of the ladder"""
+        with self.lock:
+            rescued = list(self.rescued)
+        return sorted(range(len(self.rungs)), key = lambda rung: -rescued[rung])
+
+    def get_cmd_pars(self, cmd_pars, rung):
+        """Parameters of a simulation with the overrides of a rung, the cmd_pars of the caller are not changed"""
+        return update_cmd_pars([dict(cmd_par) for cmd_par in cmd_pars], [dict(cmd_par) for cmd_par in self.rungs[rung]])
+
+    def record(self, rung):
+        """Register the rung that rescued a simulation, None if none of the rungs did"""
+        with self.lock:
+            if rung is None:
+                self.n_failed += 1
+            else:
+                self.rescued[rung] += 1
+
+    def report(self):
+        """Print the number of simulations rescued by each rung"""
+        print('Retry ladder: ' + ', '.join('rung ' + str(rung) + ' rescued ' + str(n) for rung, n in enumerate(self.rescued)) + ', ' + str(self.n_failed) + ' not rescued')
+
+def get_retry_ladder(kwargs):
+    """Set up the retry ladder of a batch from the keyword arguments of a runner, so that all the simulations of the batch share it, see RetryLadder.
+    The option retry_codes is removed from kwargs and retry_ladder is replaced by a RetryLadder, or removed if it is not used.
+
+    Parameters
+    ----------
+    kwargs : dict
+        Keyword arguments of the runner:
+        retry_ladder : bool, List or RetryLadder, True for DEFAULT_RETRY_LADDER, or the rungs of the ladder, by default None (no retries)
+        retry_codes : List, return codes of the simulations to run again, by default RETRY_CODES
+
+    Returns
+    -------
+    RetryLadder or None
+        Retry ladder of the batch, None if the simulations are not retried
+    """
+    retry_ladder = kwargs.pop('retry_ladder', None)
+    retry_codes = kwargs.pop('retry_codes', None)
+    if retry_ladder is None or retry_ladder is False:
+        return None
+    if not isinstance(retry_ladder, RetryLadder):
+        retry_ladder = RetryLadder(None if retry_ladder is True else retry_ladder, retry_codes)
+    kwargs['retry_ladder'] = retry_ladder
+    return retry_ladder
+
+def run_retry_ladder(run_func, retry_ladder, sim_type, cmd_pars, session_path, run_mode = False, verbose = False, **kwargs):
+    """Run a simulation and, if it fails with one of the codes of the retry ladder, run it again with the rungs of the ladder until one of them rescues it, see RetryLadder.
+    The hooks report the start and finish of the simulation once and each retry with the keys attempt, rung and reason, see call_hook.
+
+    Parameters
+    ----------
+    run_func : function
+        Function that runs a simulation without retries, i.e. run_simulation or run_simulation_filesafe
+    retry_ladder : RetryLadder, List or bool
+        Retry ladder, see get_retry_ladder
+    sim_type, cmd_pars, session_path, run_mode, verbose, **kwargs :
+        Arguments of run_func
+
+    Returns
+    -------
+    SimulationResult
+        Result of the rung that rescued the simulation with its index in the rung attribute, 
+        or the result of the first run (rung None) if the simulation did not fail or was not rescued
+    """
+    if not isinstance(retry_ladder, RetryLadder):
+        retry_ladder = RetryLadder(None if retry_ladder is True else retry_ladder, kwargs.pop('retry_codes', None))
+    hooks = kwargs.pop('hooks', None)
+    cancel_token = kwargs.get('cancel_token', None)
+    call_hook(hooks, 'start', None)
+    start = time.perf_counter()
+    result = first = run_func(sim_type, cmd_pars, session_path, run_mode, verbose, **kwargs)
+    if first.code in retry_ladder.codes:
+        rescued = None
+        for attempt, rung in enumerate(retry_ladder.get_order()):
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            call_hook(hooks, 'retry', None, attempt = attempt + 2, rung = rung, reason = 'error ' + str(first.code))
+            result = run_func(sim_type, retry_ladder.get_cmd_pars(cmd_pars, rung), session_path, run_mode, verbose, **kwargs)
+            if result.code in SUCCESS_CODES and result.code not in retry_ladder.codes:
+                rescued = rung
+                break
+        retry_ladder.record(rescued)
+        if rescued is None:
+            # Report the original failure, not the failure of the last rung
+            result = first
+        result.rung = rescued
+        if verbose:
+            print('Simulation failed with error ' + str(first.code) + (', rescued by rung ' + str(rescued) if rescued is not None else ', not rescued by the retry ladder'))
+    call_finish_hooks(hooks, None, result.code, time.perf_counter() - start)
+    return result
+
+def set_process_limits(pid, cpu_time_limit = None, memory_limit = None, niceness = None, cpu_affinity = None):
+    """Set the resource limits, niceness and CPU affinity of a started simulation process (Linux/macOS only). 
+    The resource limits need resource.prlimit (Linux), on other systems they are set with get_ulimit_cmd when the simulation is started.
+
+    Parameters
+    ----------
+    pid : int
+        Process ID of the simulation
+    cpu_time_limit : int, optional
+        CPU time limit in s, the process receives SIGXCPU when it is reached and is killed 5 s later, by default None
+    memory_limit : int, optional
+        Limit of the address space in bytes, by default None
+    niceness : int, optional
+        Niceness added to the process, by default None
+    cpu_affinity : List, optional
+        CPUs the process is pinned to (Linux only), by default None
+    """
+    if cpu_time_limit is not None:
+        cpu_time_limit = int(max(1, cpu_time_limit))
+        resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_time_limit, cpu_time_limit + 5))
+    if memory_limit is not None:
+        resource.prlimit(pid, resource.RLIMIT_AS, (int(memory_limit), int(memory_limit)))
+    if niceness is not None:
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + int(niceness))
+    if cpu_affinity is not None:
+        os.sched_setaffinity(pid, cpu_affinity)
+
+def get_ulimit_cmd(cpu_time_limit = None, memory_limit = None):
+    """Get the shell commands that set the CPU time limit and the memory limit of a simulation started from the same shell (Linux/macOS only)
+
+    Parameters
+    ----------
+    cpu_time_limit : int, optional
+        CPU time limit in s, by default None
+    memory_limit : int, optional
+        Limit of the address space in bytes, by default None
+
+    Returns
+    -------
+    string
+        The ulimit commands, each followed by '; '
+    """
+    ulimit_cmd = ''
+    if cpu_time_limit is not None:
+        ulimit_cmd += 'ulimit -t ' + str(int(max(1, cpu_time_limit))) + '; '
+    if memory_limit is not None:
+        ulimit_cmd += 'ulimit -v ' + str(int(memory_limit) // 1024) + '; '
+    return ulimit_cmd
+
+def kill_process_group(process, grace_time = 2):
+    """Terminate a simulation process together with its process group. The processes get grace_time seconds to exit after SIGTERM before they are killed.
+
+    Parameters
+    ----------
+    process : Popen
+        The simulation process, started in its own session/process group on Linux/macOS
+    grace_time : float, optional
+        Time in s to wait after SIGTERM before sending SIGKILL, by default 2
+    """
+    if os.name == 'nt':
+        process.kill()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_time)
+    except TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # The process already exited
+        pass
+
+def get_cgroup_cpu_limit():
+    """Get the CPU quota of the cgroup of this process (e.g. set by docker --cpus or Slurm), as a number of CPUs.
+
+    Returns
+    -------
+    float or None
+        Number of CPUs the cgroup may use, None if there is no quota
+    """
+    quota_files = []
+    try:
+        with open('/proc/self/cgroup') as fp:
+            for line in fp:
+                hierarchy, controllers, path = line.strip().split(':', 2)
+                if hierarchy == '0':
+                    # cgroup v2
+                    quota_files.append(os.path.join('/sys/fs/cgroup', path.lstrip('/'), 'cpu.max'))
+    except (OSError, ValueError):
+        pass
+    quota_files.append('/sys/fs/cgroup/cpu.max')
+
+    for quota_file in quota_files:
+        try:
+            with open(quota_file) as fp:
+                quota, period = fp.read().split()[:2]
+            return None if quota == 'max' else int(quota) / int(period)
+        except (OSError, ValueError):
+            continue
+
+    # cgroup v1
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as fp:
+            quota = int(fp.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as fp:
+            period = int(fp.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+def get_usable_cpus():
+    """Get the CPUs this process may run on, i.e. its CPU affinity (set by e.g. taskset, numactl or a batch scheduler).
+
+    Returns
+    -------
+    List
+        Sorted list of CPU ids
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def get_cpu_count():
+    """Get the number of CPUs this process may use, taking into account its CPU affinity and the CPU quota of its cgroup.
+
+    Returns
+    -------
+    int
+        Number of usable CPUs, at least 1
+    """
+    n_cpus = len(get_usable_cpus())
+    quota = get_cgroup_cpu_limit()
+    if quota is not None:
+        n_cpus = min(n_cpus, int(math.ceil(quota)))
+    return max(1, n_cpus)
+
+def get_default_max_jobs():
+    """Get the default number of parallel jobs: the number of usable CPUs - 1, see get_cpu_count.
+
+    Returns
+    -------
+    int
+        Default number of parallel jobs, at least 1
+    """
+    return max(1, get_cpu_count() - 1)
+
+def order_cpus(cpus, policy = 'compact'):
+    """Order the CPUs in which they are used to pin the simulations to. The topology is read from /sys/devices/system/cpu.
+    compact: fill the cores of one socket (package) before the next one, so the simulations share the caches and memory of one NUMA domain.
+    scatter: spread the simulations over the sockets, one CPU per physical core before the hyperthreads, to get the most memory bandwidth and cache per simulation.
+
+    Parameters
+    ----------
+    cpus : List
+        CPU ids to order
+    policy : string, optional
+        'compact' or 'scatter', by default 'compact'
+
+    Returns
+    -------
+    List
+        Ordered list of CPU ids
+    """
+    if policy not in ['compact', 'scatter']:
+        raise ValueError("Unknown CPU pinning policy: " + str(policy) + ", use 'compact' or 'scatter'.")
+
+    topology = {}
+    for cpu in cpus:
+        try:
+            with open('/sys/devices/system/cpu/cpu{}/topology/physical_package_id'.format(cpu)) as fp:
+                package = int(fp.read())
+            with open('/sys/devices/system/cpu/cpu{}/topology/core_id'.format(cpu)) as fp:
+                core = int(fp.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        topology[cpu] = (package, core)
+
+    if policy == 'compact':
+        return sorted(cpus, key = lambda cpu: (topology[cpu], cpu))
+
+    # Index of each CPU among the hyperthreads of its core
+    sibling = {}
+    seen = {}
+    for cpu in sorted(cpus):
+        sibling[cpu] = seen.get(topology[cpu], 0)
+        seen[topology[cpu]] = sibling[cpu] + 1
+    # Rank of each core within its package
+    cores = sorted(set(topology.values()))
+    core_rank = {}
+    for package in set(package for package, _ in cores):
+        for rank, core in enumerate(c for c in cores if c[0] == package):
+            core_rank[core] = rank
+    return sorted(cpus, key = lambda cpu: (sibling[cpu], core_rank[topology[cpu]], topology[cpu][0], cpu))
+
+def acquire_cpus(n_cpus = 1, policy = 'compact'):
+    """Claim free CPUs to pin a simulation to. A CPU is claimed with an exclusive lock on a file in a folder of the user in the temporary folder,
+    so the CPUs are shared between all threads and all pySIMsalabim processes of the user on this host and a CPU is only used by one simulation at a time.
+    The lock is released when the claim is released (see release_cpus) or when the process exits.
+
+    Parameters
+    ----------
+    n_cpus : int, optional
+        Number of CPUs to claim, by default 1. At most the number of usable CPUs.
+    policy : string, optional
+        Order in which the free CPUs are claimed, 'compact' or 'scatter' (see order_cpus), by default 'compact'
+
+    Returns
+    -------
+    List
+        Claim, a list of (cpu, file descriptor) tuples
+
+    Raises
+    ------
+    BlockingIOError
+        If there are not enough free CPUs, see retry_with_backoff to wait for them
+    """
+    cpus = order_cpus(get_usable_cpus(), policy)
+    n_cpus = max(1, min(int(n_cpus), len(cpus)))
+    # One folder per user, the lock files of other users cannot be opened
+    lock_dir = os.path.join(tempfile.gettempdir(), 'pySIMsalabim_cpus_' + str(os.getuid()))
+    os.makedirs(lock_dir, mode = 0o700, exist_ok = True)
+
+    claim = []
+    for cpu in cpus:
+        fd = os.open(os.path.join(lock_dir, 'cpu{}.lock'.format(cpu)), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # In use by another simulation
+            os.close(fd)
+            continue
+        claim.append((cpu, fd))
+        if len(claim) == n_cpus:
+            return claim
+
+    release_cpus(claim)
+    raise BlockingIOError('Only {} of the {} requested CPUs are free.'.format(len(claim), n_cpus))
+
+def release_cpus(claim):
+    """Release the CPUs claimed with acquire_cpus.
+
+    Parameters
+    ----------
+    claim : List
+        Claim, a list of (cpu, file descriptor) tuples
+    """
+    for cpu, fd in claim:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+def run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose = False, **kwargs):
     """Run the SIMsalabim simulation executable with the chosen device parameters. 
         Return the complete result object of the process accompanied by a message with information, 
         in case of both success and failure.
@@ -161,97 +1317,68 @@ def run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose =
         Prevents using streamlit components outside of The Shell.
     verbose : boolean
         True if the console output of the simulation should be printed to the console
+    **kwargs : dict
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation.
+        If cache_dir is set, the result is taken from the cache when the same simulation has been run before, see run_simulation_cached.
+        If scratch_dir is set, the simulation is run in a sandbox on the scratch folder, see run_simulation_filesafe.
+        If runtime_history is set, the wall time and the features of the simulation are added to this runtime history file, see record_simulation_runtime
+        If hooks is set, the start, finish and failure of the simulation are reported to the hooks with idx None, see call_hook
+        If cancel_token is set and cancelled, the simulation is not run or killed and returns CANCELLED_ERROR_CODE, see CancellationToken
+        If retry_ladder is set, a simulation that failed to converge is run again with the rungs of the ladder, see RetryLadder and run_retry_ladder
 
     Returns
     -------
-    int
-        Return code of the simulation process, 0 for success, other values for errors.
-    string
-        Return message to display on the UI, for both success and failed
+    SimulationResult
+        Result of the simulation with the return code (0 for success, other values for errors), the message to display on the UI, the output files, timing and resource usage.
+        It unpacks as (returncode, message): result, message = run_simulation(...)
     """
-    # Construct the command to run the executable
-    cmd_line = construct_cmd(sim_type, cmd_pars)
+    resource_usage_local.last = None
+    if kwargs.get('cache_dir') is not None:
+        # The result of a simulation that is run keeps its timing, resource usage and rung
+        sim_result = run_simulation_cached(run_simulation, sim_type, cmd_pars, session_path, run_mode, verbose, **kwargs)
+        if run_mode and sim_result.message == '':
+            # Cached by a run without run_mode, the console output is not available
+            sim_result.message = get_result_message(sim_result.code, '')
+        return sim_result
+
+    if kwargs.get('cancel_token') is not None and kwargs['cancel_token'].cancelled:
+        return SimulationResult(CANCELLED_ERROR_CODE, get_result_message(CANCELLED_ERROR_CODE, '') if run_mode else '', output_source = (sim_type, cmd_pars, session_path))
+
+    if kwargs.get('retry_ladder') is not None:
+        retry_ladder = kwargs.pop('retry_ladder')
+        return run_retry_ladder(run_simulation, retry_ladder, sim_type, cmd_pars, session_path, run_mode, verbose, **kwargs)
+
+    if kwargs.get('scratch_dir') is not None:
+        return run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = run_mode, verbose = verbose, **kwargs)
+
+    # Construct the arguments to run the executable
+    cmd_args = construct_cmd_args(sim_type, cmd_pars, session_path)
     
+    # The console output is only needed to build the message (The Shell) or to print it
+    hooks = kwargs.get('hooks', None)
+    call_hook(hooks, 'start', None)
+    start_time = time.time()
+    start = time.perf_counter()
+    result = execute_simulation(cmd_args, session_path, capture_output = run_mode or verbose, **kwargs)
+    wall = time.perf_counter() - start
+    call_finish_hooks(hooks, None, result.returncode, wall)
+    if kwargs.get('runtime_history') is not None:
+        record_simulation_runtime(kwargs['runtime_history'], sim_type, cmd_pars, session_path, result.returncode, wall)
+
     if run_mode:
-        # Run the simulation in a shell environment 
-        if os.name == 'nt':
-            result = run(cmd_line, cwd=session_path,stdout=PIPE, check=False, shell=True)
-        else:
-            result = run([cmd_line], cwd=session_path, stdout=PIPE, check=False, shell=True)
-    
         # Check the results of the process using the returncodes and console output
-        if result.returncode != 0 and result.returncode != 95 and result.returncode != 3:
-            # SIMsalabim raised an error, stop the program and return the error message on the UI.
-            startMessage = False
-            message = ''
-            result_decode = result.stdout.decode('utf-8')
-
-            if result.returncode >= 100:
-                # A fatal (numerical) error occurred. Return errorcode and a standard error message.
-                message = fatal_error_message(result.returncode)
-            else:
-                # Simsalabim raised an error. Read the console output for the details / error messaging. 
-                # All linetypes after 'Program will be terminated, press enter.' are considered part of the error message
-                for line_console in result_decode.split('\n'):
-                    if startMessage is True:
-                        # The actual error message. Since the error message can be multi-line, append each line.
-                        message = message + line_console + '\n'
-                    if 'Program will be terminated.' in line_console:
-                        # Last 'regular' line of the console output. The next line is from the error message.
-                        startMessage = True
-
-            # Show the message as an error on the screen. Do not continue to the simulation results page.
-            message = 'Simulation raised an error with Errorcode: ' + str(result.returncode) + '\n\n' + message
-        else:
-            # SIMsalabim simulation succeeded
-            if result.returncode == 95:
-                # In case of errorcode 95, failures during the simulations were encountered but the simulation did not halt. Show 'error' messages on the UI.
-                startMessage = False
-                message = ''
-                result_decode = result.stdout.decode('utf-8')
-                for line_console in result_decode.split('\n'):
-                    if startMessage is True:
-                        # The actual error message. Since the error message can be multi-line, append each line.
-                        message = message + line_console + '\n'
-                    if 'Program will be terminated.' in line_console:
-                        # Last 'regular' line of the console output. The next line is from the error message.
-                        startMessage = True
-               
-                # Show the message as a success on the screen
-                message = 'Simulation completed but raised errorcode: ' + str(result.returncode) + '\n\n' + 'The simulation finished but at least 1 point did not converge. \n\n' + message
-            elif result.returncode == 3:
-                # Special case, should not occur in the web version.
-                # When the program exits as a success but no simulation has been run, e.g. in the case of the autotidy functionality. 
-                message = 'Action completed'
-            else:
-                # Simulation completed as expected.
-                message = 'Simulation complete. Output can be found in the Simulation results.'
+        message = get_result_message(result.returncode, result.stdout)
     else:
-        # if verbose:
-        if os.name == 'nt':
-            result = run(cmd_line, cwd=session_path,stdout=PIPE, check=False, shell=True)
-        else:
-            result = run([cmd_line], cwd=session_path, stdout=PIPE, check=False, shell=True)
-        
         if verbose:
-            startMessage = False
-            message = ''
-            result_decode = result.stdout.decode('utf-8')
-            for line_console in result_decode.split('\n'):
-                if startMessage is True:
-                    # The actual error message. Since the error message can be multi-line, append each line.
-                    message = message + line_console + '\n'
-                if 'Program will be terminated.' in line_console:
-                    # Last 'regular' line of the console output. The next line is from the error message.
-                    startMessage = True
-            print(message)
+            print(get_console_error_message(result.stdout))
         message = ''
-    result = result.returncode
-    return result, message
+    timing = {'start': start_time, 'end': start_time + wall, 'wall': wall}
+    return SimulationResult(result.returncode, message, timing = timing, usage = result.usage, output_source = (sim_type, cmd_pars, session_path))
 
 
 def run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False, verbose = False, **kwargs):
-    """Run the SIMsalabim simulation executable with the chosen device parameters. 
+    """Run the SIMsalabim simulation executable with the chosen device parameters in a temp folder (sandbox), so simulations can run in parallel without sharing files.
+        The input files are linked into the sandbox instead of copied and the output files are moved to session_path afterwards.
         Return the complete result object of the process accompanied by a message with information, 
         in case of both success and failure.
 
@@ -270,21 +1397,48 @@ def run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False,
     verbose : boolean
         True if the console output of the simulation should be printed to the console
     **kwargs : dict
-        Additional keyword arguments, not used in this function but can be used to pass additional parameters to the function.
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation.
+        If cache_dir is set, the result is taken from the cache when the same simulation has been run before, see run_simulation_cached.
+        reuse_sandbox : bool, reuse the temp folder of the current thread for the next simulations, only the input files that changed are synced, by default True
+        sandbox_root : string, folder in which the temp folder is created, by default session_path
+        scratch_dir : string, scratch folder, e.g. on a RAM-backed file system, in which the temp folder is created instead, 'auto' to use /dev/shm if available, see get_scratch_dir, by default None
+        keep_outputs : List, names of the output file parameters (e.g. ['JVFile', 'scParsFile']) that are moved to their destination, the other output files are discarded, by default None (all)
+        runtime_history : string, runtime history file to add the wall time and the features of the simulation to, see record_simulation_runtime, by default None
+        hooks : dict, functions called when the simulation starts, finishes or fails, see call_hook, by default None
+        cancel_token : CancellationToken, the simulation is not run or killed when the token is cancelled and returns CANCELLED_ERROR_CODE, by default None
+        retry_ladder : RetryLadder, List or bool, run a simulation that failed to converge again with the rungs of the ladder, see run_retry_ladder, by default None
 
     Returns
     -------
-    result : int
-        Return code of the simulation process, 0 for success, other values for errors.
-    string
-        Return message to display on the UI, for both success and failed
+    SimulationResult
+        Result of the simulation with the return code (0 for success, other values for errors), the message to display on the UI, the output files, timing and resource usage.
+        It unpacks as (returncode, message): result, message = run_simulation_filesafe(...)
     """
-    max_wait_time = kwargs.get('max_wait_time', 100)  # seconds
-    # Create a temp folder to store the simulation results
-    ID = str(uuid.uuid4())
-    tmp_folder = os.path.join(session_path, 'tmp_'+ID)
-    if not os.path.exists(tmp_folder):
-        os.makedirs(tmp_folder)
+    resource_usage_local.last = None
+    if kwargs.get('cache_dir') is not None:
+        # The result of a simulation that is run keeps its timing, resource usage and rung
+        sim_result = run_simulation_cached(run_simulation_filesafe, sim_type, cmd_pars, session_path, run_mode, verbose, **kwargs)
+        if run_mode and sim_result.message == '':
+            # Cached by a run without run_mode, the console output is not available
+            sim_result.message = get_result_message(sim_result.code, '')
+        return sim_result
+
+    if kwargs.get('cancel_token') is not None and kwargs['cancel_token'].cancelled:
+        return SimulationResult(CANCELLED_ERROR_CODE, get_result_message(CANCELLED_ERROR_CODE, ''), output_source = (sim_type, cmd_pars, session_path))
+
+    if kwargs.get('retry_ladder') is not None:
+        retry_ladder = kwargs.pop('retry_ladder')
+        return run_retry_ladder(run_simulation_filesafe, retry_ladder, sim_type, cmd_pars, session_path, run_mode, verbose, **kwargs)
+
+    reuse_sandbox = kwargs.pop('reuse_sandbox', True)
+    sandbox_root = kwargs.pop('sandbox_root', session_path)
+    scratch_dir = kwargs.pop('scratch_dir', None)
+    keep_outputs = kwargs.pop('keep_outputs', None)
+    if scratch_dir is not None:
+        sandbox_root = get_scratch_dir(scratch_dir)
+    # Get the temp folder (sandbox) of this thread to run the simulation in
+    sandbox = get_sandbox(sandbox_root, reuse_sandbox)
+    tmp_folder = sandbox.folder
 
     # get file setup from cmd_pars
     device_parameters = None
@@ -297,46 +1451,23 @@ def run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False,
     if device_parameters is None:
         raise ValueError('Device parameters file not found in the command parameters list.')
 
-    # Copy the device parameters file to the temp folder
-    make_thread_safe_file_copy(os.path.join(session_path, device_parameters), tmp_folder)
-
-    # copy the executable to the temp folder
+    # Link the executable to the temp folder
     if os.name == 'nt':
-        shutil.copy(os.path.join(session_path, sim_type+'.exe'), tmp_folder)
+        sync_sandbox_file(sandbox, os.path.join(session_path, sim_type+'.exe'))
     else:
-        shutil.copy(os.path.join(session_path, sim_type), tmp_folder)
+        sync_sandbox_file(sandbox, os.path.join(session_path, sim_type))
 
     device_parameters = os.path.basename(device_parameters)
-    #
-    while True:
-        # copy the file to the temp folder
-        try:
-            dev_par, layers = load_device_parameters(session_path, device_parameters, run_mode = False)
-            break
-        except:
-            pass 
-        time.sleep(0.002)
-
-    if os.name != 'nt':
-        try:
-            dev_par, layers = load_device_parameters(session_path, device_parameters, run_mode = False)
-        except Exception as e:
-            raise ValueError('Error loading device parameters check that all the input files are in the right directory. \n Error: {}'.format(e))
-    else:
-        warning_timeout = kwargs.get('warning_timeout', 10)
-        exit_timeout = kwargs.get('exit_timeout', 60)
-        t_wait = 0
-        while True: # need this to be thread safe
-            try:
-                dev_par, layers = load_device_parameters(session_path, device_parameters, run_mode = False)
-                break
-            except Exception as e:
-                time.sleep(0.002)
-                t_wait = t_wait + 0.002
-                if t_wait > warning_timeout:
-                    print('Warning: SIMsalabim is not responding, please check that all the input files are in the right directory')
-                if t_wait > exit_timeout:
-                    raise ValueError('Error loading device parameters check that all the input files are in the right directory. \n Error: {}'.format(e))
+    warning_timeout = kwargs.get('warning_timeout', 10)
+    exit_timeout = kwargs.get('exit_timeout', 60)
+    # The threads of this process load the device parameters one at a time, and retry with backoff while the files are being written (e.g. on Windows)
+    try:
+        with get_session_lock(session_path):
+            dev_par, layers = retry_with_backoff(load_device_parameters, session_path, device_parameters, run_mode = False, 
+                                                 exceptions = (OSError, ValueError, IndexError), timeout = exit_timeout, warning_timeout = warning_timeout,
+                                                 description = 'loading the device parameters from ' + os.path.join(session_path, device_parameters))
+    except TimeoutError as e:
+        raise ValueError('Error loading device parameters check that all the input files are in the right directory. \n Error: {}'.format(e))
 
     # check for new layers in the cmd_pars
     newlayers = []
@@ -375,9 +1506,9 @@ def run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False,
                     dev_par[dev_par_keys[0]][i][1:] = layers[1:]   
 
 
-    # move all layer files to the temp folder
+    # Write the device parameters and layer files to the temp folder with the basename of the input files
     for layer in layers:
-        make_thread_safe_file_copy(os.path.join(session_path, layer[2]), tmp_folder)
+        sync_sandbox_file(sandbox, os.path.join(session_path, layer[2]), rewrite = True)
 
     res = store_file_names(dev_par, sim_type, device_parameters, layers, run_mode = False)
     layer_files = res[0]
@@ -414,133 +1545,73 @@ def run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False,
     varFile = res[5]
     logFile = res[6] 
     
-    # Copy the files to the temporary folder
-    for file in layer_files + optical_files + traps_int_files + traps_bulk_files + [ExpJV_file] + [tVGFile]:
-        if file is not None and os.path.isfile(file):
-            make_thread_safe_file_copy(file, tmp_folder)
-        
-        # update temp folder files with basename 
-        if file in layer_files:
-            make_basename_input_files(os.path.join(tmp_folder, os.path.basename(file)))       
+    # Link the other input files to the temporary folder, files that did not change since the previous simulation in this sandbox are skipped
+    for file in optical_files + traps_int_files + traps_bulk_files + [ExpJV_file] + [tVGFile]:
+        if file is not None and os.path.isfile(os.path.join(session_path, file)):
+            sync_sandbox_file(sandbox, os.path.join(session_path, file))
     
     input_files = get_inputFile_from_cmd_pars(sim_type, cmd_pars)
-    
     input_files = [os.path.abspath(os.path.join(session_path, f['val'])) for f in input_files]
-    input_files_basenames = [os.path.basename(f) for f in input_files]
-    
     for file in input_files:
-        # print(file)
-        # if file already in the tmp_folder, remove it and copy the new one
-        while True:
-            try:
-                if os.path.isfile(os.path.join(tmp_folder, os.path.basename(file))):
-                    os.remove(os.path.join(tmp_folder, os.path.basename(file)))
-                break
-            except:
-                pass
-            # sleep random time to prevent high CPU usage smaller than 5ms
-            time.sleep(random.uniform(0.002,0.005))
-            
-        # if os.path.isfile(os.path.join(tmp_folder, os.path.basename(file))):
-        #     os.remove(os.path.join(tmp_folder, os.path.basename(file)))
-        make_thread_safe_file_copy(os.path.join(session_path, file), tmp_folder)
-    
-    # set basename for device parameters
-    make_basename_input_files(os.path.join(tmp_folder, os.path.basename(device_parameters)))
+        if os.path.isfile(file):
+            sync_sandbox_file(sandbox, file)
 
-    # Construct the command to run the executable
-    cmd_pars = make_basename_file_cmd_pars(cmd_pars)
-    cmd_line = construct_cmd(sim_type, cmd_pars)
+    # Destination of the output files, the simulation writes them in the temp folder and they are moved afterwards
+    output_files = get_output_files(sim_type, cmd_pars, session_path)
+
+    # Construct the arguments to run the executable, with the basename of all files. The cmd_pars of the caller are not changed.
+    cmd_pars = make_basename_file_cmd_pars([dict(cmd_par) for cmd_par in cmd_pars], except_output_files = False)
+    cmd_args = construct_cmd_args(sim_type, cmd_pars, tmp_folder)
+
+    # Remove the output files left by a previous simulation in this sandbox
+    for destination in output_files.values():
+        if os.path.isfile(os.path.join(tmp_folder, os.path.basename(destination))):
+            os.remove(os.path.join(tmp_folder, os.path.basename(destination)))
+
+    # Run the simulation, the console output is written to a file in the temp folder and only read when needed
+    console_file = os.path.join(tmp_folder, 'console_output.txt')
+    hooks = kwargs.get('hooks', None)
+    call_hook(hooks, 'start', None)
+    start_time = time.time()
+    start = time.perf_counter()
+    result = execute_simulation(cmd_args, tmp_folder, stdout_file = console_file, **kwargs)
+    wall = time.perf_counter() - start
+    call_finish_hooks(hooks, None, result.returncode, wall)
+    if kwargs.get('runtime_history') is not None:
+        # The input files are in the sandbox with the names of the sandbox cmd_pars
+        record_simulation_runtime(kwargs['runtime_history'], sim_type, cmd_pars, tmp_folder, result.returncode, wall)
+    if result.returncode not in [0, 3] or verbose:
+        with open(console_file, 'rb') as fp:
+            result.stdout = fp.read()
+    if verbose:
+        print(get_console_error_message(result.stdout))
 
-    # Run the simulation
-    if os.name == 'nt':
-        result = run(cmd_line, cwd=tmp_folder, stdout=PIPE, check=False, shell=True)
-    else:
-        result = run([cmd_line], cwd=tmp_folder, stdout=PIPE, check=False, shell=True)
-    
     # Check the results of the process using the returncodes and console output
-    if result.returncode != 0 and result.returncode != 95 and result.returncode != 3:
-        # SIMsalabim raised an error, stop the program and return the error message on the UI.
-        startMessage = False
-        message = ''
-        result_decode = result.stdout.decode('utf-8')
+    message = get_result_message(result.returncode, result.stdout)
 
-        if result.returncode >= 100:
-            # A fatal (numerical) error occurred. Return errorcode and a standard error message.
-            message = fatal_error_message(result.returncode)
-        else:
-            # Simsalabim raised an error. Read the console output for the details / error messaging. 
-            # All linetypes after 'Program will be terminated, press enter.' are considered part of the error message
-            for line_console in result_decode.split('\n'):
-                if startMessage is True:
-                    # The actual error message. Since the error message can be multi-line, append each line.
-                    message = message + line_console + '\n'
-                if 'Program will be terminated.' in line_console:
-                    # Last 'regular' line of the console output. The next line is from the error message.
-                    startMessage = True
+    # Move the requested output files to their destination, discard the others
+    for par_name, destination in output_files.items():
+        file = os.path.join(tmp_folder, os.path.basename(destination))
+        if os.path.isfile(file):
+            if keep_outputs is None or par_name in keep_outputs:
+                move_output_file(file, destination)
+            else:
+                os.remove(file)
 
-        # Show the message as an error on the screen. Do not continue to the simulation results page.
-        message = 'Simulation raised an error with Errorcode: ' + str(result.returncode) + '\n\n' + message
-    else:
-        # SIMsalabim simulation succeeded
-        if result.returncode == 95:
-            # In case of errorcode 95, failures during the simulations were encountered but the simulation did not halt. Show 'error' messages on the UI.
-            startMessage = False
-            message = ''
-            result_decode = result.stdout.decode('utf-8')
-            for line_console in result_decode.split('\n'):
-                if startMessage is True:
-                    # The actual error message. Since the error message can be multi-line, append each line.
-                    message = message + line_console + '\n'
-                if 'Program will be terminated.' in line_console:
-                    # Last 'regular' line of the console output. The next line is from the error message.
-                    startMessage = True
-
-            # Show the message as a success on the screen
-            message = 'Simulation completed but raised errorcode: ' + str(result.returncode) + '\n\n' + 'The simulation finished but at least 1 point did not converge. \n\n' + message
-        elif result.returncode == 3:
-            # Special case, should not occur in the web version.
-            # When the program exits as a success but no simulation has been run, e.g. in the case of the autotidy functionality. 
-            message = 'Action completed'
-        else:
-            # Simulation completed as expected.
-            message = 'Simulation complete. Output can be found in the Simulation results.'
-
-    # Move output files to the original folder
-    if sim_type.lower() == 'simss':
-        if os.path.isfile(os.path.join(tmp_folder, varFile)):
-            # shutil.move(os.path.join(tmp_folder, varFile), os.path.join(session_path, varFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, varFile), session_path)
-        if os.path.isfile(os.path.join(tmp_folder, logFile)):
-            # shutil.move(os.path.join(tmp_folder, logFile), os.path.join(session_path, logFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, logFile), session_path)
-        if os.path.isfile(os.path.join(tmp_folder, JVFile)):
-            # shutil.move(os.path.join(tmp_folder, JVFile), session_path)
-            make_thread_safe_file_copy(os.path.join(tmp_folder, JVFile), session_path)
-        if os.path.isfile(os.path.join(tmp_folder, scParsFile)):
-            # shutil.move(os.path.join(tmp_folder, scParsFile), os.path.join(session_path, scParsFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, scParsFile), session_path)
-    elif sim_type.lower() == 'zimt':
-        if os.path.isfile(os.path.join(tmp_folder, varFile)):
-            # shutil.move(os.path.join(tmp_folder, varFile), os.path.join(session_path, varFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, varFile), session_path)
-        if os.path.isfile(os.path.join(tmp_folder, logFile)):
-            # shutil.move(os.path.join(tmp_folder, logFile), os.path.join(session_path, logFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, logFile), session_path)
-        if os.path.isfile(os.path.join(tmp_folder, tVGFile)):
-            # shutil.move(os.path.join(tmp_folder, tVGFile), os.path.join(session_path, tVGFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, tVGFile), session_path)
-        if os.path.isfile(os.path.join(tmp_folder, tJFile)):
-            # shutil.move(os.path.join(tmp_folder, tJFile), os.path.join(session_path, tJFile))
-            make_thread_safe_file_copy(os.path.join(tmp_folder, tJFile), session_path)
-
-    result = result.returncode
-    return result, message
+    if not reuse_sandbox:
+        sandbox.remove()
+
+    if keep_outputs is not None:
+        output_files = {par_name: destination for par_name, destination in output_files.items() if par_name in keep_outputs}
+    timing = {'start': start_time, 'end': start_time + wall, 'wall': wall}
+    return SimulationResult(result.returncode, message, output_files = output_files, timing = timing, usage = result.usage)
 
 
     
-def make_thread_safe_file_copy(file, destination):
+def make_thread_safe_file_copy(file, destination, timeout = 60):
     """Copy a file to a temp folder, and wait until the file is not in use anymore.
+    The file is copied to a temporary file first and then renamed, so the destination file is never incomplete.
+    While the file cannot be copied, e.g. because it is in use on Windows, the copy is retried with exponential backoff.
 
     Parameters
     ----------
@@ -548,21 +1619,283 @@ def make_thread_safe_file_copy(file, destination):
         File path of the file to copy
     destination : string
         File path of the destination folder
+    timeout : float, optional
+        Time in s after which the copy fails with a TimeoutError, by default 60
     """
     
     # check temp folder exists if not create it
-    if not os.path.exists(destination):
-        os.makedirs(destination)
+    os.makedirs(destination, exist_ok = True)
+
+    def copy_file_atomic():
+        target = os.path.join(destination, os.path.basename(file))
+        tmp_file = target + '.' + str(uuid.uuid4()) + '.tmp'
+        try:
+            shutil.copy(file, tmp_file)
+            os.replace(tmp_file, target)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
 
-    # tries to open the file, if it is in use it will wait until it is not
+    retry_with_backoff(copy_file_atomic, timeout = timeout, description = 'copying ' + str(file) + ' to ' + str(destination))
+
+def retry_with_backoff(func, *args, exceptions = (OSError,), timeout = 60, warning_timeout = None, initial_delay = 0.001, max_delay = 0.2, description = '', **kwargs):
+    """Call a function until it does not raise one of the given exceptions, sleeping with exponential backoff between the attempts.
+    Used instead of polling in a tight loop while a file is in use by another thread or process.
+
+    Parameters
+    ----------
+    func : function
+        Function to call
+    *args : tuple
+        Positional arguments of func
+    exceptions : tuple, optional
+        Exceptions after which func is called again, other exceptions are raised directly, by default (OSError,)
+    timeout : float, optional
+        Time in s after which a TimeoutError is raised, by default 60
+    warning_timeout : float, optional
+        Time in s after which a warning is printed once, by default None (no warning)
+    initial_delay : float, optional
+        Delay in s after the first failed attempt, doubled after each attempt, by default 0.001
+    max_delay : float, optional
+        Maximum delay in s between two attempts, by default 0.2
+    description : string, optional
+        Description of the action for the warning and error messages, by default ''
+    **kwargs : dict
+        Keyword arguments of func
+
+    Returns
+    -------
+    any
+        Return value of func
+
+    Raises
+    ------
+    TimeoutError
+        If func still fails after timeout s, the message contains the number of attempts and the last error
+    """
+    t_start = time.monotonic()
+    delay = initial_delay
+    attempts = 0
+    warned = False
     while True:
-        
-        # copy the file to the temp folder
+        attempts += 1
         try:
-            shutil.copy(file, destination)
-            break
-        except:
-            pass
-        
-        # add 2ms delay to prevent high CPU usage
-        time.sleep(0.002)
+            return func(*args, **kwargs)
+        except exceptions as e:
+            t_wait = time.monotonic() - t_start
+            if t_wait > timeout:
+                raise TimeoutError('Timeout after {:.1f} s and {} attempts while {}. Last error: {}'.format(t_wait, attempts, description, repr(e))) from e
+            if warning_timeout is not None and t_wait > warning_timeout and not warned:
+                print('Warning: still waiting after {:.1f} s while {}, last error: {}'.format(t_wait, description, repr(e)))
+                warned = True
+        time.sleep(delay)
+        delay = min(2 * delay, max_delay)
+
+def get_session_lock(session_path):
+    """Get the lock of a session folder. The threads of a process use it to access the files in the session folder one at a time, 
+    they wait for the lock instead of polling the files.
+
+    Parameters
+    ----------
+    session_path : string
+        Folder path of the simulation session
+
+    Returns
+    -------
+    threading.RLock
+        Lock of the session folder
+    """
+    key = os.path.normcase(os.path.abspath(session_path))
+    with session_locks_lock:
+        if key not in session_locks:
+            session_locks[key] = threading.RLock()
+        return session_locks[key]
+
+class Sandbox:
+    """Temporary folder in which simulations are run in thread safe mode, see get_sandbox. 
+    The input files are linked into the folder instead of copied and the folder is removed when the sandbox is garbage collected or at exit.
+    """
+    def __init__(self, root):
+        self.folder = os.path.join(root, 'tmp_'+str(uuid.uuid4()))
+        os.makedirs(self.folder)
+        self.files = {} # basename -> signature of the source file the sandbox file was synced from
+        self.remove = weakref.finalize(self, shutil.rmtree, self.folder, True)
+
+class SandboxLease:
+    """Sandbox used by one thread, see get_sandbox. When the thread ends, the lease is garbage collected and the sandbox is kept in idle_sandboxes for the next thread.
+    """
+    def __init__(self, root, sandbox):
+        self.sandbox = sandbox
+        weakref.finalize(self, release_sandbox, root, sandbox)
+
+def release_sandbox(root, sandbox):
+    """Keep the sandbox of a thread that ended for the next thread that needs a sandbox in root, see get_sandbox"""
+    with idle_sandboxes_lock:
+        idle_sandboxes.setdefault(root, []).append(sandbox)
+
+def get_sandbox(root, reuse = True):
+    """Get a sandbox folder in the root folder for the current thread. 
+    When reuse is True, the same sandbox is returned for all the simulations of a thread, so only the input files that changed have to be synced.
+    When the thread ends, e.g. at the end of a batch, its sandbox is reused by the next thread, also in the next batches.
+
+    Parameters
+    ----------
+    root : string
+        Folder in which the sandbox folder is created
+    reuse : bool, optional
+        If True, reuse the sandbox of the current thread, else create a new one, by default True
+
+    Returns
+    -------
+    Sandbox
+        Sandbox of the current thread
+    """
+    if not reuse:
+        return Sandbox(root)
+
+    if not hasattr(sandbox_local, 'sandboxes'):
+        sandbox_local.sandboxes = {}
+    lease = sandbox_local.sandboxes.get(root)
+    if lease is None or not os.path.isdir(lease.sandbox.folder):
+        # First simulation of this thread or the sandbox has been removed, e.g. by delete_folders. Take the sandbox of a thread that ended if there is one
+        sandbox = None
+        with idle_sandboxes_lock:
+            idle = idle_sandboxes.get(root, [])
+            while sandbox is None and len(idle) > 0:
+                candidate = idle.pop()
+                if os.path.isdir(candidate.folder):
+                    sandbox = candidate
+        if sandbox is None:
+            sandbox = Sandbox(root)
+        lease = SandboxLease(root, sandbox)
+        sandbox_local.sandboxes[root] = lease
+    return lease.sandbox
+
+def link_or_copy(file, destination):
+    """Make a file available at destination without copying its content when possible. 
+    A hardlink is tried first, then a reflink (copy-on-write clone, Linux only), then a symlink and finally a regular copy.
+    The destination file is never written to, it is replaced, so the source file is not changed.
+
+    Parameters
+    ----------
+    file : string
+        File path of the source file
+    destination : string
+        File path of the destination file
+
+    Returns
+    -------
+    string
+        Method that was used: 'hardlink', 'reflink', 'symlink' or 'copy'
+    """
+    if os.name == 'nt':
+        file, destination = str(convert_to_long_path(file)), str(convert_to_long_path(destination))
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    try:
+        os.link(file, destination)
+        return 'hardlink'
+    except OSError:
+        pass
+
+    if sys.platform.startswith('linux'):
+        try:
+            with open(file, 'rb') as src, open(destination, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            os.remove(destination)
+
+    try:
+        os.symlink(os.path.abspath(file), destination)
+        return 'symlink'
+    except (OSError, NotImplementedError):
+        pass
+
+    make_thread_safe_file_copy(file, os.path.dirname(destination))
+    return 'copy'
+
+def write_file_atomic(filename, content):
+    """Write a text file by writing a temporary file first and replacing the file with it. 
+    Readers never see a partially written file and a hardlink at filename is replaced instead of written through.
+
+    Parameters
+    ----------
+    filename : string
+        File path of the file to write
+    content : string
+        Content of the file
+    """
+    tmp_file = filename + '.' + str(uuid.uuid4()) + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as fp:
+        fp.write(content)
+    os.replace(tmp_file, filename)
+
+def sync_sandbox_file(sandbox, file, rewrite = False):
+    """Make an input file available in a sandbox folder. The file is only synced again when the source file changed since the last sync.
+
+    Parameters
+    ----------
+    sandbox : Sandbox
+        Sandbox to sync the file to, see get_sandbox
+    file : string
+        File path of the input file
+    rewrite : bool, optional
+        If True, the file is a simulation setup or layer file in which the input file names are replaced by their basename (see make_basename_input_files). 
+        The rewritten file is written to the sandbox instead of linked, by default False
+    """
+    file = os.path.abspath(file)
+    basename = os.path.basename(file)
+    stat = os.stat(file)
+    signature = (file, stat.st_ino, stat.st_size, stat.st_mtime_ns, rewrite)
+    destination = os.path.join(sandbox.folder, basename)
+    if sandbox.files.get(basename) == signature and os.path.lexists(destination):
+        return
+
+    if rewrite:
+        layer_par = make_basename_input_files(file, updateFile = False)
+        write_file_atomic(destination, devpar_write_to_txt(layer_par))
+    else:
+        link_or_copy(file, destination)
+    sandbox.files[basename] = signature
+
+def move_output_file(file, destination):
+    """Move an output file out of a sandbox folder. The file is renamed when possible and copied otherwise, e.g. to another file system.
+
+    Parameters
+    ----------
+    file : string
+        File path of the output file
+    destination : string
+        File path of the destination file
+    """
+    if os.name == 'nt':
+        file, destination = str(convert_to_long_path(file)), str(convert_to_long_path(destination))
+    try:
+        os.replace(file, destination)
+    except OSError:
+        shutil.move(file, destination)
+
+def get_scratch_dir(scratch_dir = 'auto'):
+    """Get the scratch folder to run the simulations in. With 'auto', a RAM-backed file system (/dev/shm) is used when available, 
+    otherwise the default temporary folder of the system.
+
+    Parameters
+    ----------
+    scratch_dir : string, optional
+        Scratch folder or 'auto', by default 'auto'
+
+    Returns
+    -------
+    string
+        Path of the scratch folder
+    """
+    if scratch_dir == 'auto':
+        if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            scratch_dir = '/dev/shm'
+        else:
+            scratch_dir = tempfile.gettempdir()
+    scratch_dir = os.path.join(scratch_dir, 'pySIMsalabim')
+    os.makedirs(scratch_dir, exist_ok = True)
+    return scratch_dir
@@ -0,0 +1,320 @@
+"""Functions to keep track of the simulations of (very) large sweeps in a persistent SQLite job ledger"""
+######### Package Imports #########################################################################
+
+import os, json, sqlite3, hashlib, time
+import pandas as pd
+from pySIMsalabim.utils.general import get_default_max_jobs, remap_hooks, CANCELLED_ERROR_CODE
+from pySIMsalabim.utils.results import BatchResult, SUCCESS_CODES
+
+######### Constants ###############################################################################
+
+FINISHED_RETURN_CODES = SUCCESS_CODES # Jobs that finished with these return codes are not run again when a sweep is resumed
+LEDGER_COLUMNS = ['key', 'job_type', 'session_path', 'cmd_pars', 'state', 'attempts', 'returncode', 'message', 'start', 'end', 'wall', 'outputs']
+
+######### Function Definitions ####################################################################
+
+def open_job_ledger(ledger_file):
+    """Open the job ledger and create the jobs table if it does not exist yet.
+    Each job is one row with its key (see get_job_key), state ('pending', 'done' or 'failed'), number of attempts, return code, timing and output files.
+
+    Parameters
+    ----------
+    ledger_file : string
+        Path of the SQLite database file of the ledger
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the ledger
+    """
+    folder = os.path.dirname(os.path.abspath(ledger_file))
+    os.makedirs(folder, exist_ok = True)
+    con = sqlite3.connect(ledger_file, timeout = 60)
+    # Write-ahead logging, so each finished job can be committed without syncing the whole database
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                    key TEXT PRIMARY KEY,
+                    job_type TEXT,
+                    session_path TEXT,
+                    cmd_pars TEXT,
+                    state TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    returncode INTEGER,
+                    message TEXT,
+                    start REAL,
+                    end REAL,
+                    wall REAL,
+                    outputs TEXT)''')
+    con.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)')
+    con.commit()
+    return con
+
+def get_job_key(job_type, cmd_pars, session_path):
+    """Get the key of a job in the ledger: a hash of the job type, the session path and the command line parameters, including the names of the output files.
+
+    Parameters
+    ----------
+    job_type : string
+        Type of the job: simss, zimt or the name of an experiment function
+    cmd_pars : List or dict
+        Parameters of the job, must be JSON serializable (other values are converted with str)
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    string
+        Hexadecimal key of the job
+    """
+    data = json.dumps([job_type.lower(), os.path.abspath(session_path), cmd_pars], default = str, sort_keys = True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def get_finished_jobs(con, keys):
+    """Get the jobs of the ledger that do not have to be run again: jobs that finished with a return code in FINISHED_RETURN_CODES and of which all output files still exist.
+    Jobs that failed are only returned when resume_failed is False, see run_simulation_parallel_ledger.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection to the ledger, see open_job_ledger
+    keys : List
+        Keys of the jobs to look up
+
+    Returns
+    -------
+    dict
+        (state, returncode, message) of each key that is in the ledger and finished or failed
+    """
+    finished = {}
+    keys = list(keys)
+    # Look up the keys in chunks to stay below the maximum number of SQL variables
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i+500]
+        rows = con.execute('SELECT key, state, returncode, message, outputs FROM jobs WHERE key IN (' + ','.join('?' * len(chunk)) + ')', chunk)
+        for key, state, returncode, message, outputs in rows:
+            if state == 'done' and not all(os.path.isfile(path) for path in json.loads(outputs or '{}').values()):
+                # The output has been removed since, run the job again
+                continue
+            if state in ['done', 'failed']:
+                finished[key] = (state, returncode, message)
+    return finished
+
+def record_jobs_pending(con, job_type, session_path, jobs):
+    """Add jobs to the ledger in the 'pending' state, or set them back to 'pending' if they are in the ledger already.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection to the ledger, see open_job_ledger
+    job_type : string
+        Type of the jobs: simss, zimt or the name of an experiment function
+    session_path : string
+        File path of the simss or zimt executable
+    jobs : List
+        List of (key, cmd_pars) tuples
+    """
+    with con:
+        con.executemany('''INSERT INTO jobs (key, job_type, session_path, cmd_pars, state, attempts) VALUES (?, ?, ?, ?, 'pending', 0)
+                           ON CONFLICT(key) DO UPDATE SET state = 'pending' ''',
+                        [(key, job_type.lower(), os.path.abspath(session_path), json.dumps(cmd_pars, default = str)) for key, cmd_pars in jobs])
+
+def record_job_result(con, key, returncode, timing, outputs, message = None):
+    """Record the result of a finished job in the ledger and commit it, so it is kept if the sweep is interrupted.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection to the ledger, see open_job_ledger
+    key : string
+        Key of the job, see get_job_key
+    returncode : int
+        Return code of the job
+    timing : dict
+        Timing of the job with keys 'start', 'end' and 'wall'
+    outputs : dict
+        Paths of the output files of the job that exist
+    message : string, optional
+        Return message of the job, by default None
+    """
+    state = 'done' if returncode in FINISHED_RETURN_CODES else 'failed'
+    with con:
+        con.execute('UPDATE jobs SET state = ?, attempts = attempts + 1, returncode = ?, message = ?, start = ?, end = ?, wall = ?, outputs = ? WHERE key = ?',
+                    (state, returncode, message, timing['start'], timing['end'], timing['wall'], json.dumps(outputs), key))
+
+def run_simulation_parallel_ledger(iter_func, sim_type, cmd_pars_list, session_path, max_jobs = get_default_max_jobs(), verbose = False, **kwargs):
+    """Run a list of simulations in parallel and keep track of each simulation in a job ledger.
+    When the same sweep is run again, e.g. after a crash or a reboot, the simulations that finished before are not run again.
+    The result of each simulation is committed to the ledger as soon as it finishes.
+    The simulations are run with iter_func, so GNU parallel and the workers of run_simulation_distributed are not used.
+
+    Parameters
+    ----------
+    iter_func : function
+        Function that runs the simulations in parallel and yields the result of each simulation as soon as it finishes, i.e. iter_simulation_parallel
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+    max_jobs : int
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs)
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments:
+        ledger : string, path of the SQLite database file of the ledger
+        resume_failed : bool, also run the simulations again that failed before, by default False
+        the other keyword arguments are passed to iter_func. The simulations that are cancelled (see CancellationToken) stay pending and are run when the sweep is resumed
+
+    Returns
+    -------
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. It behaves like the list of return codes, the simulations taken from the ledger have no resource usage
+    """
+    ledger_file = kwargs.pop('ledger')
+    resume_failed = kwargs.pop('resume_failed', False)
+
+    con = open_job_ledger(ledger_file)
+    try:
+        keys = [get_job_key(sim_type, cmd_pars, session_path) for cmd_pars in cmd_pars_list]
+        finished = get_finished_jobs(con, set(keys))
+        return_code_list = [None] * len(cmd_pars_list)
+        usage_list = [None] * len(cmd_pars_list)
+        start_list = [float('nan')] * len(cmd_pars_list)
+        todo = []
+        for idx, key in enumerate(keys):
+            if key in finished and (finished[key][0] == 'done' or not resume_failed):
+                return_code_list[idx] = finished[key][1]
+            else:
+                todo.append(idx)
+        if verbose:
+            print(str(len(cmd_pars_list) - len(todo)) + ' of ' + str(len(cmd_pars_list)) + ' simulations are in the ledger already, running the other ' + str(len(todo)))
+
+        record_jobs_pending(con, sim_type, session_path, [(keys[idx], cmd_pars_list[idx]) for idx in todo])
+        if kwargs.get('hooks'):
+            # Report the index in cmd_pars_list to the hooks
+            kwargs['hooks'] = remap_hooks(kwargs['hooks'], todo)
+        for todo_idx, result, output_files, timing in iter_func(sim_type, [cmd_pars_list[idx] for idx in todo], session_path, max_jobs, verbose, **kwargs):
+            idx = todo[todo_idx]
+            return_code_list[idx] = result
+            usage_list[idx] = timing.get('usage')
+            start_list[idx] = timing['start']
+            if result == CANCELLED_ERROR_CODE:
+                # Not a result of the simulation, keep it pending
+                continue
+            outputs = {par_name: path for par_name, path in output_files.items() if os.path.isfile(path)}
+            record_job_result(con, keys[idx], result, timing, outputs)
+    finally:
+        con.close()
+    return BatchResult(return_code_list, usage = usage_list, start = start_list, sim_type = sim_type, cmd_pars_list = cmd_pars_list, session_path = session_path)
+
+def run_experiment_ledger(ledger_file, experiment, device_parameters, session_path, *args, **kwargs):
+    """Run an experiment, e.g. run_SS_JV or run_EQE, and keep track of it in a job ledger.
+    If the same experiment with the same arguments finished before, it is not run again and the recorded return code and message are returned.
+    The output files are the files in session_path that were written while the experiment ran, so experiments in the same session_path should not run at the same time.
+
+    Parameters
+    ----------
+    ledger_file : string
+        Path of the SQLite database file of the ledger
+    experiment : function
+        Experiment function to run, called as experiment(device_parameters, session_path, *args, **kwargs). It must return (returncode, message)
+    device_parameters : string
+        Name of the simulation setup file
+    session_path : string
+        File path of the simss or zimt executable
+    *args : list
+        Positional arguments of the experiment
+    **kwargs : dict
+        Keyword arguments of the experiment, resume_failed : bool, also run the experiment again if it failed before, by default False
+
+    Returns
+    -------
+    int
+        Return code of the experiment
+    string
+        Return message of the experiment
+    """
+    resume_failed = kwargs.pop('resume_failed', False)
+    job_type = experiment.__name__
+    key = get_job_key(job_type, [device_parameters, args, kwargs], session_path)
+
+    con = open_job_ledger(ledger_file)
+    try:
+        finished = get_finished_jobs(con, [key])
+        if key in finished and (finished[key][0] == 'done' or not resume_failed):
+            return finished[key][1], finished[key][2]
+
+        record_jobs_pending(con, job_type, session_path, [(key, [device_parameters, args, kwargs])])
+        start = time.time()
+        returncode, message = experiment(device_parameters, session_path, *args, **kwargs)
+        end = time.time()
+
+        # The output files of the experiment are the files that were written while it ran
+        outputs = {}
+        for name in os.listdir(session_path):
+            path = os.path.join(session_path, name)
+            # Allow for the coarse modification time of some file systems
+            if os.path.isfile(path) and os.path.getmtime(path) >= start - 1:
+                outputs[name] = path
+        record_job_result(con, key, returncode, {'start': start, 'end': end, 'wall': end - start}, outputs, str(message))
+    finally:
+        con.close()
+    return returncode, message
+
+def get_ledger_jobs(ledger_file, state = None, job_type = None):
+    """Get the jobs of a ledger, e.g. to find the output files of a sweep without scanning the session folder.
+
+    Parameters
+    ----------
+    ledger_file : string
+        Path of the SQLite database file of the ledger
+    state : string, optional
+        Only get the jobs in this state: 'pending', 'done' or 'failed', by default None (all jobs)
+    job_type : string, optional
+        Only get the jobs of this type: simss, zimt or the name of an experiment function, by default None (all types)
+
+    Returns
+    -------
+    DataFrame
+        One row per job with the columns LEDGER_COLUMNS. cmd_pars and outputs are decoded from JSON.
+    """
+    query, params = 'SELECT ' + ', '.join(LEDGER_COLUMNS) + ' FROM jobs WHERE 1=1', []
+    if state is not None:
+        query += ' AND state = ?'
+        params.append(state)
+    if job_type is not None:
+        query += ' AND job_type = ?'
+        params.append(job_type.lower())
+
+    con = open_job_ledger(ledger_file)
+    try:
+        df = pd.DataFrame(con.execute(query, params).fetchall(), columns = LEDGER_COLUMNS)
+    finally:
+        con.close()
+    df['cmd_pars'] = df['cmd_pars'].apply(lambda val: json.loads(val) if val is not None else None)
+    df['outputs'] = df['outputs'].apply(lambda val: json.loads(val) if val is not None else {})
+    return df
+
+def get_ledger_outputs(ledger_file, par_name = 'JVFile', state = 'done'):
+    """Get the paths of one type of output file of the jobs in a ledger, e.g. all JV files of a sweep.
+
+    Parameters
+    ----------
+    ledger_file : string
+        Path of the SQLite database file of the ledger
+    par_name : string, optional
+        Output file parameter (or file name for experiments), by default 'JVFile'
+    state : string, optional
+        Only get the jobs in this state, by default 'done'
+
+    Returns
+    -------
+    List
+        Paths of the output files
+    """
+    df = get_ledger_jobs(ledger_file, state = state)
+    return [outputs[par_name] for outputs in df['outputs'] if par_name in outputs]
@@ -1,13 +1,22 @@
 """Functions for general use"""
 ######### Package Imports #########################################################################
 
-import os, zipfile, subprocess, uuid, shutil, threading, queue
+import os, zipfile, subprocess, uuid, shutil, threading, queue, time, signal, shlex, json
 import pandas as pd
-from subprocess import run, PIPE
+import numpy as np
+from subprocess import run, PIPE, DEVNULL, Popen, TimeoutExpired
 from functools import partial
 from threading import Thread
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pySIMsalabim.utils.general import *
 from pySIMsalabim.utils.device_parameters import *
+from pySIMsalabim.utils.sim_cache import run_simulation_parallel_cached
+from pySIMsalabim.utils.distributed import run_simulation_distributed
+from pySIMsalabim.utils.job_ledger import run_simulation_parallel_ledger
+from pySIMsalabim.utils.runtime_history import get_runtime_cost_function, record_simulation_runtime
+from pySIMsalabim.utils.results import BatchResult, get_overall_return_code, SUCCESS_CODES
 if os.name == 'nt':
     from pySIMsalabim.aux_funcs.PathChecksWin import convert_to_long_path
 
@@ -47,6 +56,12 @@ def parallel_error_message(errorcode):
             message += 'Runtime exceeds limit set by timeout.'
         elif errorcode == 99:
             message += 'Programming error (i.e. not due to the user!).'
+    elif errorcode == TIMEOUT_ERROR_CODE:
+        message = 'Error '+str(errorcode) +': Simulation killed, runtime exceeds the wall-clock time limit set by timeout.'
+    elif errorcode == CPU_LIMIT_ERROR_CODE:
+        message = 'Error '+str(errorcode) +': Simulation killed, CPU time exceeds the limit set by cpu_time_limit.'
+    elif errorcode == CANCELLED_ERROR_CODE:
+        message = 'Error '+str(errorcode) +': Simulation cancelled, the batch was cancelled before or while it ran.'
     elif errorcode > 100:
         message = 'Fatal error '+str(errorcode) +': '
         if errorcode == 106:
@@ -57,6 +72,8 @@ def parallel_error_message(errorcode):
             message += 'Range check error.'
         elif errorcode == 202:
             message += 'Stack overflow error: This error is only reported when stack checking is enabled.'
+        elif errorcode == 203:
+            message += 'Heap overflow error: The simulation ran out of memory, check the memory limit.'
         elif errorcode == 205:
             message += 'Floating point overflow.'
         elif errorcode == 206:
@@ -69,7 +86,7 @@ def parallel_error_message(errorcode):
 
     return message
 
-def run_simulation_parallel(sim_type, cmd_pars_list, session_path, max_jobs = max(1,os.cpu_count()-1), verbose=False, **kwargs):
+def run_simulation_parallel(sim_type, cmd_pars_list, session_path, max_jobs = get_default_max_jobs(), verbose=False, **kwargs):
     """Run the SIMsalabim simulation executable with the chosen device parameters.  
     Select the correct function to run the simulation in parallel based on the operating system.
 
@@ -77,41 +94,573 @@ def run_simulation_parallel(sim_type, cmd_pars_list, session_path, max_jobs = ma
     ----------
     sim_type : string
         Which type of simulation to run: simss or zimt
-    cmd_pars_list : List
+    cmd_pars_list : List or iterable
         List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
         Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+        It can also be a lazy iterable, e.g. a generator, for very large batches: the simulations are then taken from it while the others run, 
+        so the batch is never held in memory as a whole, see is_lazy_cmd_pars. job_costs, ledger, cache_dir, workers and a persistent joblog need the whole batch, 
+        so the iterable is turned into a list for them.
     session_path : string
         File path of the simss or zimt executable 
-    max_jobs : int
-        Maximum number of parallel jobs to run. Default is the number of CPU cores - 1
+    max_jobs : int or string
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs).
+        With 'auto', the number of parallel jobs is adjusted while running to get the highest throughput, see ConcurrencyAutotuner. GNU parallel is not used in this case.
     verbose : bool
         If True, print the output of the simulation to the console
     **kwargs : dict
-        Additional keyword arguments to pass to the function
+        Additional keyword arguments to pass to the function:
+        autotune_log, autotune_max : options of the autotuner for max_jobs = 'auto', see get_worker_pool_size
+        job_costs : list or function, estimated cost (e.g. runtime) of each simulation or a function that returns it for the cmd_pars of a simulation. 
+            The simulations are started in order of decreasing cost to shorten the total runtime, see get_lpt_order. By default None (in the order of cmd_pars_list)
+            With 'history', the runtime is predicted from the runtime_history, see get_runtime_cost_function.
+        runtime_history : string, runtime history file to add the wall time and the features of each simulation to, see record_simulation_runtime
+        force_multithreading : bool, use the multithreaded runner even if GNU parallel is available, by default False
+        timeout, cpu_time_limit, memory_limit, niceness : per-simulation watchdog limits, see execute_simulation
+        pin_cpus, cpus_per_job : pin each simulation to free CPUs with the policy 'compact' or 'scatter', see execute_simulation. GNU parallel is not used in this case.
+        cache_dir, cache_max_size, cache_max_age : only run the simulations that are not in the cache, see run_simulation_parallel_cached
+        scratch_dir, keep_outputs : run the simulations in sandboxes on a scratch folder and only keep the requested output files, see run_simulation_filesafe. 
+            GNU parallel is not used in this case.
+        workers : list of 'host:port' addresses of worker daemons to run the simulations on instead of this machine, see run_simulation_distributed.
+            token, heartbeat_interval, heartbeat_timeout and max_attempts are passed on, max_jobs is not used as each worker sets its own number of slots.
+        ledger, resume_failed : keep track of the simulations in a persistent job ledger and do not run the simulations again that finished before, 
+            see run_simulation_parallel_ledger.
+        hooks : dict, functions called as hook(idx, info) when a simulation is submitted, started, finished, failed or retried, with idx the index in cmd_pars_list, 
+            see call_hook. Nothing is done for the events without a function, by default None
+        fail_fast : bool or int, cancel the batch as soon as the first simulation (True) or this number of simulations failed with one of the fail_fast_codes, 
+            i.e. with an error in the input that makes the other simulations fail the same way, see add_fail_fast_hook. By default None (off)
+        fail_fast_codes : List, return codes that count for fail_fast, by default FAIL_FAST_CODES (90, 91 and 96)
+        cancel_token : CancellationToken, token to cancel the batch from another thread, e.g. a notebook or a web request. 
+            The queued simulations are not run and the running ones are killed, they return CANCELLED_ERROR_CODE. See CancellationToken
+        retry_ladder : bool, List or RetryLadder, run the simulations that failed to converge (retry_codes) again with the overrides of each rung of the ladder, 
+            True for DEFAULT_RETRY_LADDER. The ladder is shared by the batch, so the rungs that rescued simulations are tried first. See RetryLadder. 
+            The rung that rescued each simulation is in the rungs column of the result. GNU parallel is not used in this case.
+        retry_codes : List, return codes of the simulations to run again, by default RETRY_CODES (93 and 94)
     Returns
     -------
-    CompletedProcess
-        Output object of with returncode and console output of the simulation
-
+    BatchResult
+        Result of each simulation (return code, message of the failed simulations, start time and resource usage), in the same order as cmd_pars_list.
+        It behaves like the list of return codes that was returned before, e.g. batch == [0, 0, 0], and the codes can be filtered with batch.filter(codes = 95)
+        For a lazy cmd_pars_list, the BatchResult does not know the cmd_pars, so it has no output_files. 
+        If the batch is cancelled, the simulations that were not taken from it yet are not in the BatchResult.
+
+    The resource usage of the batch (CPU time, peak RSS, I/O, CPU utilization) can be retrieved afterwards with get_last_batch_resource_usage, 
+    with GNU parallel only the wall time of each simulation is known.
     """    
-    force_multithreading = kwargs.get('force_multithreading', False)
+    apply_fail_fast(kwargs)
+    retry_ladder = get_retry_ladder(kwargs)
+    job_costs = kwargs.pop('job_costs', None)
+    if is_lazy_cmd_pars(cmd_pars_list) and (job_costs is not None or any(kwargs.get(key) is not None for key in ['ledger', 'cache_dir', 'workers', 'joblog'])):
+        # These runners need the whole batch before the first simulation starts
+        cmd_pars_list = list(cmd_pars_list)
+    if job_costs == 'history':
+        job_costs = get_runtime_cost_function(kwargs['runtime_history'], sim_type, session_path)
+    if job_costs is not None:
+        # Start the most expensive simulations first and return the return codes in the order of cmd_pars_list
+        order = get_lpt_order(cmd_pars_list, job_costs)
+        kwargs['hooks'] = remap_hooks(kwargs.get('hooks'), order)
+        ordered_results = run_simulation_parallel(sim_type, [cmd_pars_list[idx] for idx in order], session_path, max_jobs, verbose, **kwargs)
+        batch = BatchResult([None] * len(cmd_pars_list), sim_type = sim_type, cmd_pars_list = cmd_pars_list, session_path = session_path)
+        batch.update(order, ordered_results)
+        return batch
+
+    if kwargs.get('ledger') is not None:
+        return run_simulation_parallel_ledger(iter_simulation_parallel, sim_type, cmd_pars_list, session_path, max_jobs, verbose, **kwargs)
+
+    if kwargs.get('cache_dir') is not None:
+        return run_simulation_parallel_cached(run_simulation_parallel, sim_type, cmd_pars_list, session_path, max_jobs, verbose, **kwargs)
+
+    workers = kwargs.pop('workers', None)
+    if workers is not None:
+        # Run the simulations on the worker daemons
+        result, msg_list, batch = run_simulation_distributed(sim_type, cmd_pars_list, session_path, workers, verbose, **kwargs)
+        return batch
+
+    force_multithreading = kwargs.pop('force_multithreading', False)
+    if kwargs.get('scratch_dir') is not None:
+        # The simulations run in sandboxes on the scratch folder, which the worker threads manage
+        force_multithreading = True
+    if kwargs.get('pin_cpus') is not None:
+        # The worker threads pin each simulation to the CPUs they claim
+        force_multithreading = True
+    if max_jobs == 'auto':
+        # The number of worker threads is adjusted while running
+        force_multithreading = True
+    if retry_ladder is not None:
+        # The worker threads run the failed simulations again
+        force_multithreading = True
 
     if os.name == 'nt':
         # Windows
-        result, msg_list, return_code_list = run_simulation_multithreaded_windows(sim_type, cmd_pars_list, session_path, max_jobs, verbose)
+        result, msg_list, return_code_list = run_simulation_multithreaded_windows(sim_type, cmd_pars_list, session_path, max_jobs, verbose, **kwargs)
         result_list = return_code_list
     else:
         # Linux
         if shutil.which('parallel') is not None and not force_multithreading:
-            result, msg_list, return_code_list  = run_simulation_GNU_parallel(sim_type, cmd_pars_list, session_path, max_jobs, verbose)
+            result, msg_list, return_code_list  = run_simulation_GNU_parallel(sim_type, cmd_pars_list, session_path, max_jobs, verbose, **kwargs)
             result_list = return_code_list           
         else:
-            result, msg_list, return_code_list = run_simulation_multithreaded_linux(sim_type, cmd_pars_list, session_path, max_jobs, verbose)
+            result, msg_list, return_code_list = run_simulation_multithreaded_linux(sim_type, cmd_pars_list, session_path, max_jobs, verbose, **kwargs)
             result_list = return_code_list
 
+    if verbose:
+        print_resource_usage(get_last_batch_resource_usage())
+        if retry_ladder is not None:
+            retry_ladder.report()
+
     return result_list
 
-def run_simulation_GNU_parallel(sim_type, cmd_pars_list, session_path, max_jobs = max(1,os.cpu_count()-1),verbose=False):
+def iter_simulation_parallel(sim_type, cmd_pars_list, session_path, max_jobs = get_default_max_jobs(), verbose=False, **kwargs):
+    """Run the SIMsalabim simulation executable for a list of parameters in parallel and yield the result of each simulation as soon as it finishes.  
+    This allows processing the output of the finished simulations while the others are still running.
+    The simulations are run by a fixed-size pool of max_jobs worker threads, the results are yielded in completion order, not in input order.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List or iterable
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+        It can also be a lazy iterable, the simulations are taken from it when a worker is free, see run_simulation_parallel
+    session_path : string
+        File path of the simss or zimt executable 
+    max_jobs : int or string
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs). 
+        With 'auto', the number of parallel jobs is adjusted while running, see ConcurrencyAutotuner
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments:
+        autotune_log, autotune_max : options of the autotuner for max_jobs = 'auto', see get_worker_pool_size
+        job_costs : list or function, estimated cost of each simulation, the simulations are started in order of decreasing cost, see get_lpt_order. 
+            With 'history', the runtime is predicted from the runtime_history, see get_runtime_cost_function
+        runtime_history : string, runtime history file to add the wall time and the features of each simulation to, see record_simulation_runtime
+        threadsafe : bool, run each simulation in its own temporary folder (run_simulation_filesafe), by default True on Windows and False otherwise
+        timeout, cpu_time_limit, memory_limit, niceness : per-simulation watchdog limits, see execute_simulation
+        pin_cpus, cpus_per_job : pin each simulation to free CPUs with the policy 'compact' or 'scatter', see execute_simulation
+        cache_dir, cache_max_size, cache_max_age : restore the simulations that are in the cache instead of running them, see run_simulation_cached
+        scratch_dir, keep_outputs : run the simulations in sandboxes on a scratch folder and only keep the requested output files, see run_simulation_filesafe
+        hooks : dict, functions called when a simulation is submitted, started, finished or failed, see call_hook
+        fail_fast, fail_fast_codes, cancel_token : cancel the simulations that did not finish yet after input errors or from another thread, see run_simulation_parallel
+        retry_ladder, retry_codes : run the simulations that failed to converge again with the rungs of a retry ladder, see run_simulation_parallel
+
+    Yields
+    ------
+    int
+        Index of the simulation in cmd_pars_list
+    int
+        Return code of the simulation process, 0 for success, other values for errors.
+    dict
+        Dictionary with the paths of the output files of the simulation, see get_output_files
+    dict
+        Timing of the simulation with keys 'start' and 'end' (time since the epoch in s), 'wall' (wall time in s) and 'usage' (resource usage, see get_resource_usage)
+    """
+    threadsafe = kwargs.pop('threadsafe', os.name == 'nt')
+    apply_fail_fast(kwargs)
+    get_retry_ladder(kwargs)
+    max_jobs = get_worker_pool_size(max_jobs, sim_type, kwargs, verbose)
+    job_costs = kwargs.pop('job_costs', None)
+    if job_costs == 'history':
+        job_costs = get_runtime_cost_function(kwargs['runtime_history'], sim_type, session_path)
+    if job_costs is not None:
+        cmd_pars_list = list(cmd_pars_list)
+        indexed_cmd_pars = ((idx, cmd_pars_list[idx]) for idx in get_lpt_order(cmd_pars_list, job_costs))
+    else:
+        indexed_cmd_pars = enumerate(cmd_pars_list)
+    n_total = None if is_lazy_cmd_pars(cmd_pars_list) else len(cmd_pars_list)
+
+    # cmd_pars of the simulations that were taken by the pool and did not finish yet, so a lazy cmd_pars_list is only read once
+    running = {}
+    def get_tasks():
+        for idx, cmd_pars in indexed_cmd_pars:
+            running[idx] = cmd_pars
+            yield idx, (sim_type, cmd_pars, session_path, threadsafe, verbose)
+
+    hooks = kwargs.pop('hooks', None)
+    target = partial(run_simulation_job, **kwargs)
+    target, tasks = get_hooked_tasks(target, get_tasks(), hooks, n_total, keyed = True)
+    usage_list = []
+    for idx, (result, message, timing) in iter_worker_pool(target, tasks, max_jobs):
+        usage_list.append(timing['usage'])
+        resource_usage_local.batch = summarize_resource_usage(usage_list)
+        yield idx, result, get_output_files(sim_type, running.pop(idx), session_path), timing
+    if isinstance(max_jobs, ConcurrencyAutotuner):
+        max_jobs.report()
+
+def run_simulation_batch(jobs, max_jobs = get_default_max_jobs(), verbose = False, **kwargs):
+    """Run a batch of simulations of different types, e.g. the steady-state JV (simss) and impedance (zimt) simulations of a characterisation campaign, on one pool of worker threads.
+    Each job has its own executable and session path. A worker that finishes a simulation takes the next one regardless of its type, 
+    so the CPUs stay busy across the experiments and there is only one tail at the end instead of one per experiment. 
+    With job_costs, the most expensive simulations of all types are started first. See get_batch_jobs to make the jobs from the cmd_pars_list of each experiment.
+
+    Parameters
+    ----------
+    jobs : List or iterable
+        Simulations to run, each a dict with the keys sim_type (simss or zimt), cmd_pars (list with parameters to add to the simss/zimt cmd line, each a dict with par,val keys) 
+        and session_path (file path of the simss or zimt executable), e.g. {'sim_type': 'zimt', 'cmd_pars': [{'par':'dev_par_file','val':'simulation_setup.txt'}], 'session_path': 'SIMsalabim/ZimT'}.
+        It can also be a lazy iterable of them, see is_lazy_cmd_pars
+    max_jobs : int or string
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs). 
+        With 'auto', the number of parallel jobs is adjusted while running, see ConcurrencyAutotuner, the autotune_log entry is stored as 'batch'
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments:
+        threadsafe : bool, run each simulation in a sandbox in its session folder (run_simulation_filesafe), by default True on Windows and False otherwise
+        job_costs : list or function, estimated cost of each simulation or a function that returns it for a job, see get_lpt_order. 
+            With 'history', the runtime of each job is predicted from the runtime_history of its sim_type and session_path, see get_runtime_cost_function
+        autotune_log, autotune_max, runtime_history, timeout, cpu_time_limit, memory_limit, niceness, pin_cpus, cpus_per_job, cache_dir, scratch_dir, keep_outputs, 
+        hooks, fail_fast, fail_fast_codes, cancel_token, retry_ladder, retry_codes : see run_simulation_parallel
+
+    Returns
+    -------
+    BatchResult
+        Result of each simulation, in the same order as jobs. Its sim_type and session_path are lists with the values of each simulation. 
+        For a lazy iterable of jobs, the BatchResult has no output_files
+    """
+    threadsafe = kwargs.pop('threadsafe', os.name == 'nt')
+    apply_fail_fast(kwargs)
+    retry_ladder = get_retry_ladder(kwargs)
+    job_costs = kwargs.pop('job_costs', None)
+    if job_costs is not None:
+        jobs = list(jobs)
+        if job_costs == 'history':
+            cost_functions = {} # runtime model of each sim_type and session_path
+            def job_costs(job):
+                key = (job['sim_type'], job['session_path'])
+                if key not in cost_functions:
+                    cost_functions[key] = get_runtime_cost_function(kwargs['runtime_history'], *key)
+                return cost_functions[key](job['cmd_pars'])
+        # Start the most expensive simulations first and return the results in the order of jobs
+        order = get_lpt_order(jobs, job_costs)
+        kwargs['hooks'] = remap_hooks(kwargs.get('hooks'), order)
+        ordered_results = run_simulation_batch([jobs[idx] for idx in order], max_jobs, False, threadsafe = threadsafe, **kwargs)
+        batch = BatchResult([None] * len(jobs), sim_type = [job['sim_type'] for job in jobs], cmd_pars_list = [job['cmd_pars'] for job in jobs], 
+                            session_path = [job['session_path'] for job in jobs])
+        batch.update(order, ordered_results)
+    else:
+        max_jobs = get_worker_pool_size(max_jobs, 'batch', kwargs, verbose)
+        hooks = kwargs.pop('hooks', None)
+        n_total = None if is_lazy_cmd_pars(jobs) else len(jobs)
+        batch = run_batch_in_worker_pool(partial(worker_batch, **kwargs), ((job['sim_type'], job['cmd_pars'], job['session_path']) for job in jobs), 
+                                         (threadsafe, verbose), hooks, max_jobs, n_total)
+        if isinstance(max_jobs, ConcurrencyAutotuner):
+            max_jobs.report()
+        if n_total is not None:
+            batch.sim_type = [job['sim_type'] for job in jobs]
+            batch.cmd_pars_list = [job['cmd_pars'] for job in jobs]
+            batch.session_path = [job['session_path'] for job in jobs]
+
+    if verbose:
+        print_resource_usage(get_last_batch_resource_usage())
+        if retry_ladder is not None:
+            retry_ladder.report()
+
+    return batch
+
+def get_batch_jobs(sim_type, cmd_pars_list, session_path):
+    """Make the jobs of run_simulation_batch from the cmd_pars_list of one type of simulation, 
+    e.g. jobs = get_batch_jobs('simss', JV_cmd_pars_list, simss_path) + get_batch_jobs('zimt', impedance_cmd_pars_list, zimt_path)
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+    session_path : string
+        File path of the simss or zimt executable 
+
+    Returns
+    -------
+    List
+        Job of each simulation, see run_simulation_batch
+    """
+    return [{'sim_type': sim_type, 'cmd_pars': cmd_pars, 'session_path': session_path} for cmd_pars in cmd_pars_list]
+
+def is_lazy_cmd_pars(cmd_pars_list):
+    """Check if cmd_pars_list is a lazy iterable, e.g. a generator, instead of a list or tuple with the cmd_pars of all simulations.
+    A lazy iterable is only read once, while the simulations run, and its length is not known in advance.
+
+    Parameters
+    ----------
+    cmd_pars_list : List or iterable
+        cmd_pars of the simulations
+
+    Returns
+    -------
+    bool
+        True if cmd_pars_list is not a sequence
+    """
+    return not isinstance(cmd_pars_list, Sequence)
+
+def get_lpt_order(cmd_pars_list, job_costs):
+    """Get the order in which to start the simulations: longest processing time first (LPT).
+    Starting the most expensive simulations first avoids a long tail at the end of a parallel run in which one worker still runs an expensive simulation while the others are idle.
+    Simulations with an unknown cost (None) are started first, as they might be expensive.
+
+    Parameters
+    ----------
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+    job_costs : list or function
+        Estimated cost (e.g. runtime in s) of each simulation, in the same order as cmd_pars_list, 
+        or a function that returns the estimated cost for the cmd_pars of a simulation, e.g. a runtime model
+
+    Returns
+    -------
+    List
+        Indices of cmd_pars_list in the order in which the simulations should be started
+
+    Raises
+    ------
+    ValueError
+        If job_costs is a list with a different length than cmd_pars_list
+    """
+    if callable(job_costs):
+        costs = [job_costs(cmd_pars) for cmd_pars in cmd_pars_list]
+    else:
+        costs = list(job_costs)
+        if len(costs) != len(cmd_pars_list):
+            raise ValueError('job_costs has ' + str(len(costs)) + ' entries, but there are ' + str(len(cmd_pars_list)) + ' simulations.')
+    # Stable sort, so simulations with the same cost keep their order
+    return sorted(range(len(cmd_pars_list)), key = lambda idx: (costs[idx] is not None, -(costs[idx] or 0)))
+
+def iter_worker_pool(target, tasks, max_jobs = get_default_max_jobs()):
+    """Run target(*args) for each (key, args) task on a fixed-size pool of max_jobs worker threads and yield the results as soon as they are available.  
+    New tasks are only taken from tasks when a worker is free, so tasks can be a lazy iterable.
+
+    Parameters
+    ----------
+    target : callable
+        Function to run for each task
+    tasks : iterable
+        Iterable of (key, args) tuples, with args the tuple of positional arguments for target
+    max_jobs : int or ConcurrencyAutotuner
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs).
+        With a ConcurrencyAutotuner, the number of parallel jobs is adjusted while running to get the highest throughput.
+
+    Yields
+    ------
+    object
+        Key of the finished task
+    object
+        Return value of target for the finished task
+    """
+    tuner = max_jobs if isinstance(max_jobs, ConcurrencyAutotuner) else None
+    max_workers = tuner.upper if tuner is not None else max(1, int(max_jobs))
+    tasks = iter(tasks)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            # Fill the free workers
+            limit = tuner.max_jobs if tuner is not None else max_workers
+            while len(running) < limit:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                key, args = task
+                running[executor.submit(target, *args)] = key
+            if len(running) == 0:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                if tuner is not None:
+                    tuner.job_finished()
+                yield key, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+class ConcurrencyAutotuner:
+    """Adjust the number of parallel jobs while running to get the highest throughput (finished jobs per second), used with max_jobs = 'auto'.
+    The throughput is measured over a window of finished jobs. The number of jobs is changed in steps by hill climbing: 
+    it keeps moving in the same direction while the throughput improves and turns around when it does not. 
+    Once both neighbours of the best number of jobs have been measured, the best number is used for the rest of the run.
+    The chosen number is printed at the end of the run and, with autotune_log, stored so that a later run can start from it (see get_autotuned_max_jobs).
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation is run: simss or zimt, used as key in the autotune_log
+    lower : int, optional
+        Minimum number of parallel jobs, by default 1
+    upper : int, optional
+        Maximum number of parallel jobs, by default the number of usable CPUs (get_cpu_count)
+    start : int, optional
+        Number of parallel jobs to start with, by default the value stored in autotune_log or half of upper
+    autotune_log : string, optional
+        JSON file in which the chosen number of parallel jobs is stored for each sim_type, by default None
+    min_improvement : float, optional
+        Relative improvement of the throughput needed to keep moving in the same direction, by default 0.05
+    verbose : bool, optional
+        If True, print each change of the number of parallel jobs, by default False
+    """
+    def __init__(self, sim_type, lower = 1, upper = None, start = None, autotune_log = None, min_improvement = 0.05, verbose = False):
+        self.sim_type = sim_type.lower()
+        self.lower = max(1, int(lower))
+        self.upper = max(self.lower, int(upper if upper is not None else get_cpu_count()))
+        if start is None and autotune_log is not None:
+            start = get_autotuned_max_jobs(autotune_log, sim_type)
+        if start is None:
+            start = (self.upper + 1) // 2
+        self.max_jobs = min(self.upper, max(self.lower, int(start)))
+        self.autotune_log = autotune_log
+        self.min_improvement = min_improvement
+        self.verbose = verbose
+
+        self.throughput = {} # Measured throughput for each number of parallel jobs
+        self.direction = 1
+        self.converged = self.lower == self.upper
+        self.lock = threading.Lock()
+        self.start_window()
+
+    def start_window(self):
+        """Start a new measurement window for the current number of parallel jobs"""
+        self.window_start = time.perf_counter()
+        self.window_done = 0
+        # At least 2 jobs per slot, so each slot finished a job that was started with this number of parallel jobs
+        self.window_size = max(4, 2 * self.max_jobs)
+
+    def job_finished(self):
+        """Register a finished job and adjust the number of parallel jobs at the end of a measurement window"""
+        with self.lock:
+            self.window_done += 1
+            if self.converged or self.window_done < self.window_size:
+                return
+            throughput = self.window_done / max(time.perf_counter() - self.window_start, 1e-9)
+            self.throughput[self.max_jobs] = max(throughput, self.throughput.get(self.max_jobs, 0))
+            self.max_jobs = self.next_max_jobs()
+            if self.verbose:
+                print('Autotuner: {:.2f} simulations/s, now running {} parallel jobs.'.format(throughput, self.max_jobs))
+            self.start_window()
+
+    def best(self):
+        """Number of parallel jobs with the highest measured throughput, the current number if nothing has been measured yet"""
+        if len(self.throughput) == 0:
+            return self.max_jobs
+        return max(self.throughput, key = self.throughput.get)
+
+    def next_max_jobs(self):
+        """Choose the number of parallel jobs for the next measurement window"""
+        best = self.best()
+        step = max(1, round(0.25 * best))
+        if self.max_jobs != best and self.throughput[self.max_jobs] < self.throughput[best] * (1 + self.min_improvement):
+            # No improvement, turn around
+            self.direction = -self.direction
+        for _ in range(2):
+            candidate = min(self.upper, max(self.lower, best + self.direction * step))
+            if candidate != best and candidate not in self.throughput:
+                return candidate
+            self.direction = -self.direction
+        # Both neighbours have been measured
+        self.converged = True
+        return best
+
+    def report(self):
+        """Print the chosen number of parallel jobs and store it in the autotune_log"""
+        best = self.best()
+        throughput = self.throughput.get(best)
+        print('Autotuned max_jobs for {}: {}{}'.format(self.sim_type, best, '' if throughput is None else ' ({:.2f} simulations/s)'.format(throughput)))
+        if self.autotune_log is not None and throughput is not None:
+            log = {}
+            if os.path.isfile(self.autotune_log):
+                with open(self.autotune_log, 'r') as fp:
+                    log = json.load(fp)
+            log[self.sim_type] = {'max_jobs': best, 'throughput': throughput, 'cpu_count': get_cpu_count(), 'time': time.time()}
+            write_file_atomic(self.autotune_log, json.dumps(log, indent = 4))
+
+def get_autotuned_max_jobs(autotune_log, sim_type):
+    """Get the number of parallel jobs chosen by the autotuner in an earlier run, see ConcurrencyAutotuner.
+
+    Parameters
+    ----------
+    autotune_log : string
+        JSON file in which the autotuner stored the chosen number of parallel jobs
+    sim_type : string
+        Which type of simulation: simss or zimt
+
+    Returns
+    -------
+    int or None
+        Number of parallel jobs, None if there is none stored for this sim_type or it was stored on a host with a different number of usable CPUs
+    """
+    try:
+        with open(autotune_log, 'r') as fp:
+            entry = json.load(fp)[sim_type.lower()]
+    except (OSError, ValueError, KeyError):
+        return None
+    if entry.get('cpu_count') != get_cpu_count():
+        return None
+    return int(entry['max_jobs'])
+
+def get_worker_pool_size(max_jobs, sim_type, kwargs, verbose = False):
+    """Get the max_jobs argument of the worker pools: the number of parallel jobs, or a ConcurrencyAutotuner when max_jobs is 'auto'.
+
+    Parameters
+    ----------
+    max_jobs : int or string
+        Maximum number of parallel jobs to run, or 'auto'
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    kwargs : dict
+        Keyword arguments of the runner, the autotuner options are removed from this dict:
+        autotune_log : string, JSON file to store the chosen number of parallel jobs in and to start from, by default None
+        autotune_max : int, maximum number of parallel jobs, by default the number of usable CPUs
+    verbose : bool, optional
+        If True, print each change of the number of parallel jobs, by default False
+
+    Returns
+    -------
+    int or ConcurrencyAutotuner
+        max_jobs argument of iter_worker_pool and run_in_worker_pool
+    """
+    autotune_log = kwargs.pop('autotune_log', None)
+    autotune_max = kwargs.pop('autotune_max', None)
+    if max_jobs == 'auto':
+        return ConcurrencyAutotuner(sim_type, upper = autotune_max, autotune_log = autotune_log, verbose = verbose)
+    return max(1, int(max_jobs))
+
+def run_simulation_job(sim_type, cmd_pars, session_path, threadsafe=False, verbose=False, **kwargs):
+    """Run a single simulation as part of a parallel run and measure its timing.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+    session_path : string
+        File path of the simss or zimt executable 
+    threadsafe : bool
+        If True, run the simulation in its own temporary folder with run_simulation_filesafe
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments passed to the simulation runner, e.g. the watchdog limits, see execute_simulation
+
+    Returns
+    -------
+    int
+        Return code of the simulation process, 0 for success, other values for errors.
+    string
+        Return message of the simulation
+    dict
+        Timing of the simulation with keys 'start', 'end', 'wall' and 'usage' (resource usage of the simulation process, see get_resource_usage, None if it was not run)
+    """
+    start = time.time()
+    t0 = time.perf_counter()
+    if threadsafe:
+        result, message = run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False, verbose = verbose, **kwargs)
+    else:
+        result, message = run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose = verbose, **kwargs)
+    wall = time.perf_counter() - t0
+
+    return result, message, {'start': start, 'end': start + wall, 'wall': wall, 'usage': get_last_resource_usage()}
+
+def run_simulation_GNU_parallel(sim_type, cmd_pars_list, session_path, max_jobs = get_default_max_jobs(),verbose=False, **kwargs):
     """Run the SIMsalabim simulation executable with the chosen device parameters.  
         The simulation is run in parallel using the GNU Parallel program. (https://www.gnu.org/software/parallel/).
         If this command is used please cite:
@@ -133,180 +682,498 @@ def run_simulation_GNU_parallel(sim_type, cmd_pars_list, session_path, max_jobs
     ----------
     sim_type : string
         Which type of simulation to run: simss or zimt
-    cmd_pars_list : List
+    cmd_pars_list : List or iterable
         List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
         Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+        It can also be a lazy iterable, the command lines are then streamed to GNU parallel while it runs, see feed_GNU_parallel. 
+        With a persistent joblog, it is turned into a list, as the command file of the whole batch is needed to resume it.
     session_path : string
         File path of the simss or zimt executable 
     max_jobs : int
-        Maximum number of parallel jobs to run. Default is the number of CPU cores - 1
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs)
+    **kwargs : dict
+        Additional keyword arguments:
+        timeout : float, wall-clock time limit in s of each simulation (parallel --timeout), by default None
+        cpu_time_limit : int, CPU time limit in s of each simulation (ulimit -t), by default None
+        memory_limit : int, limit of the address space in bytes of each simulation (ulimit -v), by default None
+        niceness : int, niceness of the simulations (parallel --nice), by default None
+        joblog : string, path of a persistent joblog. The joblog and the command file (joblog + '.cmd') are kept, 
+            so an interrupted batch can be resumed by running it again with the same joblog, by default None (temporary joblog)
+        resume : bool, only run the jobs that are not in the joblog yet (parallel --resume), by default True
+        resume_failed : bool, also run the jobs again that failed according to the joblog (parallel --resume-failed), by default False
+        progress_callback : function, called as progress_callback(idx, returncode, n_done, n_total) when a job finishes, idx is the index in cmd_pars_list, by default None
+        runtime_history : string, runtime history file to add the JobRuntime from the joblog and the features of each simulation to, see record_simulation_runtime, by default None
+        poll_interval : float, interval in s at which the joblog is read during the run, by default 0.5
+        lookahead : int, maximum number of simulations that are passed to GNU parallel and did not finish yet when the command lines are streamed, by default 1000
+        hooks : dict, functions called when a simulation is submitted, finished or failed, see call_hook. The start of a simulation is not known with GNU parallel
+        fail_fast, fail_fast_codes : cancel the batch after the first simulation(s) failed with an input error, see apply_fail_fast
+        cancel_token : CancellationToken, token to cancel the batch. GNU parallel is stopped at the next poll_interval and the simulations that did not finish return CANCELLED_ERROR_CODE
 
     Returns
     -------
     CompletedProcess
         Output object of with returncode and console output of the simulation
-    List
-        Return list of messages for each simulation
-    List
-        Return list of return codes for each simulation
+    List or None
+        Return list of messages for each simulation, None for a lazy cmd_pars_list
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. It behaves like the list of return codes, only the wall time of the resource usage is known
     """
-    # Construct the command to run the executable
-    cmd_line_list = []
-    for cmd_pars in cmd_pars_list:
-        cmd_line = construct_cmd(sim_type, cmd_pars)
-        cmd_line_list.append(cmd_line)
-    
-   
-    # Construct the file and command to run the GNU parallel
-    uuid_str = str(uuid.uuid4())
-    filename = 'Str4Parallel_'+uuid_str+'.txt'
-    log_file = os.path.join(session_path,'logjob_'+uuid_str+ '.dat')
-
-    with open(os.path.join(session_path,filename),'w') as tempfilepar:
-        for cmd_line in cmd_line_list:
-            tempfilepar.write(cmd_line+'\n')
+    cancel_token = apply_fail_fast(kwargs)
+    timeout = kwargs.get('timeout', None)
+    cpu_time_limit = kwargs.get('cpu_time_limit', None)
+    memory_limit = kwargs.get('memory_limit', None)
+    niceness = kwargs.get('niceness', None)
+    joblog = kwargs.get('joblog', None)
+    resume = kwargs.get('resume', True)
+    resume_failed = kwargs.get('resume_failed', False)
+    progress_callback = kwargs.get('progress_callback', None)
+    poll_interval = kwargs.get('poll_interval', 0.5)
+    lookahead = kwargs.get('lookahead', 1000)
+    runtime_history = kwargs.get('runtime_history', None)
+    hooks = kwargs.get('hooks', None)
+
+    # Resource limits are set with ulimit in the shell that GNU parallel starts for each simulation
+    limits_prefix = get_ulimit_cmd(cpu_time_limit, memory_limit)
+
+    lazy = is_lazy_cmd_pars(cmd_pars_list)
+    if lazy and joblog is not None:
+        # The command file of the whole batch is needed to resume it
+        cmd_pars_list = list(cmd_pars_list)
+        lazy = False
 
-    cmd_parallel = 'parallel --joblog '+ log_file +' --jobs '+str(int(max_jobs))+' -a '+os.path.join(session_path,filename)
-    
-    result = run([cmd_parallel], cwd=session_path,stdout=PIPE, check=False, shell=True)
-    msg_list,return_code_list = [],[]
-
-    # if result.returncode != 0:
-    log = pd.read_csv(log_file, sep='\t',usecols=['Exitval'],on_bad_lines='skip')
-
-    # check if all jobs have been completed successfully, i.e. all exitvals are 0, 95 or 3
-    if not all(val in [0, 95, 3] for val in log['Exitval']):
-        for idx, val in enumerate(log['Exitval']):
-            message = ''
-            if val != 0 and val != 95 and val != 3:
-                if val == 91:
-                    # look for the logfile to get more information about the error
-                    for c in cmd_pars_list[idx]:
-                        if c['par'] == 'logFile':
-                            logFile = c['val']
-                            break
-                    if os.path.isfile(os.path.join(session_path,logFile)):
-                        # find line with 'Program will be terminated.' and store the next lines as the error message
-                        startMessage = False
-                        with open(os.path.join(session_path,logFile),'r') as f:
-                            for line_console in f:
-                                if startMessage is True:
-                                    # The actual error message. Since the error message can be multi-line, append each line.
-                                    message = message + line_console + '\n'
-                                if 'Program will be terminated.' in line_console:
-                                    # Last 'regular' line of the console output. The next line is from the error message.
-                                    startMessage = True
-                    if message == '':
-                        message = 'Simulation raised an error with Errorcode: ' + str(val) + '\n\n' + parallel_error_message(val)
-                elif val == 217:
-                    print(cmd_line_list[idx])
-                elif val >= 90:
-                    # Show the message as an error on the screen. Do not continue to the simulation results page.
-                    msg_list.append('Simulation raised an error with Errorcode: ' + str(val) + '\n\n' + parallel_error_message(val))
-                
-                else:
-                    msg_list.append(parallel_error_message(val))
+    # Construct the file and command to run the GNU parallel
+    if joblog is None:
+        # The command lines are streamed to the stdin of GNU parallel while it runs, see feed_GNU_parallel
+        cmd_file = None
+        log_file = os.path.join(session_path,'logjob_'+str(uuid.uuid4())+ '.dat')
+        resume, resume_failed = False, False
+    else:
+        log_file = os.path.abspath(joblog)
+        cmd_file = log_file + '.cmd'
+        # Construct the command to run the executable
+        cmd_content = ''.join(limits_prefix + construct_cmd(sim_type, cmd_pars)+'\n' for cmd_pars in cmd_pars_list)
+
+    resuming = (resume or resume_failed) and os.path.isfile(log_file)
+    if resuming:
+        # The Seq column of the joblog refers to the lines of the command file, so it must be the same batch
+        if os.path.isfile(cmd_file):
+            with open(cmd_file) as fp:
+                if fp.read() != cmd_content:
+                    raise ValueError('The joblog ' + log_file + ' belongs to a different batch of simulations, use another joblog or set resume = False.')
+    if cmd_file is not None:
+        with open(cmd_file,'w') as tempfilepar:
+            tempfilepar.write(cmd_content)
+
+    cmd_parallel = 'parallel --joblog '+ shlex.quote(log_file) +' --jobs '+str(int(max_jobs))
+    if cmd_file is not None:
+        cmd_parallel += ' -a '+shlex.quote(cmd_file)
+    if timeout is not None:
+        cmd_parallel += ' --timeout ' + str(timeout)
+    if niceness is not None:
+        cmd_parallel += ' --nice ' + str(int(niceness))
+    if resuming:
+        cmd_parallel += ' --resume-failed' if resume_failed else ' --resume'
+
+    # Return code of each job by index in cmd_pars_list, the joblog is written in completion order
+    n_total = None if lazy else len(cmd_pars_list)
+    return_codes = {}
+    usage = {} # Only the wall time of each job is in the joblog
+    messages = {} # Messages of the failed jobs of a lazy cmd_pars_list, as the cmd_pars are not kept
+    log_offset = 0
+    if resuming:
+        # Jobs finished in a previous run of this batch
+        entries, log_offset = read_GNU_parallel_joblog(log_file)
+        for seq, exitval, signal_number, runtime in entries:
+            return_codes[seq-1] = get_GNU_parallel_return_code(exitval, signal_number, timeout, cpu_time_limit)
+        if verbose:
+            print('Resuming batch, ' + str(len(return_codes)) + '/' + str(n_total) + ' simulations were already run.')
+
+    # Run GNU parallel and read the joblog while it runs to report the finished jobs
+    # With a cancel_token, GNU parallel runs in its own process group so it can be stopped together with the simulations
+    process = Popen(cmd_parallel, cwd=session_path, stdin=PIPE if cmd_file is None else None, stdout=DEVNULL, shell=True, text=True, start_new_session = cancel_token is not None)
+    if cmd_file is None:
+        feed = {'slots': threading.Semaphore(max(1, int(lookahead))), 'stop': threading.Event(), 'pending': {}, 'n_fed': 0, 'error': None}
+        feeder = Thread(target=feed_GNU_parallel, args=(process.stdin, sim_type, cmd_pars_list, feed, limits_prefix, hooks, n_total), daemon=True)
+        feeder.start()
+    elif hooks:
+        for idx in range(n_total):
+            if idx not in return_codes:
+                call_hook(hooks, 'submit', idx, n_total = n_total)
+    finished = False
+    stopped = False
+    while not finished:
+        try:
+            process.wait(timeout = poll_interval)
+            finished = True
+        except TimeoutExpired:
+            pass
+        if cancel_token is not None and cancel_token.cancelled and not stopped and not finished:
+            stop_GNU_parallel(process)
+            stopped = True
+            finished = True
+        if not os.path.isfile(log_file):
+            continue
+        entries, log_offset = read_GNU_parallel_joblog(log_file, log_offset)
+        for seq, exitval, signal_number, runtime in entries:
+            val = get_GNU_parallel_return_code(exitval, signal_number, timeout, cpu_time_limit)
+            if stopped and (signal_number != 0 or exitval in [128 + signal.SIGTERM, 128 + signal.SIGKILL]):
+                # Killed by stop_GNU_parallel
+                val = CANCELLED_ERROR_CODE
+            if cmd_file is None:
+                # Release the slot of the finished job, so the next command line can be streamed
+                cmd_pars = feed['pending'].pop(seq-1)
+                feed['slots'].release()
             else:
-                if val == 95:
-                    # In case of errorcode 95, failures during the simulations were encountered but the simulation did not halt. Show 'error' messages on the UI.
-                    msg_list.append('Simulation completed but raised errorcode: ' + str(val) + '\n\n' + 'The simulation finished but at least 1 point did not converge.')
-                elif val == 3:
-                    # Special case, should not occur in the web version.
-                    # When the program exits as a success but no simulation has been run, e.g. in the case of the autotidy functionality. 
-                    msg_list.append('Action completed')
-                else:
-                    # Simulation completed as expected.
-                    msg_list.append('Simulation completed.')
-
-    return_code_list = log['Exitval'].tolist()  
-
-    # remove the temporary files
-    os.remove(os.path.join(session_path,filename))
-    os.remove(log_file)
-
-    return result, msg_list, return_code_list
-
-def run_simulation_multithreaded_windows(sim_type,cmd_pars_list,session_path,max_jobs=max(1,os.cpu_count()-1),verbose=False):
-    """Runs simulations in parallel on max_jobs number of threads.  
-    This procedure should work on Windows and Linux but it is not as efficient as run_parallel_simu on Linux.
-    Yet, it is the only way to run simulations in parallel on Windows in a thread safe way and making sure that two thread do not try to write to the same file at the same time.
-    This is achieved by running the simulation in a temporary folder with a copy of all the necessary input files and then moving the output files to the original folder.
+                cmd_pars = cmd_pars_list[seq-1]
+            return_codes[seq-1] = val
+            usage[seq-1] = {'wall': runtime}
+            if lazy and val not in SUCCESS_CODES:
+                messages[seq-1] = get_parallel_results([val], [cmd_pars], session_path)[1][0]
+            if runtime_history is not None:
+                record_simulation_runtime(runtime_history, sim_type, cmd_pars, session_path, val, runtime)
+            if progress_callback is not None:
+                progress_callback(seq-1, val, len(return_codes), n_total)
+            call_finish_hooks(hooks, seq-1, val, runtime, n_done = len(return_codes), n_total = n_total)
+        if verbose and len(entries) > 0:
+            print(str(len(return_codes)) + '/' + str(n_total if n_total is not None else feed['n_fed']) + ' simulations finished.')
+    result = subprocess.CompletedProcess(cmd_parallel, process.returncode)
+    if cmd_file is None:
+        feed['stop'].set()
+        feeder.join()
+        if feed['error'] is not None:
+            raise feed['error']
+        if n_total is None:
+            # The simulations that were not taken from a lazy cmd_pars_list when the batch was cancelled are not part of it
+            n_total = feed['n_fed']
+    usage_list = [usage.get(idx) for idx in range(n_total)]
+    resource_usage_local.batch = summarize_resource_usage(usage_list)
+
+    missing = [idx for idx in range(n_total) if idx not in return_codes]
+    if len(missing) > 0 and not stopped:
+        print('Warning: ' + str(len(missing)) + ' simulations did not run, run the batch again with the same joblog to resume it.')
+    return_code_list = [return_codes.get(idx, CANCELLED_ERROR_CODE if stopped else -1) for idx in range(n_total)]
+    # remove the temporary joblog, a persistent joblog is kept to resume the batch
+    if joblog is None and os.path.isfile(log_file):
+        os.remove(log_file)
+
+    if lazy:
+        # The jobs that did not finish have no message yet
+        msg_list = None
+        message_list = {idx: messages.get(idx) or parallel_error_message(val) for idx, val in enumerate(return_code_list) if val not in SUCCESS_CODES}
+    else:
+        _, msg_list = get_parallel_results(return_code_list, cmd_pars_list, session_path)
+        message_list = msg_list
+    batch = get_batch_result(sim_type, None if lazy else cmd_pars_list, session_path, return_code_list, message_list, usage_list)
 
+    return result, msg_list, batch
+
+def feed_GNU_parallel(stdin, sim_type, cmd_pars_list, feed, limits_prefix = '', hooks = None, n_total = None):
+    """Write the command lines of the simulations to the stdin of GNU parallel while it runs, so they do not have to be written to a command file first 
+    and cmd_pars_list can be a lazy iterable that is never held in memory as a whole. 
+    A simulation is only taken from cmd_pars_list when one of the lookahead slots is free, i.e. when fewer than lookahead simulations were passed to GNU parallel and did not finish yet (backpressure). 
+    run_simulation_GNU_parallel releases a slot for each job in the joblog. Runs in its own thread, stdin is closed when all simulations are written or feeding is stopped.
 
     Parameters
     ----------
+    stdin : file
+        stdin of the GNU parallel process
     sim_type : string
         Which type of simulation to run: simss or zimt
-    cmd_pars_list : List
-        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
-        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
-    session_path : string
-        File path of the simss or zimt executable 
-    max_jobs : int
-        Maximum number of parallel jobs to run. Default is the number of CPU cores - 1
-    verbose : bool
-        If True, print the output of the simulation to the console
-    
+    cmd_pars_list : List or iterable
+        List of list with parameters to add to the simss/zimt cmd line, or a lazy iterable of them
+    feed : dict
+        State shared with run_simulation_GNU_parallel, with the keys slots (Semaphore with lookahead slots), stop (Event to stop feeding), 
+        pending (cmd_pars of the simulations that did not finish yet by index), n_fed (number of simulations written) and error (exception raised while reading cmd_pars_list)
+    limits_prefix : str, optional
+        ulimit commands to put before each command line, by default ''
+    hooks : dict, optional
+        Function for each event, the submit hook is called for each simulation that is written, see call_hook, by default None
+    n_total : int, optional
+        Number of simulations if known, passed to the hooks, by default None
+    """
+    try:
+        for idx, cmd_pars in enumerate(cmd_pars_list):
+            while not feed['slots'].acquire(timeout = 0.1):
+                if feed['stop'].is_set():
+                    return
+            if feed['stop'].is_set():
+                return
+            feed['pending'][idx] = cmd_pars
+            feed['n_fed'] = idx + 1
+            call_hook(hooks, 'submit', idx, n_total = n_total)
+            stdin.write(limits_prefix + construct_cmd(sim_type, cmd_pars) + '\n')
+            stdin.flush()
+    except BrokenPipeError:
+        # GNU parallel exited or was stopped
+        pass
+    except Exception as e:
+        feed['error'] = e
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+def stop_GNU_parallel(process, grace_time = 2):
+    """Stop GNU parallel and the simulations it runs, e.g. when the batch is cancelled. 
+    GNU parallel stops starting new jobs after the first SIGTERM and kills its running jobs after the second one. 
+    The signals are sent to the process group of GNU parallel, which is killed after grace_time s if it did not exit.
+
+    Parameters
+    ----------
+    process : Popen
+        GNU parallel process, started in its own session/process group
+    grace_time : float, optional
+        Time in s to wait for GNU parallel to exit before it is killed, by default 2
+    """
+    for _ in range(2):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout = 0.1)
+            return
+        except TimeoutExpired:
+            pass
+    kill_process_group(process, grace_time)
+
+def read_GNU_parallel_joblog(log_file, offset = 0):
+    """Read the complete lines of a GNU parallel joblog, starting at offset. Used to follow the joblog while GNU parallel is running.
+
+    Parameters
+    ----------
+    log_file : string
+        Path of the joblog
+    offset : int, optional
+        Byte offset in the joblog to start reading from, by default 0
+
     Returns
     -------
     List
-        List of CompletedProcess objects with returncode and console output of the simulation
+        List of (Seq, Exitval, Signal, JobRuntime) for each finished job, Seq starts at 1 and is the line number in the command file
+    int
+        Byte offset after the last complete line, to continue reading from
+    """
+    with open(log_file, 'rb') as fp:
+        fp.seek(offset)
+        data = fp.read()
+    # Only use complete lines, the last line might still be written
+    end = data.rfind(b'\n') + 1
+    entries = []
+    for line in data[:end].decode('utf-8', errors='replace').splitlines():
+        fields = line.split('\t', 8)
+        if len(fields) < 8 or not fields[0].strip().isdigit():
+            # header or corrupted line
+            continue
+        entries.append((int(fields[0]), int(float(fields[6])), int(float(fields[7])), float(fields[3])))
+    return entries, offset + end
+
+def get_hooked_tasks(target, tasks, hooks, n_total, keyed = False):
+    """Wrap the target and tasks of a worker pool so that each simulation is reported to the hooks when it is submitted, started and finished, see call_hook.
+    Without hooks, target and tasks are returned unchanged, so the hooks cost nothing when they are not used.
+
+    Parameters
+    ----------
+    target : callable
+        Function that runs a simulation, its return value must start with the return code
+    tasks : iterable
+        Tasks of the worker pool: tuples with the positional arguments for target (run_in_worker_pool), or (key, args) tuples with the index as key if keyed (iter_worker_pool)
+    hooks : dict or None
+        Function for each event, see call_hook
+    n_total : int
+        Number of simulations in the batch
+    keyed : bool, optional
+        True for the (key, args) tasks of iter_worker_pool, by default False
+
+    Returns
+    -------
+    callable
+        Target of the worker pool
+    iterable
+        Tasks of the worker pool, the submit hook is called when a task is taken by the pool
+    """
+    if not hooks:
+        return target, tasks
+    progress = {'n_done': 0, 'n_total': n_total, 'lock': threading.Lock()}
+
+    def hooked_tasks():
+        for idx, task in (tasks if keyed else enumerate(tasks)):
+            call_hook(hooks, 'submit', idx, n_total = n_total)
+            if keyed:
+                yield idx, (idx,) + tuple(task)
+            else:
+                yield (idx,) + tuple(task)
+
+    return partial(run_hooked_job, hooks, progress, target), hooked_tasks()
+
+def run_in_worker_pool(target, tasks, max_jobs = get_default_max_jobs()):
+    """Run target(*task) for each task on a fixed-size pool of max_jobs worker threads.  
+    Only a bounded number of tasks is submitted ahead of the ones that are running, so the number of threads and pending tasks does not grow with the number of tasks.
 
+    Parameters
+    ----------
+    target : callable
+        Function to run for each task
+    tasks : iterable
+        Iterable of tuples with the positional arguments for target
+    max_jobs : int or ConcurrencyAutotuner
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs).
+        With a ConcurrencyAutotuner, the number of parallel jobs is adjusted while running, see iter_worker_pool
+
+    Returns
+    -------
+    List
+        List with the return values of target, in the same order as tasks
     """    
-    
-    lock = threading.Lock()    # Create a lock   
-    semaphore = threading.Semaphore(max_jobs)  # Create a semaphore
-
-    # Create tmp folder
-    rnd_ID = str(uuid.uuid4())
-    tmp_folder = os.path.join(session_path, 'tmp'+rnd_ID) # Generate a unique ID for the temporary folder to make sure there are no conflicts with other processes
-    if os.path.isdir(tmp_folder):
-        shutil.rmtree(tmp_folder)
-        os.mkdir(tmp_folder)
-    else:
-        os.mkdir(tmp_folder)
+    return list(iter_in_worker_pool(target, tasks, max_jobs))
 
-    tmp_folder_lst = [tmp_folder] * len(cmd_pars_list)
+def iter_in_worker_pool(target, tasks, max_jobs = get_default_max_jobs()):
+    """Run target(*task) for each task on a fixed-size pool of max_jobs worker threads and yield the return values in the same order as tasks, see run_in_worker_pool.  
+    A task is only taken from tasks when fewer than 2 * max_jobs tasks are pending (backpressure), so tasks can be a lazy iterable of any length.
 
-    # Create a queue to communicate with the worker threads
-    q = queue.Queue()
+    Parameters
+    ----------
+    target : callable
+        Function to run for each task
+    tasks : iterable
+        Iterable of tuples with the positional arguments for target
+    max_jobs : int or ConcurrencyAutotuner
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs).
+        With a ConcurrencyAutotuner, the number of parallel jobs is adjusted while running, see iter_worker_pool
+
+    Yields
+    ------
+    object
+        Return value of target, in the same order as tasks
+    """
+    if isinstance(max_jobs, ConcurrencyAutotuner):
+        # Hold the results that finished before the ones that were started earlier
+        results = {}
+        next_idx = 0
+        for idx, result in iter_worker_pool(target, enumerate(tasks), max_jobs):
+            results[idx] = result
+            while next_idx in results:
+                yield results.pop(next_idx)
+                next_idx += 1
+        return
+
+    max_jobs = max(1, int(max_jobs))
+    max_pending = 2 * max_jobs # keep the workers busy while the oldest task is being collected
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        for task in tasks:
+            pending.append(executor.submit(target, *task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def run_batch_in_worker_pool(target, jobs, task_args, hooks = None, max_jobs = get_default_max_jobs(), n_total = None):
+    """Run a batch of simulations on a fixed-size pool of worker threads and collect the results while they finish, see iter_in_worker_pool. 
+    Used by the multithreaded runners and run_simulation_batch. jobs is only read once, so it can be a lazy iterable that is never held in memory as a whole.
 
-    # Start worker threads
-    threads = []
-    for i in range(len(cmd_pars_list)):
-        t = CustomThread(target=partial(worker_windows,q=q,lock=lock,tmp_folder=tmp_folder_lst[i],semaphore=semaphore,verbose=verbose))
-        t.start()
-        threads.append(t)
+    Parameters
+    ----------
+    target : callable
+        Function that runs a simulation as target(sim_type, cmd_pars, session_path, *task_args) and returns a SimulationResult, e.g. worker_linux
+    jobs : iterable
+        Iterable of (sim_type, cmd_pars, session_path) tuples, one for each simulation
+    task_args : tuple
+        Additional positional arguments for target
+    hooks : dict, optional
+        Function for each event, see call_hook, by default None
+    max_jobs : int or ConcurrencyAutotuner
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs)
+    n_total : int, optional
+        Number of simulations if known, passed to the hooks, by default None
 
-    # Add tasks to the queue
-    for code_name, cmd_pars, path in zip([sim_type] * len(cmd_pars_list), cmd_pars_list, tmp_folder_lst):
-        q.put((code_name, cmd_pars, path, session_path))
+    Returns
+    -------
+    BatchResult
+        Result of each simulation, in the same order as jobs. The message of a failed simulation is its own message or else the one of get_parallel_results.
+        The jobs are not kept, set sim_type, cmd_pars_list and session_path of the BatchResult for the output files, see get_worker_pool_results
+    """
+    queued = deque() # jobs that were taken by the pool and did not return yet, in order
+
+    def get_tasks():
+        for job in jobs:
+            queued.append(job)
+            yield tuple(job) + tuple(task_args)
+
+    target, tasks = get_hooked_tasks(target, get_tasks(), hooks, n_total)
+    return_code_list, usage_list, start_list, rung_list, messages = [], [], [], [], {}
+    for idx, res in enumerate(iter_in_worker_pool(target, tasks, max_jobs)):
+        sim_type, cmd_pars, session_path = queued.popleft()
+        return_code_list.append(res.code)
+        usage_list.append(res.usage)
+        start_list.append(res.timing['start'] if res.timing is not None else np.nan)
+        rung_list.append(res.rung)
+        if res.code not in SUCCESS_CODES:
+            messages[idx] = res.message or get_parallel_results([res.code], [cmd_pars], session_path)[1][0]
+    resource_usage_local.batch = summarize_resource_usage(usage_list)
+
+    return BatchResult(return_code_list, messages, usage_list, start_list, rungs = rung_list)
+
+def get_worker_pool_results(batch, sim_type, cmd_pars_list, session_path):
+    """Get the overall return code and the messages of a batch run by run_batch_in_worker_pool, and add the cmd_pars to it for the output files. 
+    A lazy cmd_pars_list is not kept, see is_lazy_cmd_pars.
 
-    # Wait for all tasks to be finished
-    q.join()
-    
-    # Stop workers
-    for i in range(len(cmd_pars_list)):
-        q.put(None)
-    
-    result_list = []
-    for t in threads:
-        result_list.append(t.join())
-     
-    # # Clean up
-    shutil.rmtree(tmp_folder)
-
-    return_code_list = [res[0].returncode for res in result_list]
+    Parameters
+    ----------
+    batch : BatchResult
+        Result of the batch, see run_batch_in_worker_pool
+    sim_type : string
+        Which type of simulation was run: simss or zimt
+    cmd_pars_list : List or iterable
+        Parameters of each simulation
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    int
+        Overall return code of the batch, see get_overall_return_code
+    List or None
+        Message for each simulation, see get_parallel_results. None for a lazy cmd_pars_list, the messages of the failed simulations are in the BatchResult
+    """
+    result = get_overall_return_code(batch.codes)
+    if is_lazy_cmd_pars(cmd_pars_list):
+        return result, None
+    batch.sim_type, batch.cmd_pars_list, batch.session_path = sim_type, cmd_pars_list, session_path
+    _, message_list = get_parallel_results(batch.tolist(), cmd_pars_list, session_path)
+    return result, message_list
+
+def get_parallel_results(return_code_list, cmd_pars_list, session_path):
+    """Get the error messages for each simulation of a parallel run and the overall return code of the run.
+
+    Parameters
+    ----------
+    return_code_list : List
+        List with the return code of each simulation
+    cmd_pars_list : List
+        List of list with the parameters that were used for each simulation
+    session_path : string
+        File path of the simss or zimt executable 
+
+    Returns
+    -------
+    int
+        Overall return code. The return code of the failed simulations if they all failed with the same code, 666 if they failed with different codes, 95 or 3 if all simulations returned 0 and 95 or 0 and 3, 0 otherwise.
+    List
+        Return list of messages for each simulation
+    """    
     message_list = []
-    for res in return_code_list:
+    for res, cmd_pars in zip(return_code_list, cmd_pars_list):
         if res == 91:
             # look for the logfile to get more information about the error
-            for cmd_pars in cmd_pars_list:
-                for c in cmd_pars:
-                    if c['par'] == 'logFile':
-                        logFile = c['val']
-                        break
-            if os.path.isfile(os.path.join(session_path,logFile)):
+            logFile = None
+            for c in cmd_pars:
+                if c['par'] == 'logFile':
+                    logFile = c['val']
+                    break
+            if logFile is not None and os.path.isfile(os.path.join(session_path,logFile)):
                 # find line with 'Program will be terminated.' and store the next lines as the error message
                 startMessage = False
                 message = ''
@@ -323,480 +1190,259 @@ def run_simulation_multithreaded_windows(sim_type,cmd_pars_list,session_path,max
                 message_list.append(message)
             else:
                 message_list.append('Simulation raised an error with Errorcode: ' + str(res) + '\n\n' + parallel_error_message(res))
+        elif res == 95:
+            # In case of errorcode 95, failures during the simulations were encountered but the simulation did not halt. Show 'error' messages on the UI.
+            message_list.append('Simulation completed but raised errorcode: ' + str(res) + '\n\n' + 'The simulation finished but at least 1 point did not converge.')
+        elif res == 3:
+            # Special case, should not occur in the web version.
+            # When the program exits as a success but no simulation has been run, e.g. in the case of the autotidy functionality. 
+            message_list.append('Action completed')
+        elif res == 0:
+            # Simulation completed as expected.
+            message_list.append('Simulation completed.')
         else:
             message_list.append(parallel_error_message(res))
 
-    # message_list = [parallel_error_message(res) for res in return_code_list]
-    if not all(val in [0, 95, 3] for val in return_code_list):
-        # check if only one error code different from 0, 95 or 3
-        if len(set([val for val in return_code_list if val not in [0, 95, 3]])) == 1:
-            # if so, return that error code and the corresponding message
-            idx = return_code_list.index([val for val in return_code_list if val not in [0, 95, 3]][0])
-            result = return_code_list[idx]
-            message = message_list[idx]
-            result_list = [(result, message)]
-        else:
-            print(f"Multiple different errors occurred during the parallel simulations: {set([val for val in return_code_list if val not in [0, 95, 3]])}. Returning error code 666.")
-            result = 666
-    elif all(val in [0, 95] for val in return_code_list):
-        result = 95
-    elif all(val in [0, 3] for val in return_code_list):
-        result = 3
-    else:
-        result = 0
-    return result, message_list, return_code_list
+    result = get_overall_return_code(return_code_list)
+    return result, message_list
 
-def worker_windows(q,lock,tmp_folder,semaphore,verbose=False):
-    """Worker function that runs the simulation in a temporary folder and moves the output files to the original folder. 
+def get_batch_result(sim_type, cmd_pars_list, session_path, return_code_list, message_list = None, usage_list = None, start_list = None, rung_list = None):
+    """Make the BatchResult of a parallel run. The messages are only kept for the simulations that failed, to keep large batches small.
 
     Parameters
     ----------
-    q : queue
-        Queue to communicate with the main thread
-    lock : threading.Lock
-        Lock to prevent multiple threads from writing to the same file at the same time
-    tmp_folder : string
-        Temporary folder to run the simulation in
-    semaphore : threading.Semaphore
-        Semaphore to limit the number of parallel jobs
-    verbose : bool
-        If True, print the output of the simulation to the console
+    sim_type : string
+        Which type of simulation was run: simss or zimt
+    cmd_pars_list : List
+        List of list with the parameters that were used for each simulation
+    session_path : string
+        File path of the simss or zimt executable
+    return_code_list : List
+        Return code of each simulation
+    message_list : List or dict, optional
+        Message of each simulation, or a dict with the message by index, by default None
+    usage_list : List, optional
+        Resource usage of each simulation, see get_resource_usage, by default None
+    start_list : List, optional
+        Start time of each simulation in s since the epoch, by default None
+    rung_list : List, optional
+        Rung of the retry ladder that rescued each simulation, None if none, see RetryLadder, by default None
 
+    Returns
+    -------
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list
     """
-    while True:
-        # Get task from the queue
-        task = q.get()
-        if task is None:
-            break
-
-        # Unpack task
-        sim_type, cmd_pars, path, session_path = task
+    messages = {}
+    if isinstance(message_list, dict):
+        messages = {idx: message for idx, message in message_list.items() if return_code_list[idx] not in SUCCESS_CODES}
+    elif message_list is not None:
+        messages = {idx: message for idx, (code, message) in enumerate(zip(return_code_list, message_list)) if code not in SUCCESS_CODES}
+    return BatchResult(return_code_list, messages, usage_list, start_list, sim_type, cmd_pars_list, session_path, rung_list)
 
-        device_parameters = None
-
-        for cmd_par in cmd_pars:
-            if cmd_par['par'] == 'dev_par_file':
-                device_parameters = cmd_par['val']
-                break
-    
-        if device_parameters is None:
-            raise ValueError('Device parameters file not found in the command parameters list.')
-
-        # Acquire semaphore
-        semaphore.acquire()
-
-        # create a temporary folder for the simulation
-        ID = str(uuid.uuid4()) # Generate a unique ID for the temporary folder
-        tmp_folder = os.path.join(tmp_folder, ID)
-        if not os.path.isdir(tmp_folder):
-            os.mkdir(tmp_folder)
-
-        # Copy all necessary files to the temporary folder
-        lock.acquire()
-        # copy the executable to the temporary folder
-
-        if os.name == 'nt':
-            sim_exe_path = convert_to_long_path(os.path.join(session_path, sim_type + '.exe'))
-            shutil.copy(sim_exe_path, tmp_folder)
-        else:
-            shutil.copy(os.path.join(session_path, sim_type), tmp_folder)
+def get_GNU_parallel_return_code(exitval, signal_number, timeout = None, cpu_time_limit = None):
+    """Get the return code of a simulation from the Exitval and Signal columns of the GNU parallel joblog. 
+    Simulations killed by the watchdog get TIMEOUT_ERROR_CODE or CPU_LIMIT_ERROR_CODE, as with the other runners.
 
-        dev_par, layers = load_device_parameters(session_path, device_parameters, run_mode = False)
-
-        # check for new layers in the cmd_pars
-        newlayers = []
-        idx_layers = []
-        for cmd_par in cmd_pars:
-            if cmd_par['par'].startswith('l') and cmd_par['par'][1:].isdigit():
-                newlayers.append(cmd_par)
-                idx_layers.append(int(cmd_par['par'][1:]))
-        
-        # update layer files with cmd_pars
-        if len(newlayers) > 0:
-            for layer in layers:
-                for cmd_par in cmd_pars:
-                    if cmd_par['par'] == layer[1]:
-                        layer[2] = cmd_par['val']
-                        break
-        
-        # check if we need to add new layers
-        newlayers = [x for _, x in sorted(zip(idx_layers, newlayers))]
-        idx_layers = sorted(idx_layers)
-        if len(idx_layers) > 0:
-            if max(idx_layers) > len(layers)-1: # means we need to add new layers
-                # check that all the layers between len(layers)-& and max(idx_layers) are in the idx_layers list
-                for i in range(len(layers),max(idx_layers)+1):
-                    if i not in idx_layers:
-                        raise ValueError('Missing layer definition for layer '+str(i)+' in the command parameters list.')
-                # add the new layers
-                for i, layer in zip(idx_layers, newlayers):
-                    layers.append(['par','l'+str(i),layer['val']],'parameter file for layer '+str(i))
-            
-                # update dev_par layer files with cmd_pars
-                dev_par_keys = list(dev_par.keys())
-                for i, section in enumerate(dev_par[dev_par_keys[0]]):
-                    if section[0].lower() == 'layers':
-                        # update section with layers[1:]
-                        dev_par[dev_par_keys[0]][i][1:] = layers[1:]                  
-
-
-        # move all layers to the temporary folder
-        for layer in layers:
-            if os.name == 'nt':
-                layer_path = convert_to_long_path(os.path.join(session_path, layer[2]))
-                shutil.copy(layer_path, tmp_folder)
-            else:
-                shutil.copy(os.path.join(session_path, layer[2]), tmp_folder)
-
-
-        res = store_file_names(dev_par, sim_type, device_parameters, layers, run_mode = False)
-        layer_files = res[0]
-        optical_files = res[1]
-        # make absolute paths
-        layer_files = [os.path.abspath(os.path.join(session_path, f)) for f in layer_files]
-        optical_files = [os.path.abspath(os.path.join(session_path, f)) for f in optical_files]
-        optical_file_basenames = [os.path.basename(f) for f in optical_files]   
-        traps_int_files = res[2]
-        traps_bulk_files = res[3]
-        traps_int_files = [os.path.abspath(os.path.join(session_path, f)) for f in traps_int_files]
-        traps_bulk_files = [os.path.abspath(os.path.join(session_path, f)) for f in traps_bulk_files]
-        traps_int_file_basenames = [os.path.basename(f) for f in traps_int_files]
-        traps_bulk_file_basenames = [os.path.basename(f) for f in traps_bulk_files]
-
-        ExpJV_file = None
-        tVGFile = None
-        tJFile = None
-        JVFile = None
-        scParsFile = None
-        if sim_type == 'simss':
-            if res[4].lower() == 'None'.lower():
-                ExpJV_file = None
-            else:
-                ExpJV_file = res[4]
-            JVFile = res[7]
-            scParsFile = res[8]
-        else:
-            tVGFile = res[4]
-            tJFile = res[7]
-
-        varFile = res[5]
-        logFile = res[6]
-
-
-        # Copy the files to the temporary folder
-        for file in layer_files + optical_files + traps_int_files + traps_bulk_files + [ExpJV_file] + [tVGFile]:
-            if file is not None and os.path.isfile(file):
-                if os.name == 'nt':
-                    file_path = convert_to_long_path(file)
-                    shutil.copy(file_path, tmp_folder)
-                else:
-                    shutil.copy(file, tmp_folder)
-
-            # update temp folder files with basename
-            if file in layer_files:
-                make_basename_input_files(os.path.join(tmp_folder, os.path.basename(file)))       
-
-        # move files from cmd_pars to the temporary folder and overwrite if necessary
-        input_files = get_inputFile_from_cmd_pars(sim_type, cmd_pars)
-        input_files = [os.path.abspath(os.path.join(session_path, f['val'])) for f in input_files]
-        input_files_basenames = [os.path.basename(f) for f in input_files]
-        for file in input_files:
-            # if file already in the tmp_folder, remove it and copy the new one
-            if os.path.isfile(os.path.join(tmp_folder, os.path.basename(file))):
-                os.remove(os.path.join(tmp_folder, os.path.basename(file)))
-            shutil.copy(os.path.join(session_path, file), tmp_folder)
-
-        # set basename for device parameters
-        make_basename_input_files(os.path.join(tmp_folder, os.path.basename(device_parameters)))
-
-
-        # check the input files for the new layers
-        # for layer in newlayers:
-        #     input_files2 = get_inputFile_from_layer(layer,session_path)
-        #     for file in input_files2:
-        #         # if file does not exist in the tmp_folder, copy it. Otherwise, copy it if it is not in the input_files list
-        #         if not os.path.isfile(os.path.join(tmp_folder, os.path.basename(file))):
-        #             shutil.copy(os.path.join(session_path, file), tmp_folder)
-        #         else:
-        #             if not os.path.basename(file) in input_files_basenames:
-        #                 shutil.copy(os.path.join(session_path, file), tmp_folder)
-
-        lock.release()
+    Parameters
+    ----------
+    exitval : int
+        Exit value of the job
+    signal_number : int
+        Signal that killed the job, 0 if it was not killed
+    timeout : float, optional
+        Wall-clock time limit used for the run, by default None
+    cpu_time_limit : int, optional
+        CPU time limit used for the run, by default None
 
-        # Construct the command to run the executable
-        cmd_pars = make_basename_file_cmd_pars(cmd_pars)
-        cmd_line = construct_cmd(sim_type, cmd_pars)
-
-        # Run the simulation
-        result = run(cmd_line, cwd=tmp_folder, stdout=PIPE, check=False, shell=True)
-
-        # Check the results of the process using the returncodes and console output
-        if result.returncode != 0 and result.returncode != 95 and result.returncode != 3:
-            # SIMsalabim raised an error, stop the program and return the error message on the UI.
-            startMessage = False
-            message = ''
-            result_decode = result.stdout.decode('utf-8')
-
-            if result.returncode >= 100:
-                # A fatal (numerical) error occurred. Return errorcode and a standard error message.
-                message = fatal_error_message(result.returncode)
-            else:
-                # Simsalabim raised an error. Read the console output for the details / error messaging. 
-                # All linetypes after 'Program will be terminated, press enter.' are considered part of the error message
-                for line_console in result_decode.split('\n'):
-                    if startMessage is True:
-                        # The actual error message. Since the error message can be multi-line, append each line.
-                        message = message + line_console + '\n'
-                    if 'Program will be terminated.' in line_console:
-                        # Last 'regular' line of the console output. The next line is from the error message.
-                        startMessage = True
-
-            # Show the message as an error on the screen. Do not continue to the simulation results page.
-            message = 'Simulation raised an error with Errorcode: ' + str(result.returncode) + '\n\n' + message
-        else:
-            # SIMsalabim simulation succeeded
-            if result.returncode == 95:
-                # In case of errorcode 95, failures during the simulations were encountered but the simulation did not halt. Show 'error' messages on the UI.
-                startMessage = False
-                message = ''
-                result_decode = result.stdout.decode('utf-8')
-                for line_console in result_decode.split('\n'):
-                    if startMessage is True:
-                        # The actual error message. Since the error message can be multi-line, append each line.
-                        message = message + line_console + '\n'
-                    if 'Program will be terminated.' in line_console:
-                        # Last 'regular' line of the console output. The next line is from the error message.
-                        startMessage = True
-
-                # Show the message as a success on the screen
-                message = 'Simulation completed but raised errorcode: ' + str(result.returncode) + '\n\n' + 'The simulation finished but at least 1 point did not converge. \n\n' + message
-            elif result.returncode == 3:
-                # Special case, should not occur in the web version.
-                # When the program exits as a success but no simulation has been run, e.g. in the case of the autotidy functionality. 
-                message = 'Action completed'
-            else:
-                # Simulation completed as expected.
-                message = 'Simulation complete. Output can be found in the Simulation results.'
-
-        # Move output files to the original folder
-        lock.acquire()
-        if sim_type.lower() == 'simss':
-            if os.path.isfile(os.path.join(tmp_folder, varFile)):
-                varFile_path = convert_to_long_path(os.path.join(tmp_folder, varFile))
-                newFile_path = convert_to_long_path(os.path.join(session_path, varFile))
-                shutil.move(varFile_path, newFile_path)
-            if os.path.isfile(os.path.join(tmp_folder, logFile)):
-                logFile_path = convert_to_long_path(os.path.join(tmp_folder, logFile))
-                newLog_path = convert_to_long_path(os.path.join(session_path, logFile))
-                shutil.move(logFile_path, newLog_path)
-            if os.path.isfile(os.path.join(tmp_folder, JVFile)):
-                JVFile_path = convert_to_long_path(os.path.join(tmp_folder, JVFile))
-                shutil.move(JVFile_path, session_path)
-            if os.path.isfile(os.path.join(tmp_folder, scParsFile)):
-                scParsFile_path = convert_to_long_path(os.path.join(tmp_folder, scParsFile))
-                newScPars_path = convert_to_long_path(os.path.join(session_path, scParsFile))
-                shutil.move(scParsFile_path, newScPars_path)
-        elif sim_type.lower() == 'zimt':
-            if os.path.isfile(os.path.join(tmp_folder, varFile)):
-                varFile_path = convert_to_long_path(os.path.join(tmp_folder, varFile))
-                newFile_path = convert_to_long_path(os.path.join(session_path, varFile))
-                shutil.move(varFile_path, newFile_path)
-            if os.path.isfile(os.path.join(tmp_folder, logFile)):
-                logFile_path = convert_to_long_path(os.path.join(tmp_folder, logFile))
-                newLog_path = convert_to_long_path(os.path.join(session_path, logFile))
-                shutil.move(logFile_path, newLog_path)
-            if os.path.isfile(os.path.join(tmp_folder, tVGFile)):
-                tVGFile_path = convert_to_long_path(os.path.join(tmp_folder, tVGFile))
-                newTVG_path = convert_to_long_path(os.path.join(session_path, tVGFile))
-                shutil.move(tVGFile_path, newTVG_path)
-            if os.path.isfile(os.path.join(tmp_folder, tJFile)):
-                tJFile_path = convert_to_long_path(os.path.join(tmp_folder, tJFile))
-                newTJ_path = convert_to_long_path(os.path.join(session_path, tJFile))
-                shutil.move(tJFile_path, newTJ_path)
-        lock.release()
-
-        # Release semaphore
-        semaphore.release()
-
-        # Print output if verbose
-        if verbose:
-            print(result.stdout)
+    Returns
+    -------
+    int
+        Return code of the simulation
+    """
+    if signal_number == 0:
+        return int(exitval)
+    if cpu_time_limit is not None and signal_number == getattr(signal, 'SIGXCPU', None):
+        return CPU_LIMIT_ERROR_CODE
+    if timeout is not None:
+        # GNU parallel sends TERM (and KILL if needed) to jobs that exceed --timeout
+        return TIMEOUT_ERROR_CODE
+    return int(exitval)
+
+def run_simulation_multithreaded_windows(sim_type,cmd_pars_list,session_path,max_jobs=get_default_max_jobs(),verbose=False,**kwargs):
+    """Runs simulations in parallel on max_jobs number of threads.  
+    This procedure should work on Windows and Linux but it is not as efficient as run_parallel_simu on Linux.
+    Yet, it is the only way to run simulations in parallel on Windows in a thread safe way and making sure that two thread do not try to write to the same file at the same time.
+    This is achieved by running the simulation in a temporary folder with links to all the necessary input files and then moving the output files to the original folder.
+    The temporary folders (sandboxes) are created in session_path and reused by the next simulations and batches, see get_sandbox.
+    The simulations are run by a fixed-size pool of max_jobs worker threads.
 
-        # Notify the queue that the task is done
-        q.task_done()
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List or iterable
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+        It can also be a lazy iterable, see run_batch_in_worker_pool
+    session_path : string
+        File path of the simss or zimt executable 
+    max_jobs : int
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs)
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation.
+        hooks : dict, functions called when a simulation is submitted, started, finished or failed, see call_hook
+        fail_fast, fail_fast_codes, cancel_token : cancel the simulations that did not finish yet after input errors or from another thread, see run_simulation_parallel
+        retry_ladder, retry_codes : run the simulations that failed to converge again with the rungs of a retry ladder, see run_simulation_parallel
+        run_mode : bool, build the message of each simulation from its console output, see worker_windows, by default False
     
-    return result, message
+    Returns
+    -------
+    int
+        Overall return code of the parallel run, see get_parallel_results
+    List or None
+        Return list of messages for each simulation, None for a lazy cmd_pars_list
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. It behaves like the list of return codes
 
-def worker_linux(q,lock,semaphore,verbose=False):
-    """Worker function that runs the simulation in a temporary folder and moves the output files to the original folder. 
+    """    
+    
+    apply_fail_fast(kwargs)
+    get_retry_ladder(kwargs)
+    max_jobs = get_worker_pool_size(max_jobs, sim_type, kwargs, verbose)
+    hooks = kwargs.pop('hooks', None)
+    jobs = ((sim_type, cmd_pars, session_path) for cmd_pars in cmd_pars_list)
+    n_total = None if is_lazy_cmd_pars(cmd_pars_list) else len(cmd_pars_list)
+    batch = run_batch_in_worker_pool(partial(worker_windows, **kwargs), jobs, (verbose,), hooks, max_jobs, n_total)
+    result, message_list = get_worker_pool_results(batch, sim_type, cmd_pars_list, session_path)
+    if isinstance(max_jobs, ConcurrencyAutotuner):
+        max_jobs.report()
+
+    return result, message_list, batch
+
+def worker_windows(sim_type, cmd_pars, session_path, verbose=False, run_mode=False, **kwargs):
+    """Run a single simulation in a temporary folder (sandbox) and move the output files to the original folder, see run_simulation_filesafe.
 
     Parameters
     ----------
-    q : queue
-        Queue to communicate with the main thread
-    lock : threading.Lock
-        Lock to prevent multiple threads from writing to the same file at the same time
-    semaphore : threading.Semaphore
-        Semaphore to limit the number of parallel jobs
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+    session_path : string
+        File path of the simss or zimt executable 
     verbose : bool
         If True, print the output of the simulation to the console
+    run_mode : bool
+        If True, the message of the simulation is built from its console output, see run_simulation_filesafe, by default False
+    **kwargs : dict
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation
 
+    Returns
+    -------
+    SimulationResult
+        Result of the simulation, it unpacks as (returncode, message)
     """
-    while True:
-        # Get task from the queue
-        task = q.get()
-        if task is None:
-            break
-        
-        # Unpack task
-        sim_type, cmd_pars, session_path = task
+    # Each worker thread reuses a sandbox in session_path, the input files are linked instead of copied
+    return run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = run_mode, verbose = verbose, **kwargs)
 
-        # Acquire semaphore
-        semaphore.acquire()
+def worker_linux(sim_type, cmd_pars, session_path, verbose=False, **kwargs):
+    """Run a single simulation in the session folder. 
 
-        result, message = run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose=verbose)
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+    session_path : string
+        File path of the simss or zimt executable 
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation
 
-        # Release semaphore
-        semaphore.release()
+    Returns
+    -------
+    SimulationResult
+        Result of the simulation, it unpacks as (returncode, message)
+    """
+    return run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose=verbose, **kwargs)
 
-        # Print output if verbose
-        if verbose:
-            print(result.stdout)
+def worker_batch(sim_type, cmd_pars, session_path, threadsafe = False, verbose = False, **kwargs):
+    """Run a single simulation of a mixed batch, see run_simulation_batch. 
+    In thread safe mode the simulation runs in a sandbox of the worker thread in its session folder (see run_simulation_filesafe), else in the session folder itself.
 
-        # Notify the queue that the task is done
-        q.task_done()
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
+    session_path : string
+        File path of the simss or zimt executable 
+    threadsafe : bool
+        If True, run the simulation with run_simulation_filesafe
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation
 
-        return result, message
+    Returns
+    -------
+    SimulationResult
+        Result of the simulation, it unpacks as (returncode, message)
+    """
+    if threadsafe:
+        return run_simulation_filesafe(sim_type, cmd_pars, session_path, run_mode = False, verbose = verbose, **kwargs)
+    return run_simulation(sim_type, cmd_pars, session_path, run_mode = False, verbose = verbose, **kwargs)
 
-def run_simulation_multithreaded_linux(sim_type,cmd_pars_list,session_path,max_jobs=max(1,os.cpu_count()-1),verbose=False):
+def run_simulation_multithreaded_linux(sim_type,cmd_pars_list,session_path,max_jobs=get_default_max_jobs(),verbose=False,**kwargs):
     """Runs simulations in parallel on max_jobs number of threads.  
-    This procedure should work on Windows and Linux but it is not as efficient as run_parallel_simu on Linux.
-    Yet, it is the only way to run simulations in parallel on Windows in a thread safe way and making sure that two thread do not try to write to the same file at the same time.
-    This is achieved by running the simulation in a temporary folder with a copy of all the necessary input files and then moving the output files to the original folder.
-
+    The simulations are run by a fixed-size pool of max_jobs worker threads, so the number of threads does not depend on the number of simulations.
+    Used on Linux when GNU parallel is not available or when multithreading is forced.
 
     Parameters
     ----------
     sim_type : string
         Which type of simulation to run: simss or zimt
-    cmd_pars_list : List
+    cmd_pars_list : List or iterable
         List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys. 
         Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+        It can also be a lazy iterable, see run_batch_in_worker_pool
     session_path : string
         File path of the simss or zimt executable 
     max_jobs : int
-        Maximum number of parallel jobs to run. Default is the number of CPU cores - 1
+        Maximum number of parallel jobs to run. Default is the number of usable CPUs - 1 (get_default_max_jobs)
     verbose : bool
         If True, print the output of the simulation to the console
+    **kwargs : dict
+        Additional keyword arguments, e.g. the watchdog limits timeout, cpu_time_limit, memory_limit and niceness, see execute_simulation.
+        hooks : dict, functions called when a simulation is submitted, started, finished or failed, see call_hook
+        fail_fast, fail_fast_codes, cancel_token : cancel the simulations that did not finish yet after input errors or from another thread, see run_simulation_parallel
+        retry_ladder, retry_codes : run the simulations that failed to converge again with the rungs of a retry ladder, see run_simulation_parallel
     
     Returns
     -------
-    List
-        List of CompletedProcess objects with returncode and console output of the simulation
+    int
+        Overall return code of the parallel run, see get_parallel_results
+    List or None
+        Return list of messages for each simulation, None for a lazy cmd_pars_list
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. It behaves like the list of return codes
 
     """    
- 
-    lock = threading.Lock()    # Create a lock   
-    semaphore = threading.Semaphore(max_jobs)  # Create a semaphore
-
-    # Create a queue to communicate with the worker threads
-    q = queue.Queue()
-
-    # Start worker threads
-    threads = []
-    for i in range(len(cmd_pars_list)):
-        t = CustomThread(target=partial(worker_linux,q=q,lock=lock,semaphore=semaphore,verbose=verbose))
-        t.start()
-        threads.append(t)
-
-    # Add tasks to the queue
-    for code_name, cmd_pars in zip([sim_type] * len(cmd_pars_list), cmd_pars_list):
-        q.put((code_name, cmd_pars, session_path))
-
-    # Wait for all tasks to be finished
-    q.join()
-
-    # Stop workers
-    for i in range(len(cmd_pars_list)):
-        q.put(None)
-
-    result_list = []
-    for t in threads:
-        result_list.append(t.join())
-    print(result_list)
-    return_code_list = [res[0] for res in result_list]
-    # message_list = [parallel_error_message(res) for res in return_code_list]
-    message_list = []
-    for res in return_code_list:
-        if res == 91:
-            # look for the logfile to get more information about the error
-            for cmd_pars in cmd_pars_list:
-                for c in cmd_pars:
-                    if c['par'] == 'logFile':
-                        logFile = c['val']
-                        break
-            if os.path.isfile(os.path.join(session_path,logFile)):
-                # find line with 'Program will be terminated.' and store the next lines as the error message
-                startMessage = False
-                message = ''
-                with open(os.path.join(session_path,logFile),'r') as f:
-                    for line_console in f:
-                        if startMessage is True:
-                            # The actual error message. Since the error message can be multi-line, append each line.
-                            message = message + line_console + '\n'
-                        if 'Program will be terminated.' in line_console:
-                            # Last 'regular' line of the console output. The next line is from the error message.
-                            startMessage = True
-                if message == '':
-                    message = 'Simulation raised an error with Errorcode: ' + str(res) + '\n\n' + parallel_error_message(res)
-                message_list.append(message)
-            else:
-                message_list.append('Simulation raised an error with Errorcode: ' + str(res) + '\n\n' + parallel_error_message(res))
-        else:
-            message_list.append(parallel_error_message(res))
-    if not all(val in [0, 95, 3] for val in return_code_list):
-        # check if only one error code different from 0, 95 or 3
-        if len(set([val for val in return_code_list if val not in [0, 95, 3]])) == 1:
-            # if so, return that error code and the corresponding message
-            idx = return_code_list.index([val for val in return_code_list if val not in [0, 95, 3]][0])
-            result = return_code_list[idx]
-            message = message_list[idx]
-            result_list = [(result, message)]
-        else:
-            print(f"Multiple different errors occurred during the parallel simulations: {set([val for val in return_code_list if val not in [0, 95, 3]])}. Returning error code 666.")
-            result = 666
-    elif all(val in [0, 95] for val in return_code_list):
-        result = 95
-    elif all(val in [0, 3] for val in return_code_list):
-        result = 3
-    else:
-        result = 0
-    return result, message_list, return_code_list
-    # return result_list
-
-# Custom thread class to return the result of the thread
-class CustomThread(Thread):
-    def __init__(self, group=None, target=None, name=None,
-                 args=(), kwargs={}, Verbose=None):
-        Thread.__init__(self, group, target, name, args, kwargs)
-        self._return = None
- 
-    def run(self):
-        if self._target is not None:
-            self._return = self._target(*self._args, **self._kwargs)
-             
-    def join(self, *args):
-        Thread.join(self, *args)
-        return self._return
-
-
-
-
-
-
-
-
-
-
-
-
+    apply_fail_fast(kwargs)
+    get_retry_ladder(kwargs)
+    max_jobs = get_worker_pool_size(max_jobs, sim_type, kwargs, verbose)
+    hooks = kwargs.pop('hooks', None)
+    jobs = ((sim_type, cmd_pars, session_path) for cmd_pars in cmd_pars_list)
+    n_total = None if is_lazy_cmd_pars(cmd_pars_list) else len(cmd_pars_list)
+    batch = run_batch_in_worker_pool(partial(worker_linux, **kwargs), jobs, (verbose,), hooks, max_jobs, n_total)
+    result, message_list = get_worker_pool_results(batch, sim_type, cmd_pars_list, session_path)
+    if isinstance(max_jobs, ConcurrencyAutotuner):
+        max_jobs.report()
+
+    return result, message_list, batch
@@ -0,0 +1,386 @@
+"""Structured results of SIMsalabim simulations: SimulationResult for a single simulation and the columnar BatchResult for a batch"""
+######### Package Imports #########################################################################
+
+import numpy as np
+import pandas as pd
+from pySIMsalabim.utils.device_parameters import get_output_files
+
+######### Constants ###############################################################################
+
+SUCCESS_CODES = [0, 95, 3] # Return codes of simulations that did not fail, 95: at least 1 point did not converge, 3: finished without simulating (e.g. autoTidy)
+MULTIPLE_ERRORS_CODE = 666 # Overall return code of a batch in which simulations failed with different return codes
+CANCELLED_ERROR_CODE = 130 # Return code of a simulation that was not run or was terminated because its batch was cancelled, see CancellationToken
+USAGE_COLUMNS = ['wall', 'user', 'sys', 'max_rss', 'read_bytes', 'write_bytes'] # Resource usage stored for each simulation of a BatchResult, see get_resource_usage
+BYTE_COLUMNS = ['max_rss', 'read_bytes', 'write_bytes'] # Usage columns in bytes, stored as float64 to keep them exact
+
+######### Function Definitions ####################################################################
+
+def get_overall_return_code(return_code_list, verbose = True):
+    """Get the overall return code of a batch of simulations.
+
+    Parameters
+    ----------
+    return_code_list : List or array
+        Return code of each simulation
+    verbose : bool, optional
+        If True, print the return codes when the simulations failed with different codes, by default True
+
+    Returns
+    -------
+    int
+        The return code of the failed simulations if they all failed with the same code, MULTIPLE_ERRORS_CODE (666) if they failed with different codes,
+        95 or 3 if all simulations returned 0 and 95 or 0 and 3, 0 otherwise. 
+        The simulations that were cancelled only count when no simulation failed, so a batch cancelled by fail_fast returns the error that cancelled it.
+    """
+    codes = set(int(val) for val in np.unique(np.asarray(return_code_list, dtype = int)))
+    failed_codes = codes - set(SUCCESS_CODES)
+    if len(failed_codes) > 1:
+        failed_codes.discard(CANCELLED_ERROR_CODE)
+    if len(failed_codes) == 1:
+        return failed_codes.pop()
+    elif len(failed_codes) > 1:
+        if verbose:
+            print(f"Multiple different errors occurred during the parallel simulations: {failed_codes}. Returning error code {MULTIPLE_ERRORS_CODE}.")
+        return MULTIPLE_ERRORS_CODE
+    elif 95 in codes and 3 not in codes:
+        return 95
+    elif 3 in codes and 95 not in codes:
+        return 3
+    return 0
+
+class SimulationResult:
+    """Result of a single simulation: return code, message, output files, timing and resource usage.
+    For backwards compatibility it unpacks as the (returncode, message) tuple that the runners returned before, i.e. result, message = run_simulation(...) still works.
+
+    Parameters
+    ----------
+    code : int
+        Return code of the simulation process, 0 for success, other values for errors
+    message : string, optional
+        Return message to display on the UI, by default ''
+    output_files : dict, optional
+        Paths of the output files by parameter name (e.g. 'JVFile'), see get_output_files, by default None
+    timing : dict, optional
+        Timing of the simulation with the keys 'start', 'end' (time since the epoch in s) and 'wall' (wall time in s), by default None (not run, e.g. taken from the cache)
+    usage : dict, optional
+        Resource usage of the simulation process, see get_resource_usage, by default None (not run)
+    output_source : tuple, optional
+        (sim_type, cmd_pars, session_path) to get the output files from when they are first needed if output_files is None, by default None
+    rung : int, optional
+        Rung of the retry ladder that rescued the simulation, see RetryLadder, by default None (run with its own parameters)
+    """
+    __slots__ = ('code', 'message', 'timing', 'usage', 'rung', '_output_files', '_output_source')
+
+    def __init__(self, code, message = '', output_files = None, timing = None, usage = None, output_source = None, rung = None):
+        self.code = int(code)
+        self.message = message
+        self.timing = timing
+        self.usage = usage
+        self.rung = rung
+        self._output_files = output_files
+        self._output_source = output_source
+
+    @property
+    def output_files(self):
+        if self._output_files is None and self._output_source is not None:
+            self._output_files = get_output_files(*self._output_source)
+        return self._output_files
+
+    @property
+    def succeeded(self):
+        """True if the simulation did not fail, i.e. the return code is in SUCCESS_CODES"""
+        return self.code in SUCCESS_CODES
+
+    def __iter__(self):
+        return iter((self.code, self.message))
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, idx):
+        return (self.code, self.message)[idx]
+
+    def __eq__(self, other):
+        if isinstance(other, SimulationResult):
+            return (self.code, self.message) == (other.code, other.message)
+        if isinstance(other, (list, tuple)):
+            return (self.code, self.message) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.code, self.message))
+
+    def __repr__(self):
+        wall = None if self.timing is None else round(self.timing['wall'], 3)
+        return 'SimulationResult(code={}, wall={}, message={!r})'.format(self.code, wall, self.message[:40])
+
+class BatchResult:
+    """Columnar result of a batch of simulations. The return codes, start times and resource usage of the simulations are stored in NumPy arrays,
+    messages only for the simulations that have one, and the output files are derived from the cmd_pars when asked for.
+    This keeps a batch of 100k simulations small and makes filtering cheap, e.g. batch.codes == 95 or batch.filter(codes = [95]).
+
+    For backwards compatibility it behaves like the list of return codes that the parallel runners returned before:
+    len(batch), iterating, batch[idx] (an int) and batch == [0, 0, 0] work on the return codes.
+    The columns are the arrays codes (int32), start (s since the epoch, NaN if unknown), rungs (int8, rung of the retry ladder that rescued the simulation, -1 if none)
+    and the resource usage USAGE_COLUMNS (float32 for the times and float64 for the BYTE_COLUMNS, NaN if unknown).
+
+    Parameters
+    ----------
+    codes : List or array
+        Return code of each simulation, None for simulations that did not run (stored as -1)
+    messages : List or dict, optional
+        Message of each simulation, or a dict with the message by index, empty messages are not stored, by default None
+    usage : List, optional
+        Resource usage of each simulation (dict, see get_resource_usage, or None), by default None
+    start : List or array, optional
+        Start time of each simulation in s since the epoch, by default None
+    sim_type : string or List, optional
+        Which type of simulation was run: simss or zimt, or a list with the type of each simulation for a mixed batch (see run_simulation_batch), needed for the output files, by default None
+    cmd_pars_list : List, optional
+        Parameters of each simulation, needed for the output files, by default None
+    session_path : string or List, optional
+        File path of the simss or zimt executable, or a list with the path of each simulation for a mixed batch, needed for the output files, by default None
+    rungs : List or array, optional
+        Rung of the retry ladder that rescued each simulation, None or -1 if none, by default None
+    """
+    __slots__ = ['codes', 'start', 'rungs', 'messages', 'sim_type', 'cmd_pars_list', 'session_path', 'index'] + USAGE_COLUMNS
+
+    def __init__(self, codes, messages = None, usage = None, start = None, sim_type = None, cmd_pars_list = None, session_path = None, rungs = None):
+        self.codes = np.asarray([-1 if code is None else code for code in codes], dtype = np.int32)
+        n_jobs = len(self.codes)
+        if isinstance(messages, dict):
+            self.messages = {int(idx): msg for idx, msg in messages.items() if msg}
+        else:
+            self.messages = {idx: msg for idx, msg in enumerate(messages or []) if msg}
+        self.start = np.full(n_jobs, np.nan) if start is None else np.asarray(start, dtype = float)
+        self.rungs = np.full(n_jobs, -1, dtype = np.int8) if rungs is None else np.asarray([-1 if rung is None else rung for rung in rungs], dtype = np.int8)
+        for column in USAGE_COLUMNS:
+            setattr(self, column, np.full(n_jobs, np.nan, dtype = np.float64 if column in BYTE_COLUMNS else np.float32))
+        if usage is not None:
+            for idx, job_usage in enumerate(usage):
+                if job_usage is not None:
+                    for column in USAGE_COLUMNS:
+                        if column in job_usage:
+                            getattr(self, column)[idx] = job_usage[column]
+        self.sim_type = sim_type
+        self.cmd_pars_list = cmd_pars_list
+        self.session_path = session_path
+        self.index = None # Position of each simulation in the original batch, set by take
+
+    @classmethod
+    def from_results(cls, results, sim_type = None, cmd_pars_list = None, session_path = None):
+        """Make a BatchResult from a list of SimulationResult (or (returncode, message) tuples).
+
+        Parameters
+        ----------
+        results : List
+            Result of each simulation
+        sim_type, cmd_pars_list, session_path : optional
+            See BatchResult, needed for the output files
+
+        Returns
+        -------
+        BatchResult
+            Result of the batch
+        """
+        codes, messages, usage, start, rungs = [], [], [], [], []
+        for result in results:
+            code, message = result
+            codes.append(code)
+            messages.append(message)
+            usage.append(getattr(result, 'usage', None))
+            timing = getattr(result, 'timing', None)
+            start.append(np.nan if timing is None else timing['start'])
+            rungs.append(getattr(result, 'rung', None))
+        return cls(codes, messages, usage, start, sim_type, cmd_pars_list, session_path, rungs)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return iter(self.codes.tolist())
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return int(self.codes[idx])
+        return self.take(np.arange(len(self.codes))[idx])
+
+    def __eq__(self, other):
+        if isinstance(other, BatchResult):
+            return np.array_equal(self.codes, other.codes)
+        if isinstance(other, (list, tuple)):
+            return self.codes.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'BatchResult(n_jobs={}, codes={})'.format(len(self.codes), self.counts())
+
+    def tolist(self):
+        """Return codes as a list of ints"""
+        return self.codes.tolist()
+
+    @property
+    def succeeded(self):
+        """Boolean array, True for the simulations that did not fail, i.e. with a return code in SUCCESS_CODES"""
+        return np.isin(self.codes, SUCCESS_CODES)
+
+    @property
+    def overall_code(self):
+        """Overall return code of the batch, see get_overall_return_code"""
+        return get_overall_return_code(self.codes, verbose = False)
+
+    def counts(self):
+        """Number of simulations for each return code.
+
+        Returns
+        -------
+        dict
+            Number of simulations by return code
+        """
+        codes, counts = np.unique(self.codes, return_counts = True)
+        return dict(zip(codes.tolist(), counts.tolist()))
+
+    def where(self, codes = None, failed = None):
+        """Get the indices of the simulations with one of the given return codes.
+
+        Parameters
+        ----------
+        codes : int or List, optional
+            Return code(s) to select, by default None (all)
+        failed : bool, optional
+            If True, only select the simulations that failed, if False, only the ones that succeeded (see SUCCESS_CODES), by default None (all)
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the selected simulations
+        """
+        mask = np.ones(len(self.codes), dtype = bool)
+        if codes is not None:
+            mask &= np.isin(self.codes, np.atleast_1d(codes))
+        if failed is not None:
+            mask &= ~self.succeeded if failed else self.succeeded
+        return np.flatnonzero(mask)
+
+    def filter(self, codes = None, failed = None):
+        """Get the result of the simulations with one of the given return codes, see where.
+
+        Returns
+        -------
+        BatchResult
+            Result of the selected simulations, its index attribute holds their positions in this batch
+        """
+        return self.take(self.where(codes, failed))
+
+    def take(self, indices):
+        """Get the result of a subset of the simulations.
+
+        Parameters
+        ----------
+        indices : array
+            Indices of the simulations in this batch
+
+        Returns
+        -------
+        BatchResult
+            Result of the selected simulations, its index attribute holds their positions in this batch
+        """
+        indices = np.asarray(indices, dtype = int)
+        subset = BatchResult.__new__(BatchResult)
+        subset.codes = self.codes[indices]
+        subset.start = self.start[indices]
+        subset.rungs = self.rungs[indices]
+        for column in USAGE_COLUMNS:
+            setattr(subset, column, getattr(self, column)[indices])
+        positions = {int(idx): pos for pos, idx in enumerate(indices)}
+        subset.messages = {positions[idx]: msg for idx, msg in self.messages.items() if idx in positions}
+        subset.sim_type = [self.sim_type[idx] for idx in indices] if isinstance(self.sim_type, list) else self.sim_type
+        subset.cmd_pars_list = None if self.cmd_pars_list is None else [self.cmd_pars_list[idx] for idx in indices]
+        subset.session_path = [self.session_path[idx] for idx in indices] if isinstance(self.session_path, list) else self.session_path
+        subset.index = indices if self.index is None else self.index[indices]
+        return subset
+
+    def update(self, indices, results):
+        """Set the result of a subset of the simulations, e.g. after running them again.
+
+        Parameters
+        ----------
+        indices : List
+            Indices of the simulations in this batch
+        results : BatchResult or List
+            Result of each of these simulations, a list only sets the return codes
+        """
+        indices = np.asarray(indices, dtype = int)
+        if len(indices) == 0:
+            return
+        if not isinstance(results, BatchResult):
+            self.codes[indices] = list(results)
+            return
+        self.codes[indices] = results.codes
+        self.start[indices] = results.start
+        self.rungs[indices] = results.rungs
+        for column in USAGE_COLUMNS:
+            getattr(self, column)[indices] = getattr(results, column)
+        for pos, idx in enumerate(indices.tolist()):
+            self.messages.pop(idx, None)
+            if pos in results.messages:
+                self.messages[idx] = results.messages[pos]
+
+    def message(self, idx):
+        """Message of simulation idx, empty if it has none"""
+        return self.messages.get(int(idx), '')
+
+    def output_source(self, idx):
+        """(sim_type, cmd_pars, session_path) of simulation idx, from which its output files are derived. None if the cmd_pars are not known"""
+        if self.cmd_pars_list is None or self.sim_type is None:
+            return None
+        sim_type = self.sim_type[idx] if isinstance(self.sim_type, list) else self.sim_type
+        session_path = self.session_path[idx] if isinstance(self.session_path, list) else self.session_path
+        return sim_type, self.cmd_pars_list[idx], session_path
+
+    def output_files(self, idx):
+        """Paths of the output files of simulation idx, see get_output_files. Empty if the cmd_pars are not known"""
+        output_source = self.output_source(idx)
+        if output_source is None:
+            return {}
+        return get_output_files(*output_source)
+
+    def result(self, idx):
+        """Get the result of simulation idx as a SimulationResult.
+
+        Parameters
+        ----------
+        idx : int
+            Index of the simulation in this batch
+
+        Returns
+        -------
+        SimulationResult
+            Result of the simulation
+        """
+        usage = {column: float(getattr(self, column)[idx]) for column in USAGE_COLUMNS if not np.isnan(getattr(self, column)[idx])}
+        timing = None
+        if not np.isnan(self.start[idx]) and 'wall' in usage:
+            timing = {'start': float(self.start[idx]), 'end': float(self.start[idx]) + usage['wall'], 'wall': usage['wall']}
+        output_source = self.output_source(idx)
+        rung = int(self.rungs[idx]) if self.rungs[idx] >= 0 else None
+        return SimulationResult(self.codes[idx], self.message(idx), timing = timing, usage = usage or None, output_source = output_source, rung = rung)
+
+    def to_dataframe(self):
+        """Get the result of the batch as a DataFrame with one row per simulation and the columns code, start, rung, the resource usage and message.
+        A mixed batch also has the column sim_type.
+
+        Returns
+        -------
+        DataFrame
+            Result of the batch
+        """
+        data = {'code': self.codes, 'start': self.start, 'rung': self.rungs}
+        data.update({column: getattr(self, column) for column in USAGE_COLUMNS})
+        df = pd.DataFrame(data, index = self.index)
+        df['message'] = [self.message(idx) for idx in range(len(self.codes))]
+        if isinstance(self.sim_type, list):
+            df['sim_type'] = self.sim_type
+        return df
@@ -0,0 +1,431 @@
+"""Functions to record the runtime of SIMsalabim simulations and to predict the runtime of new simulations and experiments"""
+######### Package Imports #########################################################################
+
+import os, json, sqlite3, socket, time, inspect, heapq
+import numpy as np
+import pandas as pd
+from pySIMsalabim.utils.device_parameters import read_devpar_file_cached
+
+######### Constants ###############################################################################
+
+FEATURE_SECTIONS = ['Numerical Parameters', 'Voltage range of simulation'] # Sections of the simulation setup file of which the numerical parameters are used as features
+MIN_RECORDS_PER_FEATURE = 2 # Number of records per feature needed to fit the regression model, otherwise the median runtime is used
+
+######### Function Definitions ####################################################################
+
+def to_number(val):
+    """Convert a parameter value to a float.
+
+    Parameters
+    ----------
+    val : any
+        Value of the parameter
+
+    Returns
+    -------
+    float or None
+        The value as float, None if it is not a number
+    """
+    if isinstance(val, bool):
+        return float(val)
+    try:
+        val = float(val)
+    except (TypeError, ValueError):
+        return None
+    return val if np.isfinite(val) else None
+
+def get_runtime_features(sim_type, cmd_pars, session_path):
+    """Get the features of a simulation that determine its runtime: the numerical and voltage range parameters of the simulation setup file,
+    the number of layers, the total thickness, G_frac and, for zimt, the number of rows in the tVG file. The command line parameters take precedence over the files.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    dict
+        Value of each feature
+    """
+    cmd_values = {cmd_par['par']: cmd_par['val'] for cmd_par in cmd_pars}
+    features = {}
+    if 'dev_par_file' not in cmd_values:
+        return features
+
+    setup_par = read_devpar_file_cached(os.path.join(session_path, cmd_values['dev_par_file']))
+    setup_values, layer_files = {}, {}
+    for section in setup_par[1:]:
+        for param in section[1:]:
+            if param[0] != 'par':
+                continue
+            setup_values[param[1]] = param[2]
+            if section[0] in FEATURE_SECTIONS and to_number(param[2]) is not None:
+                features[param[1]] = to_number(cmd_values.get(param[1], param[2]))
+            if section[0] == 'Layers':
+                layer_files[param[1]] = param[2]
+
+    # Layers and the total thickness
+    thickness = 0
+    for layer, layer_file in layer_files.items():
+        layer_file = cmd_values.get(layer, layer_file)
+        try:
+            layer_par = read_devpar_file_cached(os.path.join(session_path, layer_file))
+        except OSError:
+            continue
+        for section in layer_par[1:]:
+            for param in section[1:]:
+                if param[0] == 'par' and param[1] == 'L':
+                    thickness += to_number(cmd_values.get(layer + '.L', param[2])) or 0
+    features['n_layers'] = len(layer_files)
+    features['L'] = thickness
+    features['G_frac'] = to_number(cmd_values.get('G_frac', setup_values.get('G_frac', 1)))
+
+    if sim_type.lower() == 'zimt':
+        tVG_file = cmd_values.get('tVGFile', setup_values.get('tVGFile'))
+        try:
+            with open(os.path.join(session_path, tVG_file)) as fp:
+                # Minus the header line
+                features['n_tVG'] = max(0, sum(1 for line in fp if line.strip() != '') - 1)
+        except (OSError, TypeError):
+            pass
+    return {name: val for name, val in features.items() if val is not None}
+
+def get_experiment_features(experiment, *args, **kwargs):
+    """Get the features of an experiment: its numerical arguments and the length of its list arguments, e.g. the number of frequencies or G_fracs.
+    The simulation setup file (first argument) and session path (second argument) are used for the features of the device, see get_runtime_features.
+
+    Parameters
+    ----------
+    experiment : function
+        Experiment function, e.g. run_impedance_simu, called as experiment(device_parameters, session_path, *args, **kwargs)
+    *args : list
+        Positional arguments of the experiment, starting with the simulation setup file and the session path
+    **kwargs : dict
+        Keyword arguments of the experiment
+
+    Returns
+    -------
+    dict
+        Value of each feature
+    """
+    try:
+        bound = inspect.signature(experiment).bind_partial(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+    except TypeError:
+        arguments = dict(enumerate(args))
+        arguments.update(kwargs)
+    arguments.update(arguments.pop('kwargs', {}) or {})
+
+    features = {}
+    if len(args) >= 2:
+        try:
+            features.update(get_runtime_features('simss', [{'par': 'dev_par_file', 'val': args[0]}], args[1]))
+        except (OSError, ValueError, IndexError):
+            pass
+    for name, val in arguments.items():
+        if isinstance(val, (list, tuple, np.ndarray)):
+            features['len_' + str(name)] = float(len(val))
+        elif to_number(val) is not None and not isinstance(val, str):
+            features[str(name)] = to_number(val)
+    return features
+
+def open_runtime_history(history_file):
+    """Open the runtime history and create the runs table if it does not exist yet.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the runtime history
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(history_file)), exist_ok = True)
+    con = sqlite3.connect(history_file, timeout = 60)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS runs (
+                    time REAL,
+                    job_type TEXT,
+                    returncode INTEGER,
+                    wall REAL,
+                    host TEXT,
+                    features TEXT)''')
+    con.execute('CREATE INDEX IF NOT EXISTS runs_job_type ON runs (job_type)')
+    con.commit()
+    return con
+
+def record_runtime(history_file, job_type, returncode, wall, features):
+    """Add a run to the runtime history. Errors are printed as a warning, so the simulation itself never fails on the history.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    job_type : string
+        Type of the job: simss, zimt or the name of an experiment function
+    returncode : int
+        Return code of the run
+    wall : float
+        Wall time of the run in s
+    features : dict
+        Features of the run, see get_runtime_features and get_experiment_features
+    """
+    try:
+        con = open_runtime_history(history_file)
+        try:
+            with con:
+                con.execute('INSERT INTO runs (time, job_type, returncode, wall, host, features) VALUES (?, ?, ?, ?, ?, ?)',
+                            (time.time(), job_type.lower(), int(returncode), float(wall), socket.gethostname(), json.dumps(features)))
+        finally:
+            con.close()
+    except (sqlite3.Error, OSError) as e:
+        print('Warning: could not record the runtime in ' + str(history_file) + ': ' + repr(e))
+
+def record_simulation_runtime(history_file, sim_type, cmd_pars, session_path, returncode, wall):
+    """Add a simulation to the runtime history, see record_runtime and get_runtime_features.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    sim_type : string
+        Which type of simulation: simss or zimt
+    cmd_pars : List
+        List with parameters of the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+    session_path : string
+        Folder with the input files of the simulation
+    returncode : int
+        Return code of the simulation
+    wall : float
+        Wall time of the simulation in s
+    """
+    try:
+        features = get_runtime_features(sim_type, cmd_pars, session_path)
+    except (OSError, ValueError, IndexError) as e:
+        print('Warning: could not get the runtime features of the simulation: ' + repr(e))
+        return
+    record_runtime(history_file, sim_type, returncode, wall, features)
+
+def load_runtime_history(history_file, job_type = None):
+    """Load the runs of the runtime history.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    job_type : string, optional
+        Only load the runs of this type: simss, zimt or the name of an experiment function, by default None (all runs)
+
+    Returns
+    -------
+    DataFrame
+        One row per run with the columns time, job_type, returncode, wall and host, and one column per feature
+    """
+    con = open_runtime_history(history_file)
+    try:
+        if job_type is None:
+            rows = con.execute('SELECT time, job_type, returncode, wall, host, features FROM runs').fetchall()
+        else:
+            rows = con.execute('SELECT time, job_type, returncode, wall, host, features FROM runs WHERE job_type = ?', (job_type.lower(),)).fetchall()
+    finally:
+        con.close()
+    df = pd.DataFrame(rows, columns = ['time', 'job_type', 'returncode', 'wall', 'host', 'features'])
+    features = pd.DataFrame([json.loads(val) for val in df['features']], index = df.index)
+    return pd.concat([df.drop(columns = 'features'), features], axis = 1)
+
+def fit_runtime_model(history_file, job_type, ridge = 1e-3):
+    """Fit a model that predicts the runtime of a job from its features: a linear regression (with a small ridge penalty) of the log of the wall time
+    on the log of the features. Only runs that finished with return code 0 or 95 are used. With too few runs, the model predicts the median wall time.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    job_type : string
+        Type of the job: simss, zimt or the name of an experiment function
+    ridge : float, optional
+        Ridge penalty of the regression, by default 1e-3
+
+    Returns
+    -------
+    dict or None
+        Model with the keys features, coef, mean, scale and median (see predict_runtime), None if there are no runs of this type
+    """
+    df = load_runtime_history(history_file, job_type)
+    df = df[df['returncode'].isin([0, 95]) & (df['wall'] > 0)]
+    if len(df) == 0:
+        return None
+    model = {'features': [], 'coef': [float(np.log(df['wall']).median())], 'mean': [], 'scale': [], 'median': float(df['wall'].median()), 'n_runs': len(df)}
+
+    # Only the features that were recorded for all runs and that vary
+    feature_df = df.drop(columns = ['time', 'job_type', 'returncode', 'wall', 'host']).dropna(axis = 1)
+    feature_df = feature_df.loc[:, feature_df.nunique() > 1]
+    if feature_df.shape[1] == 0 or len(df) < MIN_RECORDS_PER_FEATURE * (feature_df.shape[1] + 1):
+        return model
+
+    X = np.log1p(np.abs(feature_df.to_numpy(dtype = float)))
+    mean, scale = X.mean(axis = 0), X.std(axis = 0)
+    X = (X - mean) / scale
+    X = np.hstack([np.ones((len(X), 1)), X])
+    y = np.log(df['wall'].to_numpy(dtype = float))
+    # Ridge regression, the intercept is not penalized
+    penalty = ridge * np.eye(X.shape[1])
+    penalty[0, 0] = 0
+    coef = np.linalg.solve(X.T @ X + penalty, X.T @ y)
+
+    model.update({'features': list(feature_df.columns), 'coef': coef.tolist(), 'mean': mean.tolist(), 'scale': scale.tolist()})
+    return model
+
+def predict_runtime(model, features):
+    """Predict the runtime of a job with a model from fit_runtime_model.
+
+    Parameters
+    ----------
+    model : dict
+        Model, see fit_runtime_model
+    features : dict
+        Features of the job, see get_runtime_features and get_experiment_features
+
+    Returns
+    -------
+    float or None
+        Predicted wall time in s, None if there is no model
+    """
+    if model is None:
+        return None
+    if len(model['features']) == 0 or any(name not in features for name in model['features']):
+        return model['median']
+    x = np.log1p(np.abs(np.array([features[name] for name in model['features']], dtype = float)))
+    x = (x - np.array(model['mean'])) / np.array(model['scale'])
+    return float(np.exp(model['coef'][0] + np.dot(model['coef'][1:], x)))
+
+def get_runtime_cost_function(history_file, sim_type, session_path):
+    """Get a function that predicts the runtime of a simulation from its cmd_pars, e.g. for the job_costs option of run_simulation_parallel.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    sim_type : string
+        Which type of simulation: simss or zimt
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    function
+        Function that returns the predicted wall time in s for the cmd_pars of a simulation, or None if it cannot be predicted
+    """
+    model = fit_runtime_model(history_file, sim_type)
+    def cost(cmd_pars):
+        try:
+            return predict_runtime(model, get_runtime_features(sim_type, cmd_pars, session_path))
+        except (OSError, ValueError, IndexError):
+            return None
+    return cost
+
+def estimate_simulation_runtime(history_file, sim_type, cmd_pars_list, session_path, max_jobs = 1):
+    """Estimate the runtime of a batch of simulations before running it, e.g. to reserve resources or to show an ETA.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    sim_type : string
+        Which type of simulation: simss or zimt
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+    session_path : string
+        File path of the simss or zimt executable
+    max_jobs : int, optional
+        Number of parallel jobs, by default 1
+
+    Returns
+    -------
+    dict
+        Estimates with the keys 'per_job' (wall time in s of each simulation, None if unknown), 'total' (sum of the known wall times in s)
+        and 'makespan' (wall time in s of the batch on max_jobs parallel jobs in order of decreasing cost, see get_makespan)
+    """
+    cost = get_runtime_cost_function(history_file, sim_type, session_path)
+    per_job = [cost(cmd_pars) for cmd_pars in cmd_pars_list]
+    return {'per_job': per_job, 'total': sum(val for val in per_job if val is not None), 'makespan': get_makespan(per_job, max_jobs)}
+
+def estimate_experiment_runtime(history_file, experiment, *args, **kwargs):
+    """Estimate the runtime of an experiment before running it, from earlier runs recorded with run_experiment_recorded.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    experiment : function
+        Experiment function, e.g. run_impedance_simu, run_CV_simu or run_EQE
+    *args : list
+        Positional arguments of the experiment, starting with the simulation setup file and the session path
+    **kwargs : dict
+        Keyword arguments of the experiment
+
+    Returns
+    -------
+    float or None
+        Predicted wall time in s, None if the experiment has not been recorded before
+    """
+    model = fit_runtime_model(history_file, experiment.__name__)
+    return predict_runtime(model, get_experiment_features(experiment, *args, **kwargs))
+
+def run_experiment_recorded(history_file, experiment, *args, **kwargs):
+    """Run an experiment and add its runtime to the runtime history, so the runtime of later runs can be estimated with estimate_experiment_runtime.
+
+    Parameters
+    ----------
+    history_file : string
+        Path of the SQLite database file of the runtime history
+    experiment : function
+        Experiment function, e.g. run_impedance_simu, run_CV_simu or run_EQE. It must return (returncode, message)
+    *args : list
+        Positional arguments of the experiment, starting with the simulation setup file and the session path
+    **kwargs : dict
+        Keyword arguments of the experiment
+
+    Returns
+    -------
+    tuple
+        Return value of the experiment
+    """
+    features = get_experiment_features(experiment, *args, **kwargs)
+    start = time.perf_counter()
+    output = experiment(*args, **kwargs)
+    wall = time.perf_counter() - start
+    returncode = output[0] if isinstance(output, tuple) else output
+    record_runtime(history_file, experiment.__name__, returncode, wall, features)
+    return output
+
+def get_makespan(costs, max_jobs = 1):
+    """Get the total wall time of running jobs with the given costs on max_jobs parallel jobs, in order of decreasing cost.
+    Jobs with an unknown cost (None) are not counted.
+
+    Parameters
+    ----------
+    costs : List
+        Wall time of each job in s
+    max_jobs : int, optional
+        Number of parallel jobs, by default 1
+
+    Returns
+    -------
+    float
+        Total wall time in s
+    """
+    slots = [0.0] * max(1, int(max_jobs))
+    for cost in sorted((val for val in costs if val is not None), reverse = True):
+        # The next job starts on the first free slot
+        heapq.heapreplace(slots, slots[0] + cost)
+    return max(slots)
@@ -0,0 +1,346 @@
+"""Functions to cache the results of SIMsalabim simulations on disk"""
+######### Package Imports #########################################################################
+
+import os, json, shutil, uuid, time, hashlib, threading
+from collections import OrderedDict
+from pySIMsalabim.utils.device_parameters import get_input_files, get_output_files
+from pySIMsalabim.utils.results import SimulationResult, BatchResult
+
+######### Constants ###############################################################################
+
+CACHEABLE_RETURN_CODES = [0, 95] # Only simulations that produced their output are cached
+FILE_HASH_CACHE_SIZE = 4096 # Maximum number of file hashes kept in memory, the least recently used are dropped
+file_hash_cache = OrderedDict() # Hash of each file, keyed on (path, size, modification time) to avoid hashing unchanged files again
+file_hash_cache_lock = threading.Lock()
+
+######### Function Definitions ####################################################################
+
+def get_file_hash(file):
+    """Get the SHA-256 hash of the content of a file. The hash is kept in memory as long as the size and modification time of the file do not change, 
+    for at most FILE_HASH_CACHE_SIZE files (least recently used first out).
+
+    Parameters
+    ----------
+    file : string
+        Path of the file
+
+    Returns
+    -------
+    string
+        Hexadecimal SHA-256 hash of the file
+    """
+    stat = os.stat(file)
+    stat_key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    with file_hash_cache_lock:
+        file_hash = file_hash_cache.get(stat_key)
+        if file_hash is not None:
+            file_hash_cache.move_to_end(stat_key)
+            return file_hash
+    # Hash outside the lock, so the other threads do not wait for large files
+    sha = hashlib.sha256()
+    with open(file, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+    file_hash = sha.hexdigest()
+    with file_hash_cache_lock:
+        file_hash_cache[stat_key] = file_hash
+        if len(file_hash_cache) > FILE_HASH_CACHE_SIZE:
+            file_hash_cache.popitem(last = False)
+    return file_hash
+
+def get_simulation_key(sim_type, cmd_pars, session_path):
+    """Get the cache key of a simulation. The key is a hash of the executable, the content of all input files (see get_input_files)
+    and the effective command line parameters. The names of the output files do not change the key, only whether they are written.
+
+    Parameters
+    ----------
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    string
+        Hexadecimal cache key of the simulation
+    """
+    output_pars = ['JVFile', 'scParsFile', 'tJFile', 'varFile', 'logFile']
+    if os.name == 'nt':
+        exe = os.path.join(session_path, sim_type.lower()+'.exe')
+    else:
+        exe = os.path.join(session_path, sim_type.lower())
+
+    sha = hashlib.sha256()
+    sha.update(sim_type.lower().encode())
+    sha.update(get_file_hash(exe).encode())
+    # The content of the input files matters, not their names (those are part of the cmd_pars or the setup file)
+    for file_hash in sorted(get_file_hash(file) for file in get_input_files(sim_type, cmd_pars, session_path)):
+        sha.update(file_hash.encode())
+    for cmd_par in cmd_pars:
+        val = str(cmd_par['val'])
+        if cmd_par['par'] in output_pars and val.lower() != 'none':
+            val = 'file'
+        sha.update(('-'+cmd_par['par']+'='+val+'\n').encode())
+    return sha.hexdigest()
+
+def load_cached_result(cache_dir, key, sim_type, cmd_pars, session_path, run_mode = False):
+    """Restore the output files of a cached simulation to the paths requested in the cmd_pars.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Folder of the cache
+    key : string
+        Cache key of the simulation, see get_simulation_key
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+    session_path : string
+        File path of the simss or zimt executable
+    run_mode : boolean
+        True if function is called as part of The Shell, False when called directly. Used to return the message of the cached simulation.
+
+    Returns
+    -------
+    tuple or None
+        (returncode, message) of the cached simulation, None if the simulation is not in the cache
+    """
+    entry = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as fp:
+            meta = json.load(fp)
+        output_files = get_output_files(sim_type, cmd_pars, session_path)
+        if not set(output_files).issubset(meta['requested']):
+            # The cached simulation was run without some of the output files that are requested now
+            return None
+        for par_name, path in output_files.items():
+            if par_name in meta['files']:
+                shutil.copyfile(os.path.join(entry, par_name), path)
+        # Mark the entry as recently used for the eviction
+        os.utime(entry)
+    except (OSError, ValueError, KeyError):
+        # Not in the cache, or evicted while reading
+        return None
+
+    message = meta['message'] if run_mode else ''
+    return meta['returncode'], message
+
+def store_cached_result(cache_dir, key, returncode, message, sim_type, cmd_pars, session_path):
+    """Store the output files of a finished simulation in the cache. The entry is written to a temporary folder first and then renamed,
+    so other processes never see an incomplete entry. Only simulations with a return code in CACHEABLE_RETURN_CODES are stored.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Folder of the cache
+    key : string
+        Cache key of the simulation, see get_simulation_key
+    returncode : int
+        Return code of the simulation
+    message : string
+        Return message of the simulation
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+    session_path : string
+        File path of the simss or zimt executable
+
+    Returns
+    -------
+    bool
+        True if the simulation was stored in the cache
+    """
+    entry = os.path.join(cache_dir, key)
+    if returncode not in CACHEABLE_RETURN_CODES or os.path.isdir(entry):
+        return False
+
+    tmp_entry = os.path.join(cache_dir, 'tmp_'+str(uuid.uuid4()))
+    os.makedirs(tmp_entry)
+    try:
+        output_files = get_output_files(sim_type, cmd_pars, session_path)
+        files = []
+        for par_name, path in output_files.items():
+            if os.path.isfile(path):
+                shutil.copyfile(path, os.path.join(tmp_entry, par_name))
+                files.append(par_name)
+        meta = {'sim_type': sim_type.lower(), 'returncode': returncode, 'message': message, 'requested': list(output_files), 'files': files, 'created': time.time()}
+        with open(os.path.join(tmp_entry, 'meta.json'), 'w', encoding='utf-8') as fp:
+            json.dump(meta, fp)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another process stored the same simulation first
+        shutil.rmtree(tmp_entry, ignore_errors = True)
+        return False
+    return True
+
+def evict_cache(cache_dir, max_size = None, max_age = None):
+    """Remove entries from the cache. First all entries that have not been used for longer than max_age are removed,
+    then the least recently used entries until the total size of the cache is at most max_size.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Folder of the cache
+    max_size : int, optional
+        Maximum size of the cache in bytes, by default None (no limit)
+    max_age : float, optional
+        Maximum time in s since an entry was last used, by default None (no limit)
+
+    Returns
+    -------
+    int
+        Number of removed entries
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name.startswith('tmp_') or not os.path.isdir(entry):
+            continue
+        try:
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+        except OSError:
+            continue
+    entries.sort()
+
+    now = time.time()
+    total_size = sum(entry[1] for entry in entries)
+    removed = 0
+    for last_used, size, entry in entries:
+        if (max_age is None or now - last_used <= max_age) and (max_size is None or total_size <= max_size):
+            break
+        # Rename the entry first, so it is never read while it is being removed
+        tmp_entry = os.path.join(cache_dir, 'tmp_'+str(uuid.uuid4()))
+        try:
+            os.rename(entry, tmp_entry)
+        except OSError:
+            continue
+        shutil.rmtree(tmp_entry, ignore_errors = True)
+        total_size -= size
+        removed += 1
+    return removed
+
+def pop_cache_options(kwargs):
+    """Remove the cache options from the keyword arguments of a simulation runner.
+
+    Parameters
+    ----------
+    kwargs : dict
+        Keyword arguments of the simulation runner, the cache options are removed from this dict:
+        cache_dir : string, folder of the cache, by default None (no caching)
+        cache_max_size : int, maximum size of the cache in bytes, by default None
+        cache_max_age : float, maximum time in s since an entry was last used, by default None
+
+    Returns
+    -------
+    tuple
+        cache_dir, cache_max_size and cache_max_age
+    """
+    return kwargs.pop('cache_dir', None), kwargs.pop('cache_max_size', None), kwargs.pop('cache_max_age', None)
+
+def run_simulation_cached(run_func, sim_type, cmd_pars, session_path, run_mode = False, verbose = False, **kwargs):
+    """Run a simulation with run_func, unless the same simulation is in the cache. In that case the output files are restored from the cache
+    and the simulation is not run. After a simulation is run, its output is stored in the cache and the cache is evicted if needed.
+
+    Parameters
+    ----------
+    run_func : function
+        Function to run the simulation, e.g. run_simulation or run_simulation_filesafe
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars : List
+        List with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+        Note: when relevant the first entry must be the deviceparameters file with a key: dev_par_file
+    session_path : string
+        File path of the simss or zimt executable
+    run_mode : boolean
+        True if function is called as part of The Shell, False when called directly.
+    verbose : boolean
+        True if the console output of the simulation should be printed to the console
+    **kwargs : dict
+        Cache options cache_dir, cache_max_size and cache_max_age (see pop_cache_options), the other keyword arguments are passed to run_func
+
+    Returns
+    -------
+    SimulationResult
+        Result of the simulation, without timing and resource usage if it was taken from the cache. It unpacks as (returncode, message)
+    """
+    cache_dir, cache_max_size, cache_max_age = pop_cache_options(kwargs)
+    os.makedirs(cache_dir, exist_ok = True)
+
+    key = get_simulation_key(sim_type, cmd_pars, session_path)
+    cached = load_cached_result(cache_dir, key, sim_type, cmd_pars, session_path, run_mode)
+    if cached is not None:
+        return SimulationResult(cached[0], cached[1], output_source = (sim_type, cmd_pars, session_path))
+
+    sim_result = run_func(sim_type, cmd_pars, session_path, run_mode = run_mode, verbose = verbose, **kwargs)
+    result, message = sim_result
+    if store_cached_result(cache_dir, key, result, message, sim_type, cmd_pars, session_path):
+        if cache_max_size is not None or cache_max_age is not None:
+            evict_cache(cache_dir, cache_max_size, cache_max_age)
+    return sim_result
+
+def run_simulation_parallel_cached(run_func, sim_type, cmd_pars_list, session_path, max_jobs, verbose = False, **kwargs):
+    """Run a list of simulations in parallel with run_func, only the simulations that are not in the cache are run.
+    The output files of the other simulations are restored from the cache.
+
+    Parameters
+    ----------
+    run_func : function
+        Function to run the simulations in parallel, e.g. run_simulation_parallel
+    sim_type : string
+        Which type of simulation to run: simss or zimt
+    cmd_pars_list : List
+        List of list with parameters to add to the simss/zimt cmd line. Each parameter is a dict with par,val keys.
+    session_path : string
+        File path of the simss or zimt executable
+    max_jobs : int
+        Maximum number of parallel jobs to run
+    verbose : bool
+        If True, print the output of the simulation to the console
+    **kwargs : dict
+        Cache options cache_dir, cache_max_size and cache_max_age (see pop_cache_options), the other keyword arguments are passed to run_func
+
+    Returns
+    -------
+    BatchResult
+        Result of each simulation, in the same order as cmd_pars_list. The simulations restored from the cache have no resource usage
+    """
+    cache_dir, cache_max_size, cache_max_age = pop_cache_options(kwargs)
+    os.makedirs(cache_dir, exist_ok = True)
+
+    keys = [get_simulation_key(sim_type, cmd_pars, session_path) for cmd_pars in cmd_pars_list]
+    result_list = [None] * len(cmd_pars_list)
+    idx_run = []
+    for idx, (key, cmd_pars) in enumerate(zip(keys, cmd_pars_list)):
+        cached = load_cached_result(cache_dir, key, sim_type, cmd_pars, session_path)
+        if cached is None:
+            idx_run.append(idx)
+        else:
+            result_list[idx] = cached[0]
+
+    run_results = []
+    if len(idx_run) > 0:
+        if kwargs.get('hooks'):
+            # Report the index in cmd_pars_list to the hooks, imported here as general imports this module
+            from pySIMsalabim.utils.general import remap_hooks
+            kwargs['hooks'] = remap_hooks(kwargs['hooks'], idx_run)
+        run_results = run_func(sim_type, [cmd_pars_list[idx] for idx in idx_run], session_path, max_jobs, verbose, **kwargs)
+        stored = False
+        for idx, result in zip(idx_run, run_results):
+            result_list[idx] = result
+            stored = store_cached_result(cache_dir, keys[idx], result, '', sim_type, cmd_pars_list[idx], session_path) or stored
+        if stored and (cache_max_size is not None or cache_max_age is not None):
+            evict_cache(cache_dir, cache_max_size, cache_max_age)
+
+    batch = BatchResult(result_list, sim_type = sim_type, cmd_pars_list = cmd_pars_list, session_path = session_path)
+    batch.update(idx_run, run_results)
+    return batch
@@ -43,5 +43,10 @@ setuptools.setup(
         ],
     },
     include_package_data=True,
+    entry_points = {
+        'console_scripts': [
+            'pySIMsalabim=pySIMsalabim.__main__:main',
+        ],
+    },
         
 )
\ No newline at end of file